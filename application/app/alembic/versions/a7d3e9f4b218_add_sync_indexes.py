@@ -0,0 +1,37 @@
+"""add sync indexes
+
+Revision ID: a7d3e9f4b218
+Revises: f2c6d81a9e37
+Create Date: 2026-10-19 17:41:05.917342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9f4b218'
+down_revision = 'f2c6d81a9e37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A sync ORs the three date columns, each served by its own index and combined in a bitmap scan
+    op.create_index('ix_Meal_user_id_date_modified', 'Meal', ['user_id', 'date_modified'], unique=False)
+    op.create_index('ix_Meal_user_id_date_deleted', 'Meal', ['user_id', 'date_deleted'], unique=False)
+    op.create_index('ix_HealthRecord_user_id_date_modified', 'HealthRecord', ['user_id', 'date_modified'], unique=False)
+    op.create_index('ix_HealthRecord_user_id_date_deleted', 'HealthRecord', ['user_id', 'date_deleted'], unique=False)
+    op.create_index('ix_FoodItem_date_created', 'FoodItem', ['date_created'], unique=False)
+    op.create_index('ix_FoodItem_date_modified', 'FoodItem', ['date_modified'], unique=False)
+    op.create_index('ix_FoodItem_date_deleted', 'FoodItem', ['date_deleted'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_FoodItem_date_deleted', table_name='FoodItem')
+    op.drop_index('ix_FoodItem_date_modified', table_name='FoodItem')
+    op.drop_index('ix_FoodItem_date_created', table_name='FoodItem')
+    op.drop_index('ix_HealthRecord_user_id_date_deleted', table_name='HealthRecord')
+    op.drop_index('ix_HealthRecord_user_id_date_modified', table_name='HealthRecord')
+    op.drop_index('ix_Meal_user_id_date_deleted', table_name='Meal')
+    op.drop_index('ix_Meal_user_id_date_modified', table_name='Meal')
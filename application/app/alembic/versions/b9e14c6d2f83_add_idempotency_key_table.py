@@ -0,0 +1,35 @@
+"""add idempotency key table
+
+Revision ID: b9e14c6d2f83
+Revises: a7d3e9f4b218
+Create Date: 2026-10-19 18:22:47.105388
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e14c6d2f83'
+down_revision = 'a7d3e9f4b218'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('IdempotencyKey',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('idempotency_key', sa.String(), nullable=False),
+    sa.Column('endpoint', sa.String(), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=False),
+    sa.Column('response', sa.String(), nullable=True),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['User.user_id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'idempotency_key')
+    )
+    op.create_index(op.f('ix_IdempotencyKey_date_created'), 'IdempotencyKey', ['date_created'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_IdempotencyKey_date_created'), table_name='IdempotencyKey')
+    op.drop_table('IdempotencyKey')
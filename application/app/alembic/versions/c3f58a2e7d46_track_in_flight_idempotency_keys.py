@@ -0,0 +1,27 @@
+"""track in flight idempotency keys
+
+Revision ID: c3f58a2e7d46
+Revises: b9e14c6d2f83
+Create Date: 2026-10-19 19:03:31.662014
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f58a2e7d46'
+down_revision = 'b9e14c6d2f83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('IdempotencyKey', sa.Column('request_hash', sa.String(), nullable=True))
+    op.alter_column('IdempotencyKey', 'status_code', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade():
+    op.execute('DELETE FROM "IdempotencyKey" WHERE status_code IS NULL')
+    op.alter_column('IdempotencyKey', 'status_code', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('IdempotencyKey', 'request_hash')
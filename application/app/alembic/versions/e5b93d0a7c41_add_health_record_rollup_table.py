@@ -0,0 +1,71 @@
+"""add health record rollup table
+
+Revision ID: e5b93d0a7c41
+Revises: c4a8e17f3b25
+Create Date: 2026-10-19 16:12:40.281934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b93d0a7c41'
+down_revision = 'c4a8e17f3b25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_HealthRecord_user_id_date_created', 'HealthRecord', ['user_id', 'date_created'], unique=False)
+
+    # Partitioned by resolution, a chart query only reads the partition of its resolution
+    op.execute('''
+        CREATE TABLE "HealthRecordRollup" (
+            user_id INTEGER NOT NULL REFERENCES "User" (user_id),
+            metric VARCHAR NOT NULL,
+            resolution VARCHAR NOT NULL,
+            period_start TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            minimum FLOAT NOT NULL,
+            maximum FLOAT NOT NULL,
+            total FLOAT NOT NULL,
+            count INTEGER NOT NULL,
+            last FLOAT NOT NULL,
+            last_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (user_id, metric, resolution, period_start)
+        ) PARTITION BY LIST (resolution)
+    ''')
+    for resolution in ('day', 'week', 'month'):
+        op.execute(f'''CREATE TABLE "HealthRecordRollup_{resolution}" PARTITION OF "HealthRecordRollup" FOR VALUES IN ('{resolution}')''')
+
+    # Backfill from the existing records, periods are truncated like health_series.get_period_start
+    op.execute('''
+        INSERT INTO "HealthRecordRollup"
+        SELECT
+            record.user_id,
+            metric.name,
+            resolution.name,
+            date_trunc(resolution.name, record.date_created),
+            min(metric.value),
+            max(metric.value),
+            sum(metric.value),
+            count(metric.value),
+            (array_agg(metric.value ORDER BY record.date_created DESC))[1],
+            max(record.date_created)
+        FROM "HealthRecord" record
+        CROSS JOIN LATERAL (VALUES
+            ('weight', record.weight),
+            ('systolic_pressure', record.systolic_pressure),
+            ('fasting_blood_glucose', record.fasting_blood_glucose),
+            ('hdl_cholesterol', record.hdl_cholesterol),
+            ('triglycerides', record.triglycerides)
+        ) AS metric (name, value)
+        CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS resolution (name)
+        WHERE record.date_deleted IS NULL AND record.date_created IS NOT NULL AND metric.value IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TABLE "HealthRecordRollup"')
+    op.drop_index('ix_HealthRecord_user_id_date_created', table_name='HealthRecord')
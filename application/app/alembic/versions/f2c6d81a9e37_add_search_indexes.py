@@ -0,0 +1,36 @@
+"""add search indexes
+
+Revision ID: f2c6d81a9e37
+Revises: e5b93d0a7c41
+Create Date: 2026-10-19 17:04:12.538210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6d81a9e37'
+down_revision = 'e5b93d0a7c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Meal_user_id_date_created', 'Meal', ['user_id', 'date_created'], unique=False)
+
+    # Trigram indexes serve the ILIKE '%query%' substring matches, tsvector indexes the full-text matches,
+    # the expressions must stay identical to crud.get_name_search_condition for the planner to use them
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX "ix_Food_food_name_trgm" ON "Food" USING gin (food_name gin_trgm_ops)')
+    op.execute('CREATE INDEX "ix_FoodItem_new_food_type_trgm" ON "FoodItem" USING gin (new_food_type gin_trgm_ops)')
+    op.execute('''CREATE INDEX "ix_Food_food_name_tsvector" ON "Food" USING gin (to_tsvector('simple', food_name))''')
+    op.execute('''CREATE INDEX "ix_FoodItem_new_food_type_tsvector" ON "FoodItem" USING gin (to_tsvector('simple', new_food_type))''')
+
+
+def downgrade():
+    op.drop_index('ix_FoodItem_new_food_type_tsvector', table_name='FoodItem')
+    op.drop_index('ix_Food_food_name_tsvector', table_name='Food')
+    op.drop_index('ix_FoodItem_new_food_type_trgm', table_name='FoodItem')
+    op.drop_index('ix_Food_food_name_trgm', table_name='Food')
+    op.drop_index('ix_Meal_user_id_date_created', table_name='Meal')
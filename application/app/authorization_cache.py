@@ -0,0 +1,77 @@
+# authorization_cache.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import time
+import threading
+from collections import OrderedDict
+from app import notifications
+
+# Postgres channel notified with the clinician id when one of their assignments changes
+ASSIGNMENT_CHANNEL = 'clinician_assignment_changed'
+
+
+class ClinicianAuthorizationCache:
+	'''
+	Set of accepted patient ids per clinician, loaded once per clinician by crud.get_accepted_patient_ids.
+
+	Entries are invalidated by the crud functions changing assignments, in every worker through
+	a NOTIFY on the clinician_assignment_changed channel, and expire after ttl seconds in case a
+	notification was missed.
+	'''
+
+	def __init__(self, ttl: float = 300, max_clinicians: int = 10000):
+		self.ttl = ttl
+		self.max_clinicians = max_clinicians
+		self.__entries = OrderedDict()
+		self.__lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+		# Incremented on every invalidation, sets of ids loaded before an invalidation are discarded
+		self.generation = 0
+
+	def get(self, clinician_id: int):
+		'''
+		Return:
+			Frozenset of accepted patient ids, None if the clinician is not cached
+		'''
+
+		with self.__lock:
+			entry = self.__entries.get(clinician_id)
+			if(entry is None or entry[0] < time.monotonic()):
+				self.misses += 1
+				return None
+
+			self.__entries.move_to_end(clinician_id)
+			self.hits += 1
+			return entry[1]
+
+	def set(self, clinician_id: int, patient_ids, generation: int):
+		patient_ids = frozenset(patient_ids)
+		with self.__lock:
+			if(generation != self.generation):
+				return patient_ids
+			self.__entries[clinician_id] = (time.monotonic() + self.ttl, patient_ids)
+			self.__entries.move_to_end(clinician_id)
+			while(len(self.__entries) > self.max_clinicians):
+				self.__entries.popitem(last=False)
+		return patient_ids
+
+	def invalidate(self, clinician_id: int):
+		with self.__lock:
+			self.generation += 1
+			self.__entries.pop(clinician_id, None)
+
+	def stats(self):
+		with self.__lock:
+			return {'clinicians': len(self.__entries), 'hits': self.hits, 'misses': self.misses}
+
+
+clinician_authorization = ClinicianAuthorizationCache(ttl=float(os.getenv('CLINICIAN_AUTHORIZATION_TTL') or 300))
+
+notifications.listener.subscribe(ASSIGNMENT_CHANNEL, lambda payload: clinician_authorization.invalidate(int(payload)))
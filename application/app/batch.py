@@ -0,0 +1,354 @@
+# batch.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import traceback
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from app import crud, models, schemas, event_hub, idempotency
+from app.nutrition_service import NutritionService, FoodItemDoesNotExistError, NutritionDataRequiredError, ServiceUnavailableError
+
+# Operations accepted by /batch
+CREATE_HEALTH_RECORD = 'create_health_record'
+UPDATE_HEALTH_RECORD = 'update_health_record'
+DELETE_HEALTH_RECORD = 'delete_health_record'
+UPDATE_MEAL_BLOOD_GLUCOSE = 'update_meal_blood_glucose'
+DELETE_MEAL = 'delete_meal'
+CREATE_FOOD_ITEM = 'create_food_item'
+UPDATE_FOOD_ITEM = 'update_food_item'
+DELETE_FOOD_ITEM = 'delete_food_item'
+
+# Schema of the data of each operation, None for operations without data
+OPERATION_SCHEMAS = {
+	CREATE_HEALTH_RECORD: schemas.HealthRecordCreate,
+	UPDATE_HEALTH_RECORD: schemas.HealthRecordUpdate,
+	DELETE_HEALTH_RECORD: None,
+	UPDATE_MEAL_BLOOD_GLUCOSE: schemas.MealUpdateBloodGlucose,
+	DELETE_MEAL: None,
+	CREATE_FOOD_ITEM: schemas.FoodItemCreateUpdate,
+	UPDATE_FOOD_ITEM: schemas.FoodItemCreateUpdate,
+	DELETE_FOOD_ITEM: None,
+}
+
+# Consecutive operations of these types are inserted with one statement
+BULK_OPERATIONS = (CREATE_HEALTH_RECORD, CREATE_FOOD_ITEM)
+
+# Largest batch accepted
+BATCH_MAX_OPERATIONS = int(os.getenv('BATCH_MAX_OPERATIONS') or 500)
+
+# Endpoint recorded with the idempotency keys of batch operations
+IDEMPOTENCY_ENDPOINT = 'POST /batch'
+
+
+class OperationError(Exception):
+	def __init__(self, status_code: int, detail: str):
+		super().__init__(detail)
+		self.status_code = status_code
+		self.detail = detail
+
+
+class PendingOperation:
+	# An operation of the batch, result is set once it has been executed, replayed or rejected
+	def __init__(self, operation: schemas.BatchOperation):
+		self.operation = operation.operation
+		self.id = operation.id
+		self.idempotency_key = operation.idempotency_key
+		self.raw_data = operation.data
+		self.data = None
+		self.result = None
+		self.duplicate_of = None
+
+
+def get_error_result(exc: OperationError):
+	return schemas.BatchOperationResult(status_code=exc.status_code, detail=exc.detail)
+
+
+def parse_operation(pending: PendingOperation):
+	if(pending.operation not in OPERATION_SCHEMAS):
+		raise OperationError(400, f"Unknown operation: {pending.operation}")
+	if(pending.idempotency_key is not None and len(pending.idempotency_key) > idempotency.IDEMPOTENCY_KEY_MAX_LENGTH):
+		raise OperationError(400, 'Idempotency key is too long')
+	if(pending.operation != CREATE_HEALTH_RECORD and pending.id is None):
+		raise OperationError(400, 'Operation requires an id')
+
+	schema = OPERATION_SCHEMAS[pending.operation]
+	if(schema is not None):
+		try:
+			pending.data = schema.parse_obj(pending.raw_data or {})
+		except ValidationError as exc:
+			raise OperationError(422, str(exc))
+
+
+def get_replayed_result(stored: models.IdempotencyKey):
+	if(stored.endpoint != IDEMPOTENCY_ENDPOINT):
+		return schemas.BatchOperationResult(status_code=422, detail='Idempotency key was used by another endpoint')
+	result = schemas.BatchOperationResult.parse_raw(stored.response)
+	result.replayed = True
+	return result
+
+
+async def resolve_food(service: NutritionService, food_item: schemas.FoodItemCreateUpdate, resolved: dict):
+	# Mirrors the food item endpoints, foods resolved once are reused by the other operations of the batch
+	if(food_item.food_id is None and food_item.new_food_type is None):
+		raise OperationError(403, 'Invalid Format')
+
+	key = (food_item.food_id, food_item.new_food_type)
+	if(key not in resolved):
+		try:
+			resolved[key] = ((await service.get_from_database(food_id=food_item.food_id, parsed_text=food_item.new_food_type)).food_id, None)
+		except ServiceUnavailableError:
+			raise OperationError(503, 'Nutrition Service is unavailable')
+		except FoodItemDoesNotExistError:
+			resolved[key] = (None, food_item.new_food_type)
+		except NutritionDataRequiredError:
+			raise OperationError(400, 'Bad Request, Parsed Text Required')
+		except Exception:
+			traceback.print_exc()
+			raise OperationError(500, 'Server Error. Please contact service administrator')
+
+	food_item.food_id, food_item.new_food_type = resolved[key]
+
+
+### Ownership checks, run before any write of the operation
+def get_owned_meal(db: Session, user_id: int, meal_id: int):
+	meal = crud.get_meal(db, meal_id)
+	if(meal is None or meal.date_deleted is not None):
+		raise OperationError(404, 'Meal not found')
+	if(meal.user_id != user_id):
+		raise OperationError(403, 'Not allowed')
+	return meal
+
+
+def get_owned_health_record(db: Session, user_id: int, health_record_id: int):
+	health_record = crud.get_health_record(db, health_record_id)
+	if(health_record is None or health_record.date_deleted is not None):
+		raise OperationError(404, 'Record not found')
+	if(health_record.user_id != user_id):
+		raise OperationError(403, 'Not allowed')
+	return health_record
+
+
+def get_owned_food_item(db: Session, user_id: int, food_item_id: int):
+	food_item = crud.get_food_item(db, food_item_id)
+	if(food_item is None):
+		raise OperationError(404, 'Food item not found')
+	get_owned_meal(db, user_id, food_item.meal_id)
+	return food_item
+
+
+def check_measurement(db: Session, food_item: schemas.FoodItemCreateUpdate):
+	try:
+		crud.get_measurement_by_suffix(db, food_item.measurement_suffix)
+	except Exception as exc:
+		raise OperationError(422, str(exc))
+
+
+def get_meal_food_ids(db: Session, meal_id: int):
+	# Queried rather than read from meal.food_items, which does not see the rows written by earlier operations
+	return {food_id for food_id, in db.query(models.FoodItem.food_id).filter(models.FoodItem.meal_id == meal_id, models.FoodItem.date_deleted == None, models.FoodItem.food_id != None)}
+
+
+### Operations, each sets the result of its pending operations and adds the (meal_id, event_type) events to publish
+def create_health_records(db: Session, user_id: int, group: list, events: set):
+	health_record_ids = crud.create_health_records(db, user_id, [pending.data for pending in group])
+	for pending, health_record_id in zip(group, health_record_ids):
+		pending.result = schemas.BatchOperationResult(status_code=200, id=health_record_id)
+
+
+def update_health_record(db: Session, user_id: int, pending: PendingOperation, events: set):
+	get_owned_health_record(db, user_id, pending.id)
+	crud.update_health_record(db, user_id, pending.id, pending.data, commit=False)
+
+
+def delete_health_record(db: Session, user_id: int, pending: PendingOperation, events: set):
+	get_owned_health_record(db, user_id, pending.id)
+	crud.delete_health_record(db, pending.id, commit=False)
+
+
+def update_meal_blood_glucose(db: Session, user_id: int, pending: PendingOperation, events: set):
+	get_owned_meal(db, user_id, pending.id)
+	crud.update_meal_blood_glucose(db, pending.id, pending.data, commit=False)
+	events.add((pending.id, event_hub.MEAL_UPDATED))
+
+
+def delete_meal(db: Session, user_id: int, pending: PendingOperation, events: set):
+	get_owned_meal(db, user_id, pending.id)
+	crud.delete_meal(db, pending.id, commit=False)
+	events.add((pending.id, event_hub.MEAL_DELETED))
+
+
+def create_food_items(db: Session, user_id: int, group: list, events: set):
+	created = []
+	meal_food_ids = {}
+	for pending in group:
+		try:
+			get_owned_meal(db, user_id, pending.id)
+			check_measurement(db, pending.data)
+			food_ids = meal_food_ids.setdefault(pending.id, get_meal_food_ids(db, pending.id))
+			if(pending.data.food_id in food_ids):
+				raise OperationError(422, 'Cannot have duplicate food item in meal.')
+		except OperationError as exc:
+			pending.result = get_error_result(exc)
+			continue
+
+		if(pending.data.food_id is not None):
+			food_ids.add(pending.data.food_id)
+		created.append(pending)
+
+	food_item_ids = crud.create_food_items(db, [(pending.id, pending.data) for pending in created])
+	for pending, food_item_id in zip(created, food_item_ids):
+		pending.result = schemas.BatchOperationResult(status_code=200, id=food_item_id)
+		events.add((pending.id, event_hub.MEAL_UPDATED))
+
+
+def update_food_item(db: Session, user_id: int, pending: PendingOperation, events: set):
+	food_item = get_owned_food_item(db, user_id, pending.id)
+	check_measurement(db, pending.data)
+	if(pending.data.food_id in get_meal_food_ids(db, food_item.meal_id) and food_item.food_id != pending.data.food_id):
+		raise OperationError(422, 'Cannot have duplicate food item in meal.')
+
+	crud.update_food_item(db, pending.id, pending.data, commit=False)
+	events.add((food_item.meal_id, event_hub.MEAL_UPDATED))
+
+
+def delete_food_item(db: Session, user_id: int, pending: PendingOperation, events: set):
+	food_item = get_owned_food_item(db, user_id, pending.id)
+	crud.delete_food_item(db, pending.id, commit=False)
+	events.add((food_item.meal_id, event_hub.MEAL_UPDATED))
+
+
+def run_each(operation):
+	# Runs a single record operation for every pending operation of a group
+	def run(db: Session, user_id: int, group: list, events: set):
+		for pending in group:
+			try:
+				operation(db, user_id, pending, events)
+				pending.result = schemas.BatchOperationResult(status_code=200, id=pending.id)
+			except OperationError as exc:
+				pending.result = get_error_result(exc)
+	return run
+
+
+OPERATIONS = {
+	CREATE_HEALTH_RECORD: create_health_records,
+	UPDATE_HEALTH_RECORD: run_each(update_health_record),
+	DELETE_HEALTH_RECORD: run_each(delete_health_record),
+	UPDATE_MEAL_BLOOD_GLUCOSE: run_each(update_meal_blood_glucose),
+	DELETE_MEAL: run_each(delete_meal),
+	CREATE_FOOD_ITEM: create_food_items,
+	UPDATE_FOOD_ITEM: run_each(update_food_item),
+	DELETE_FOOD_ITEM: run_each(delete_food_item),
+}
+
+
+def get_groups(pending_operations: list):
+	# Consecutive bulk operations of the same type form one group, every other operation its own
+	groups = []
+	for pending in pending_operations:
+		if(groups and pending.operation in BULK_OPERATIONS and groups[-1][0].operation == pending.operation):
+			groups[-1].append(pending)
+		else:
+			groups.append([pending])
+	return groups
+
+
+def execute_group(db: Session, user_id: int, group: list, events: set):
+	# In a savepoint, the writes of a group and the idempotency keys of their results are kept or rolled back together
+	group_events = set()
+	savepoint = db.begin_nested()
+	try:
+		OPERATIONS[group[0].operation](db, user_id, group, group_events)
+
+		# Server errors are not stored so a retry runs the operation again
+		responses = [(pending.idempotency_key, pending.result.status_code, pending.result.json()) for pending in group if pending.idempotency_key is not None and pending.result.status_code < 500]
+		if(responses):
+			crud.create_idempotency_keys(db, user_id, IDEMPOTENCY_ENDPOINT, responses, idempotency.get_live_since())
+		savepoint.commit()
+	except Exception:
+		savepoint.rollback()
+		raise
+
+	events.update(group_events)
+
+
+def execute_groups(db: Session, user_id: int, groups: list, events: set):
+	for group in groups:
+		try:
+			execute_group(db, user_id, group, events)
+			continue
+		except Exception:
+			for pending in group:
+				pending.result = None
+
+		if(len(group) > 1):
+			# A failed bulk insert is retried one operation at a time to find the failing one
+			execute_groups(db, user_id, [[pending] for pending in group], events)
+			continue
+
+		# An idempotency key stored concurrently by a retry of the same batch fails the insert, replay its result
+		pending = group[0]
+		stored = crud.get_idempotency_keys(db, user_id, [pending.idempotency_key], idempotency.get_live_since()) if pending.idempotency_key is not None else []
+		if(stored):
+			pending.result = get_replayed_result(stored[0])
+		else:
+			traceback.print_exc()
+			pending.result = schemas.BatchOperationResult(status_code=500, detail='Server Error. Please contact service administrator')
+
+
+async def execute_batch(db: Session, user_id: int, operations: list):
+	'''
+	Execute the operations of a batch in order, in one transaction committed by the caller after publishing the events
+
+	Parameters:
+		db (Session): Database session
+		user_id (int): Owner of the records
+		operations (list): schemas.BatchOperation
+	Return:
+		List of schemas.BatchOperationResult in the order of operations,
+		and the set of (meal_id, event_type) events to publish
+	'''
+
+	pending_operations = [PendingOperation(operation) for operation in operations]
+	for pending in pending_operations:
+		try:
+			parse_operation(pending)
+		except OperationError as exc:
+			pending.result = get_error_result(exc)
+
+	# Operations retried with the key of a stored result replay it, repeated keys within the batch replay the first
+	keys = list({pending.idempotency_key for pending in pending_operations if pending.result is None and pending.idempotency_key is not None})
+	stored = {stored.idempotency_key: stored for stored in crud.get_idempotency_keys(db, user_id, keys, idempotency.get_live_since())} if keys else {}
+	first_operations = {}
+	for pending in pending_operations:
+		if(pending.result is not None or pending.idempotency_key is None):
+			continue
+		if(pending.idempotency_key in stored):
+			pending.result = get_replayed_result(stored[pending.idempotency_key])
+		elif(pending.idempotency_key in first_operations):
+			pending.duplicate_of = first_operations[pending.idempotency_key]
+		else:
+			first_operations[pending.idempotency_key] = pending
+
+	# Foods are resolved before the writes, the nutrition service commits the foods it fetches itself
+	service = NutritionService(db)
+	resolved = {}
+	for pending in pending_operations:
+		if(pending.result is None and pending.duplicate_of is None and pending.operation in (CREATE_FOOD_ITEM, UPDATE_FOOD_ITEM)):
+			try:
+				await resolve_food(service, pending.data, resolved)
+			except OperationError as exc:
+				pending.result = get_error_result(exc)
+
+	events = set()
+	runnable = [pending for pending in pending_operations if pending.result is None and pending.duplicate_of is None]
+	execute_groups(db, user_id, get_groups(runnable), events)
+
+	for pending in pending_operations:
+		if(pending.duplicate_of is not None):
+			pending.result = pending.duplicate_of.result.copy(update={'replayed': True})
+
+	return [pending.result for pending in pending_operations], events
@@ -0,0 +1,74 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, random, time, uuid
+import httpx
+
+
+def generate_operations(count, meal_id):
+	# Queued offline changes, health records and, given a meal, blood glucose readings of that meal
+	operations = []
+	for index in range(count):
+		if(meal_id is not None and index % 5 == 4):
+			operations.append({'operation': 'update_meal_blood_glucose', 'id': meal_id, 'idempotency_key': str(uuid.uuid4()),
+				'data': {'blood_glucose': round(random.uniform(4, 9), 1)}})
+		else:
+			operations.append({'operation': 'create_health_record', 'idempotency_key': str(uuid.uuid4()),
+				'data': {'weight': round(random.uniform(50, 100), 1), 'systolic_pressure': random.randint(100, 150), 'fasting_blood_glucose': round(random.uniform(4, 9), 1)}})
+	return operations
+
+
+def replay_individually(client, operations):
+	# One request per queued change, as the app replays its queue today
+	for operation in operations:
+		if(operation['operation'] == 'create_health_record'):
+			response = client.post('/health-records/', json=operation['data'])
+		else:
+			response = client.put('/meals/{}/blood-glucose/'.format(operation['id']), json=operation['data'])
+		response.raise_for_status()
+
+
+def replay_batched(client, operations, batch_size):
+	results = []
+	for start in range(0, len(operations), batch_size):
+		response = client.post('/batch', json={'operations': operations[start:start + batch_size]})
+		response.raise_for_status()
+		results += response.json()['results']
+	return results
+
+
+def measure(function):
+	start = time.perf_counter()
+	result = function()
+	return time.perf_counter() - start, result
+
+
+def benchmark_batch(args):
+	headers = {'Authorization': 'Bearer {}'.format(args.token)}
+	operations = generate_operations(args.operations, args.meal_id)
+
+	with httpx.Client(base_url=args.url, headers=headers, timeout=120) as client:
+		individual_seconds, _ = measure(lambda: replay_individually(client, operations))
+		batched_seconds, results = measure(lambda: replay_batched(client, operations, args.batch_size))
+		# A retry after a lost response, every operation replays its stored result
+		retry_seconds, retry_results = measure(lambda: replay_batched(client, operations, args.batch_size))
+
+	print(json.dumps({
+		'operations': args.operations,
+		'batch_size': args.batch_size,
+		'individual_ms': individual_seconds * 1000,
+		'batched_ms': batched_seconds * 1000,
+		'retry_ms': retry_seconds * 1000,
+		'speedup': individual_seconds / batched_seconds,
+		'failed': sum(1 for result in results if result['status_code'] != 200),
+		'replayed_on_retry': sum(1 for result in retry_results if result['replayed']),
+	}, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compares replaying queued offline changes one request at a time and through /batch')
+	parser.add_argument('token', help='Access token of the user replaying the changes')
+	parser.add_argument('-u', '--url', default='http://localhost:8000', help='URL of a running server')
+	parser.add_argument('-n', '--operations', type=int, default=500, help='Number of queued operations')
+	parser.add_argument('-b', '--batch-size', type=int, default=500, help='Number of operations per batch')
+	parser.add_argument('-m', '--meal-id', type=int, default=None, help='Meal of the user whose blood glucose is updated by every fifth operation')
+	args = parser.parse_args()
+	benchmark_batch(args)
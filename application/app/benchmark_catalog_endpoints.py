@@ -0,0 +1,54 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, time
+import httpx
+
+# Catalog requests made by the app on every launch
+CATALOG_PATHS = ['/food/', '/food-id-strings/', '/trend-analyzer/features/']
+
+
+def fetch(client, path, headers, repeat):
+	# Bytes on the wire are the body as sent, i.e. compressed when Content-Encoding is set
+	wire_bytes = 0
+	status_codes = set()
+	start = time.perf_counter()
+	for _ in range(repeat):
+		with client.stream('GET', path, headers=headers) as response:
+			for chunk in response.iter_raw():
+				wire_bytes += len(chunk)
+			status_codes.add(response.status_code)
+	elapsed = time.perf_counter() - start
+
+	return {
+		'requests_per_second': repeat / elapsed,
+		'bytes_per_request': wire_bytes / repeat,
+		'status_codes': sorted(status_codes),
+	}
+
+
+def benchmark_catalog_endpoints(args):
+	paths = CATALOG_PATHS + ['/food/{}/food-nutrition/'.format(food_id) for food_id in args.food_id]
+	results = {}
+
+	with httpx.Client(base_url=args.url) as client:
+		for path in paths:
+			# The ETag of the uncompressed payload, sent back by clients revalidating their copy
+			etag = client.get(path, headers={'Accept-Encoding': 'identity'}).headers.get('etag')
+
+			results[path] = {
+				'identity': fetch(client, path, {'Accept-Encoding': 'identity'}, args.repeat),
+				'gzip': fetch(client, path, {'Accept-Encoding': 'gzip'}, args.repeat),
+				'br': fetch(client, path, {'Accept-Encoding': 'br'}, args.repeat),
+			}
+			if(etag is not None):
+				results[path]['not_modified'] = fetch(client, path, {'Accept-Encoding': 'gzip', 'If-None-Match': etag}, args.repeat)
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Measures bytes on the wire and requests per second of the catalog endpoints')
+	parser.add_argument('-u', '--url', default='http://localhost:8000', help='URL of a running server')
+	parser.add_argument('-f', '--food-id', action='append', default=[], help='Food ID whose nutrition is fetched, may be repeated')
+	parser.add_argument('-r', '--repeat', type=int, default=200, help='Number of requests per endpoint and encoding')
+	args = parser.parse_args()
+	benchmark_catalog_endpoints(args)
@@ -0,0 +1,74 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, time
+import numpy as np
+from app import inference, smart_diet_watcher
+from app.export_classification_model import list_images
+
+
+def benchmark_backend(backend, images, repeat):
+	# Warm up
+	backend.predict(images[0])
+
+	latencies = []
+	predictions = []
+	start = time.perf_counter()
+	for _ in range(repeat):
+		predictions = []
+		for image in images:
+			image_start = time.perf_counter()
+			predictions.append(backend.predict(image)[0])
+			latencies.append(time.perf_counter() - image_start)
+	elapsed = time.perf_counter() - start
+
+	return np.array(predictions), {
+		'latency_p50_ms': float(np.percentile(latencies, 50) * 1000),
+		'latency_p95_ms': float(np.percentile(latencies, 95) * 1000),
+		'throughput_images_per_second': len(latencies) / elapsed,
+	}
+
+
+def compare_predictions(reference, predictions, top_k):
+	# Fraction of images where the top class matches, and the mean overlap of the top k classes
+	reference_top = np.argsort(reference, axis=1)[:, ::-1][:, :top_k]
+	predictions_top = np.argsort(predictions, axis=1)[:, ::-1][:, :top_k]
+
+	top_1 = float(np.mean(reference_top[:, 0] == predictions_top[:, 0]))
+	top_k_overlap = float(np.mean([len(set(a) & set(b)) / top_k for a, b in zip(reference_top, predictions_top)]))
+	return {'top_1_agreement': top_1, f"top_{top_k}_overlap": top_k_overlap}
+
+
+def benchmark_classification(args):
+	backends = {'keras': inference.load_backend(inference.BACKEND_KERAS, args.model)}
+	for export in args.exports:
+		name, backend, model_path = export.split(':', 2)
+		backends[name] = inference.load_backend(backend, model_path, args.threads)
+
+	image_paths = list_images(args.images)
+	print('[INFO] {} images loaded'.format(len(image_paths)))
+
+	results = {}
+	reference = None
+	for name, backend in backends.items():
+		print('[INFO] benchmarking {}'.format(name))
+		images = [smart_diet_watcher.load_classification_image(image_path, backend.input_size) for image_path in image_paths]
+		predictions, results[name] = benchmark_backend(backend, images, args.repeat)
+
+		# Accuracy parity against the Keras model
+		if(reference is None):
+			reference = predictions
+		else:
+			results[name].update(compare_predictions(reference, predictions, args.top_k))
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compares the accuracy and latency of the food classification inference backends')
+	parser.add_argument('-m', '--model', required=True, help='Path to the Keras food classification model')
+	parser.add_argument('-e', '--exports', nargs='*', default=[], help='Exports to compare as name:backend:path, e.g. int8:tflite:model_int8.tflite')
+	parser.add_argument('-i', '--images', required=True, help='Path to a fixed directory of meal images')
+	parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of passes over the images')
+	parser.add_argument('-t', '--threads', type=int, default=None, help='Number of threads used by the tflite and onnx backends')
+	parser.add_argument('-k', '--top-k', type=int, default=5, help='Number of top classes compared')
+	args = parser.parse_args()
+	benchmark_classification(args)
@@ -0,0 +1,65 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, gzip, json, time
+import httpx
+
+# Endpoints returning large nested payloads to the mobile app
+DEFAULT_PATHS = ['/meals/?limit=100', '/health-records/?limit=100', '/food/']
+
+
+def fetch(client, path, headers):
+	start = time.perf_counter()
+	body = b''
+	with client.stream('GET', path, headers=headers) as response:
+		for chunk in response.iter_raw():
+			body += chunk
+		encoding = response.headers.get('content-encoding')
+	server_seconds = time.perf_counter() - start
+
+	# Client side decompression is part of the end-to-end latency
+	start = time.perf_counter()
+	if(encoding == 'gzip'):
+		gzip.decompress(body)
+	decode_seconds = time.perf_counter() - start
+
+	return len(body), encoding, server_seconds, decode_seconds
+
+
+def benchmark_compression(args):
+	headers = {}
+	if(args.token):
+		headers['Authorization'] = 'Bearer {}'.format(args.token)
+
+	# Simulated link: one round trip plus the transfer time of the body at the given bandwidth
+	bytes_per_second = args.bandwidth_kbps * 1000 / 8
+	results = {}
+
+	with httpx.Client(base_url=args.url) as client:
+		for path in args.path or DEFAULT_PATHS:
+			results[path] = {}
+			for accept_encoding in ('identity', 'gzip'):
+				samples = [fetch(client, path, dict(headers, **{'Accept-Encoding': accept_encoding})) for _ in range(args.repeat)]
+				size, encoding = samples[-1][0], samples[-1][1]
+				server_seconds = sum(sample[2] for sample in samples) / len(samples)
+				decode_seconds = sum(sample[3] for sample in samples) / len(samples)
+
+				results[path][accept_encoding] = {
+					'content_encoding': encoding,
+					'bytes': size,
+					'server_ms': server_seconds * 1000,
+					'decode_ms': decode_seconds * 1000,
+					'end_to_end_ms': (args.rtt_ms / 1000 + server_seconds + size / bytes_per_second + decode_seconds) * 1000,
+				}
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmarks response compression over a simulated slow link')
+	parser.add_argument('-u', '--url', default='http://localhost:8000', help='URL of a running server')
+	parser.add_argument('-t', '--token', default=None, help='Access token used for the authenticated endpoints')
+	parser.add_argument('-p', '--path', action='append', default=[], help='Path to fetch, may be repeated')
+	parser.add_argument('-b', '--bandwidth-kbps', type=float, default=1600, help='Simulated link bandwidth in kbit/s')
+	parser.add_argument('-l', '--rtt-ms', type=float, default=150, help='Simulated link round trip time in milliseconds')
+	parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of requests per path and encoding')
+	args = parser.parse_args()
+	benchmark_compression(args)
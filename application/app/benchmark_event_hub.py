@@ -0,0 +1,71 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, asyncio, json, time, tracemalloc
+from app import event_hub
+
+
+class IdleRequest:
+	# Stands in for a connected client, the stream only checks for disconnects when idle
+	async def is_disconnected(self):
+		return False
+
+
+async def subscriber(user_id, received, ready):
+	stream = event_hub.iterate_events(IdleRequest(), user_id, keepalive_interval=3600)
+	await stream.__anext__()
+	ready.set()
+	async for _ in stream:
+		received[0] += 1
+
+
+async def run(args):
+	hub = event_hub.hub
+	received = [0]
+
+	tracemalloc.start()
+	baseline = tracemalloc.get_traced_memory()[0]
+
+	start = time.perf_counter()
+	tasks = []
+	for index in range(args.subscribers):
+		ready = asyncio.Event()
+		tasks.append(asyncio.ensure_future(subscriber(index % args.users, received, ready)))
+		await ready.wait()
+	subscribe_seconds = time.perf_counter() - start
+	memory = tracemalloc.get_traced_memory()[0] - baseline
+	tracemalloc.stop()
+
+	# Fan one event out to every user and wait until every subscription received it
+	start = time.perf_counter()
+	for user_id in range(args.users):
+		hub.publish(None, [user_id], event_hub.MEAL_CREATED, user_id=user_id, meal_id=1)
+	while(received[0] < args.subscribers):
+		await asyncio.sleep(0)
+	fan_out_seconds = time.perf_counter() - start
+
+	for task in tasks:
+		task.cancel()
+	await asyncio.gather(*tasks, return_exceptions=True)
+
+	print(json.dumps({
+		'subscribers': args.subscribers,
+		'users': args.users,
+		'subscribe_ms': subscribe_seconds * 1000,
+		'bytes_per_idle_subscriber': memory / args.subscribers,
+		'fan_out_ms': fan_out_seconds * 1000,
+		'events_per_second': args.subscribers / fan_out_seconds,
+	}, indent=2))
+
+
+def benchmark_event_hub(args):
+	if(event_hub.hub.backend != event_hub.BACKEND_MEMORY):
+		print('[INFO] the benchmark measures the in-process hub, set EVENT_HUB_BACKEND=memory')
+		sys.exit(1)
+	asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmarks idle subscriptions and fan-out of the event hub in one worker')
+	parser.add_argument('-s', '--subscribers', type=int, default=10000, help='Number of concurrent subscriptions')
+	parser.add_argument('-u', '--users', type=int, default=5000, help='Number of users the subscriptions are spread across')
+	args = parser.parse_args()
+	benchmark_event_hub(args)
@@ -0,0 +1,72 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, base64, json, time
+import tensorflow as tf
+from keras import backend
+from app import food_detector, inference
+
+
+def load_frames(image_directory):
+	# Encode images the same way clients send them to /food/detect/
+	frames = []
+	for file_name in sorted(os.listdir(image_directory)):
+		ext = os.path.splitext(file_name)[1][1:].lower()
+		if(ext not in ('jpg', 'jpeg', 'png')):
+			continue
+		with open(os.path.join(image_directory, file_name), 'rb') as f:
+			frames.append('data:image/{};base64,{}'.format(ext, base64.b64encode(f.read()).decode()))
+	return frames
+
+
+def run(detector, frames, repeat):
+	start = time.perf_counter()
+	for _ in range(repeat):
+		for frame in frames:
+			detector.detect(frame)
+	elapsed = time.perf_counter() - start
+	return len(frames) * repeat / elapsed
+
+
+def benchmark_food_detection(args):
+	# Pin TensorFlow to the given number of cores
+	backend.set_session(tf.Session(config=tf.ConfigProto(
+		intra_op_parallelism_threads=args.threads,
+		inter_op_parallelism_threads=1,
+	)))
+
+	print('[INFO] loading models')
+	model = inference.load_backend(inference.BACKEND_KERAS, args.model, model_name=inference.MODEL_DETECTION)
+	prefilter_model = inference.load_backend(inference.BACKEND_KERAS, args.prefilter_model, model_name=inference.MODEL_DETECTION_PREFILTER) if args.prefilter_model else None
+
+	frames = load_frames(args.images)
+	print('[INFO] {} frames loaded'.format(len(frames)))
+
+	# Warm up
+	food_detector.TieredFoodDetector(model).detect(frames[0])
+
+	results = {}
+
+	# Full model on every frame
+	detector = food_detector.TieredFoodDetector(model, cache=food_detector.PerceptualHashCache(capacity=0))
+	results['model'] = {'fps': run(detector, frames, args.repeat)}
+
+	# Tiered pipeline, the cache is cold on the first pass over the frames
+	detector = food_detector.TieredFoodDetector(model, prefilter_model, prefilter_confidence=args.prefilter_confidence)
+	results['tiered'] = {'fps': run(detector, frames, args.repeat)}
+	results['tiered'].update(detector.stats())
+
+	for result in results.values():
+		result['fps_per_core'] = result['fps'] / args.threads
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmarks the tiered food detection pipeline')
+	parser.add_argument('-i', '--images', required=True, help='Path to a directory containing camera frames')
+	parser.add_argument('-m', '--model', required=True, help='Path to the food detection model')
+	parser.add_argument('-p', '--prefilter-model', default=None, help='Path to the pre-filter model')
+	parser.add_argument('-c', '--prefilter-confidence', type=float, default=0.9, help='Minimum confidence of the pre-filter model')
+	parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of passes over the frames')
+	parser.add_argument('-t', '--threads', type=int, default=1, help='Number of cores used by TensorFlow')
+	args = parser.parse_args()
+	benchmark_food_detection(args)
@@ -0,0 +1,201 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, asyncio, base64, random, time
+import cv2
+import httpx
+import numpy as np
+from app import benchmark_report
+
+# Roles of the users making the requests
+PATIENT = 'patient'
+CLINICIAN = 'clinician'
+
+
+def get_image_data(rng):
+	# A new JPEG per upload, identical images would only be stored and classified once
+	pixels = np.array([rng.getrandbits(8) for _ in range(64 * 64 * 3)], dtype=np.uint8).reshape((64, 64, 3))
+	pixels = cv2.resize(pixels, (512, 384), interpolation=cv2.INTER_LINEAR)
+	return 'data:image/jpeg;base64,' + base64.b64encode(cv2.imencode('.jpg', pixels)[1].tobytes()).decode()
+
+
+class Session:
+	'''
+	Logged in user of the load, with the ids needed to build its requests
+	'''
+
+	def __init__(self, email: str, token: str, role: str):
+		self.email = email
+		self.headers = {'Authorization': 'Bearer {}'.format(token), 'Accept-Encoding': 'gzip'}
+		self.role = role
+		self.patient_ids = []
+
+
+async def login(client, email: str, password: str):
+	return await client.post('/token', data={'username': email, 'password': password})
+
+
+# Requests of the endpoint mix, each returns the response
+async def request_login(client, rng, session, args):
+	return await login(client, session.email, args.password)
+
+
+async def request_meal_upload(client, rng, session, args):
+	return await client.post('/meals/?top_k=5', json={'image': get_image_data(rng)}, headers=session.headers)
+
+
+async def request_meal_list(client, rng, session, args):
+	return await client.get('/meals/?skip=0&limit=20', headers=session.headers)
+
+
+async def request_meal_list_page(client, rng, session, args):
+	return await client.get('/meals/?skip={}&limit=20'.format(rng.randint(1, 10) * 20), headers=session.headers)
+
+
+async def request_meal_search(client, rng, session, args):
+	return await client.get('/meals/?query={}&limit=20'.format(rng.choice(['rice', 'chicken', 'soup', 'bread'])), headers=session.headers)
+
+
+async def request_health_record_list(client, rng, session, args):
+	return await client.get('/health-records/?skip=0&limit=20', headers=session.headers)
+
+
+async def request_health_record_series(client, rng, session, args):
+	return await client.get('/health-records/series?metric={}&resolution={}'.format(rng.choice(['weight', 'fasting_blood_glucose']), rng.choice(['day', 'week', 'month'])), headers=session.headers)
+
+
+async def request_profile(client, rng, session, args):
+	return await client.get('/profile/', headers=session.headers)
+
+
+async def request_sync(client, rng, session, args):
+	return await client.get('/sync', headers=session.headers)
+
+
+async def request_food_catalog(client, rng, session, args):
+	return await client.get('/food/', headers=session.headers)
+
+
+async def request_clinician_dashboard(client, rng, session, args):
+	# Streamed, the latency includes reading every patient
+	async with client.stream('GET', '/clinician/dashboard/', headers=session.headers) as response:
+		async for _ in response.aiter_raw():
+			pass
+	return response
+
+
+async def request_clinician_patient_meals(client, rng, session, args):
+	return await client.get('/clinician/assigned-users/{}/meals/?limit=20'.format(rng.choice(session.patient_ids)), headers=session.headers)
+
+
+async def request_clinician_patient_series(client, rng, session, args):
+	return await client.get('/clinician/assigned-users/{}/health-records/series?metric=weight&resolution=week'.format(rng.choice(session.patient_ids)), headers=session.headers)
+
+
+async def request_trend_report(client, rng, session, args):
+	return await client.post('/trend-analyzer/generate-report/', json={}, headers=session.headers)
+
+
+# Endpoint mix of the load as (name, role, weight, request), weights are the share of requests of an app session
+ENDPOINT_MIX = [
+	('login', PATIENT, 2, request_login),
+	('meal_upload', PATIENT, 5, request_meal_upload),
+	('meal_list', PATIENT, 25, request_meal_list),
+	('meal_list_page', PATIENT, 8, request_meal_list_page),
+	('meal_search', PATIENT, 3, request_meal_search),
+	('health_record_list', PATIENT, 10, request_health_record_list),
+	('health_record_series', PATIENT, 6, request_health_record_series),
+	('profile', PATIENT, 6, request_profile),
+	('sync', PATIENT, 8, request_sync),
+	('food_catalog', PATIENT, 5, request_food_catalog),
+	('clinician_dashboard', CLINICIAN, 6, request_clinician_dashboard),
+	('clinician_patient_meals', CLINICIAN, 8, request_clinician_patient_meals),
+	('clinician_patient_series', CLINICIAN, 5, request_clinician_patient_series),
+	('trend_report', CLINICIAN, 1, request_trend_report),
+]
+
+
+async def create_sessions(client, email: str, count: int, role: str, password: str):
+	sessions = []
+	for index in range(count):
+		response = await login(client, email.format(index), password)
+		if(response.status_code == 429):
+			print('[ERROR] login rate limited, raise LOGIN_RATE_LIMIT_IP_BURST and LOGIN_RATE_LIMIT_USERNAME_BURST on the server under load')
+			sys.exit(1)
+		if(response.status_code != 200):
+			print('[ERROR] login of {} failed with {}, generate the users with generate_benchmark_data.py'.format(email.format(index), response.status_code))
+			sys.exit(1)
+		sessions.append(Session(email.format(index), response.json()['access_token'], role))
+	return sessions
+
+
+async def run_worker(client, rng, sessions, mix, args, deadline, timings, errors):
+	names, weights = [entry[0] for entry in mix], [entry[2] for entry in mix]
+	requests = {entry[0]: entry for entry in mix}
+	while time.perf_counter() < deadline:
+		name = rng.choices(names, weights)[0]
+		_, role, _, request = requests[name]
+		session = rng.choice(sessions[role])
+
+		start = time.perf_counter()
+		try:
+			response = await request(client, rng, session, args)
+			failed = response.status_code >= 400
+		except httpx.HTTPError:
+			failed = True
+		if(failed):
+			errors[name] = errors.get(name, 0) + 1
+		else:
+			timings.setdefault(name, []).append(time.perf_counter() - start)
+
+
+async def run_load(args):
+	rng = random.Random(args.seed)
+	mix = [entry for entry in ENDPOINT_MIX if args.endpoints is None or entry[0] in args.endpoints]
+
+	async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+		sessions = {
+			PATIENT: await create_sessions(client, benchmark_report.PATIENT_EMAIL, args.patients, PATIENT, args.password),
+			CLINICIAN: await create_sessions(client, benchmark_report.CLINICIAN_EMAIL, args.clinicians, CLINICIAN, args.password),
+		}
+
+		# Clinicians only request the patients which accepted them
+		for session in sessions[CLINICIAN]:
+			response = await client.get('/clinician/assignments/', headers=session.headers)
+			session.patient_ids = [assignment['user_id'] for assignment in response.json() if assignment.get('assignment_accepted')]
+		sessions[CLINICIAN] = [session for session in sessions[CLINICIAN] if session.patient_ids]
+		mix = [entry for entry in mix if sessions[entry[1]]]
+
+		timings, errors = {}, {}
+		start = time.perf_counter()
+		deadline = start + args.duration
+		await asyncio.gather(*[
+			run_worker(client, random.Random(rng.getrandbits(64)), sessions, mix, args, deadline, timings, errors)
+			for _ in range(args.concurrency)
+		])
+		elapsed = time.perf_counter() - start
+
+	results = {name: benchmark_report.summarize(timings.get(name, []), elapsed, errors.get(name, 0)) for name, _, _, _ in mix}
+	results['all'] = benchmark_report.summarize([seconds for values in timings.values() for seconds in values], elapsed, sum(errors.values()))
+	return results
+
+
+def benchmark_load(args):
+	results = asyncio.get_event_loop().run_until_complete(run_load(args))
+	parameters = {key: value for key, value in vars(args).items() if key not in ('url', 'output', 'password')}
+	benchmark_report.write_report(benchmark_report.create_report('load', parameters, results), args.output)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Replays a realistic endpoint mix against a running server with the users of generate_benchmark_data.py. '
+		'Login attempts are rate limited per IP, raise the LOGIN_RATE_LIMIT_* bursts of the server under load.')
+	parser.add_argument('-u', '--url', default='http://localhost:9000', help='URL of a running server')
+	parser.add_argument('-p', '--patients', type=int, default=20, help='Number of generated patients logged in')
+	parser.add_argument('-c', '--clinicians', type=int, default=5, help='Number of generated clinicians logged in')
+	parser.add_argument('--password', default='benchmark', help='Password of the generated users')
+	parser.add_argument('-n', '--concurrency', type=int, default=20, help='Number of requests in flight')
+	parser.add_argument('-d', '--duration', type=float, default=60, help='Seconds the load runs')
+	parser.add_argument('-e', '--endpoints', nargs='+', help='Names of the endpoints of the mix to run, all by default')
+	parser.add_argument('-t', '--timeout', type=float, default=30, help='Seconds before a request fails')
+	parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed of the endpoint mix')
+	parser.add_argument('-o', '--output', help='File the JSON report is written to, compare reports with benchmark_report.py')
+	args = parser.parse_args()
+	benchmark_load(args)
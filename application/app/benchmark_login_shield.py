@@ -0,0 +1,56 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, random, time
+from app import rate_limiter, security
+
+
+def simulate_attack(args, shield):
+	# Credential stuffing: a few attacker IPs cycling through leaked usernames, most without an account
+	random.seed(0)
+	accounts = {f"user{i}@example.com": security.get_password_hash('correct-password') for i in range(args.accounts)}
+	usernames = list(accounts) + [f"leaked{i}@example.com" for i in range(args.accounts * 9)]
+	ips = [f"10.0.0.{i}" for i in range(args.ips)]
+
+	verifications = 0
+	start = time.process_time()
+	for _ in range(args.attempts):
+		username = random.choice(usernames)
+		if(shield is not None and shield.check(username, random.choice(ips)) is not None):
+			continue
+
+		password_hash = accounts.get(username)
+		if(password_hash is None):
+			if(shield is not None):
+				shield.unknown_usernames.add(username)
+			continue
+
+		security.verify_password('guessed-password', password_hash)
+		verifications += 1
+
+	return {
+		'cpu_seconds': time.process_time() - start,
+		'password_verifications': verifications,
+		'attempts': shield.stats() if shield is not None else None,
+	}
+
+
+def benchmark_login_shield(args):
+	results = {
+		'unprotected': simulate_attack(args, None),
+		'shielded': simulate_attack(args, rate_limiter.LoginShield(
+			ip_limiter=rate_limiter.RateLimiter(rate_limiter.MemoryBucketBackend(), capacity=20, rate=10 / 60),
+			username_limiter=rate_limiter.RateLimiter(rate_limiter.MemoryBucketBackend(), capacity=5, rate=5 / 60),
+			unknown_usernames=rate_limiter.NegativeCache(ttl=300),
+		)),
+	}
+	results['cpu_seconds_saved'] = results['unprotected']['cpu_seconds'] - results['shielded']['cpu_seconds']
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Measures the CPU time saved by the login shield under a synthetic credential stuffing attack')
+	parser.add_argument('-n', '--attempts', type=int, default=2000, help='Number of login attempts')
+	parser.add_argument('-a', '--accounts', type=int, default=20, help='Number of existing accounts')
+	parser.add_argument('-i', '--ips', type=int, default=5, help='Number of attacker IPs')
+	args = parser.parse_args()
+	benchmark_login_shield(args)
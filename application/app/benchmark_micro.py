@@ -0,0 +1,102 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, base64, random, tempfile, time
+from datetime import datetime, timedelta
+from app import crud, health_series, clinician_dashboard, smart_diet_watcher, inference, benchmark_report
+from app.benchmark_load import get_image_data
+from app.database import SessionLocal
+
+
+def measure(function, repeat: int, warmup: int, after=None):
+	# after runs outside of the timings, e.g. to clear the session so every call queries the database
+	for _ in range(warmup):
+		function()
+		if(after is not None):
+			after()
+
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		timings.append(time.perf_counter() - start)
+		if(after is not None):
+			after()
+	return benchmark_report.summarize(timings)
+
+
+def get_crud_cases(db, patient_id: int, clinician_id: int):
+	since = datetime.now() - timedelta(days=1)
+	patient_ids = list(crud.get_accepted_patient_ids(db, clinician_id))
+	return {
+		'crud.get_user_by_id': lambda: crud.get_user_by_id(db, patient_id),
+		'crud.get_user_meal_list': lambda: [meal.food_items for meal in crud.get_user_meal_list(db, patient_id, None, 0, 20)],
+		'crud.get_user_meal_list_search': lambda: crud.get_user_meal_list(db, patient_id, 'rice', 0, 20),
+		'crud.get_user_health_record_list': lambda: crud.get_user_health_record_list(db, patient_id, None, 0, 20),
+		'crud.get_latest_health_record': lambda: crud.get_latest_health_record(db, patient_id),
+		'crud.get_profile': lambda: crud.get_profile(db, patient_id),
+		'crud.get_user_meals_changed_since': lambda: crud.get_user_meals_changed_since(db, patient_id, since),
+		'crud.search_food': lambda: crud.search_food(db, 'rice', 0, 20),
+		'health_series.get_series': lambda: health_series.get_series(db, patient_id, 'weight', 'week'),
+		'clinician_dashboard.get_patient_summaries': lambda: clinician_dashboard.get_patient_summaries(db, patient_ids, 5),
+	}
+
+
+def get_smart_diet_watcher_cases(rng, model):
+	image_data = get_image_data(rng)
+	image = base64.b64decode(image_data.split(',')[1])
+
+	# load_classification_image reads from disk like the meal endpoints
+	image_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+	image_file.write(image)
+	image_file.close()
+
+	cases = {
+		'smart_diet_watcher.get_content_address': lambda: smart_diet_watcher.get_content_address(image),
+		'smart_diet_watcher.create_thumbnail': lambda: smart_diet_watcher.create_thumbnail(image, 'jpg'),
+		'smart_diet_watcher.decode_image_data': lambda: smart_diet_watcher.decode_image_data(image_data),
+		'smart_diet_watcher.load_classification_image': lambda: smart_diet_watcher.load_classification_image(image_file.name, (224, 224)),
+	}
+	if(model is not None):
+		# Uncached, predict_probabilities caches results by image path
+		cases['smart_diet_watcher.predict_probabilities'] = lambda: smart_diet_watcher.predict_probabilities.__wrapped__(model, image_file.name)
+	return cases, image_file.name
+
+
+def benchmark_micro(args):
+	rng = random.Random(args.seed)
+	results = {}
+
+	if(not args.skip_database):
+		db = SessionLocal()
+		patient = crud.get_user_by_email(db, benchmark_report.PATIENT_EMAIL.format(0))
+		clinician = crud.get_user_by_email(db, benchmark_report.CLINICIAN_EMAIL.format(0))
+		if(patient is None or clinician is None):
+			print('[ERROR] no benchmark users, generate them with generate_benchmark_data.py or run with --skip-database')
+			sys.exit(1)
+
+		for name, function in get_crud_cases(db, patient.user_id, clinician.user_id).items():
+			if(args.cases is None or name in args.cases):
+				results[name] = measure(function, args.repeat, args.warmup, db.expunge_all)
+		db.close()
+
+	model = inference.load_local_backend(inference.MODEL_CLASSIFICATION) if args.model else None
+	cases, image_path = get_smart_diet_watcher_cases(rng, model)
+	for name, function in cases.items():
+		if(args.cases is None or name in args.cases):
+			results[name] = measure(function, args.repeat, args.warmup)
+	os.remove(image_path)
+
+	parameters = {key: value for key, value in vars(args).items() if key != 'output'}
+	benchmark_report.write_report(benchmark_report.create_report('micro', parameters, results), args.output)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Times crud and smart_diet_watcher functions on the data of generate_benchmark_data.py')
+	parser.add_argument('-r', '--repeat', type=int, default=100, help='Number of timed calls per case')
+	parser.add_argument('-w', '--warmup', type=int, default=5, help='Number of untimed calls per case first')
+	parser.add_argument('-c', '--cases', nargs='+', help='Names of the cases to run, all by default')
+	parser.add_argument('--model', action='store_true', help='Also time the food classification model configured by FOOD_CLASSIFICATION_BACKEND')
+	parser.add_argument('--skip-database', action='store_true', help='Only run the cases which do not need the database')
+	parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed of the generated image')
+	parser.add_argument('-o', '--output', help='File the JSON report is written to, compare reports with benchmark_report.py')
+	args = parser.parse_args()
+	benchmark_micro(args)
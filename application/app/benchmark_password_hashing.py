@@ -0,0 +1,71 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, asyncio, json, time
+import numpy as np
+from app import security
+
+
+async def heartbeat(interval, lags, stop):
+	# Stand-in for an unrelated endpoint, records how late the event loop schedules it
+	while not stop.is_set():
+		start = time.perf_counter()
+		await asyncio.sleep(interval)
+		lags.append(time.perf_counter() - start - interval)
+
+
+async def login_inline(password, password_hash):
+	return security.verify_and_update_password(password, password_hash)
+
+
+async def run(login, password_hash, password, logins, concurrency):
+	lags = []
+	stop = asyncio.Event()
+	heartbeat_task = asyncio.ensure_future(heartbeat(0.005, lags, stop))
+
+	semaphore = asyncio.Semaphore(concurrency)
+	async def limited_login():
+		async with semaphore:
+			try:
+				await login(password, password_hash)
+				return True
+			except security.PasswordHasherBusyError:
+				return False
+
+	start = time.perf_counter()
+	results = await asyncio.gather(*[limited_login() for _ in range(logins)])
+	elapsed = time.perf_counter() - start
+
+	stop.set()
+	await heartbeat_task
+
+	return {
+		'logins_per_second': sum(results) / elapsed,
+		'rejected': len(results) - sum(results),
+		'unrelated_lag_p50_ms': float(np.percentile(lags, 50) * 1000) if lags else None,
+		'unrelated_lag_p99_ms': float(np.percentile(lags, 99) * 1000) if lags else None,
+	}
+
+
+def benchmark_password_hashing(args):
+	password = 'benchmark-password'
+	password_hash = security.get_password_hash(password)
+	hasher = security.PasswordHasher(args.workers, args.max_pending)
+
+	loop = asyncio.get_event_loop()
+	results = {
+		'rounds': security.PASSWORD_HASH_ROUNDS,
+		'inline': loop.run_until_complete(run(login_inline, password_hash, password, args.logins, args.concurrency)),
+		'process_pool': loop.run_until_complete(run(hasher.verify_and_update, password_hash, password, args.logins, args.concurrency)),
+	}
+	hasher.shutdown()
+
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compares login throughput and event loop latency of inline and process pool password hashing')
+	parser.add_argument('-n', '--logins', type=int, default=100, help='Number of logins')
+	parser.add_argument('-c', '--concurrency', type=int, default=32, help='Number of concurrent logins')
+	parser.add_argument('-w', '--workers', type=int, default=security.PASSWORD_HASH_WORKERS, help='Number of hashing processes')
+	parser.add_argument('-p', '--max-pending', type=int, default=security.PASSWORD_HASH_MAX_PENDING, help='Number of hashing requests allowed to wait')
+	args = parser.parse_args()
+	benchmark_password_hashing(args)
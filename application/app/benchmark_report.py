@@ -0,0 +1,151 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, math, platform, subprocess
+from datetime import datetime
+
+# Accounts of the users of generate_benchmark_data.py, which benchmark_load.py logs in
+PATIENT_EMAIL = 'benchmark-patient-{}@example.com'
+CLINICIAN_EMAIL = 'benchmark-clinician-{}@example.com'
+
+# Metrics compared between reports, and whether lower values are better
+COMPARED_METRICS = {
+	'median_ms': True,
+	'p95_ms': True,
+	'per_second': False,
+	'startup_ms': True,
+	'max_rss_mb': True,
+}
+
+
+def get_commit():
+	# Reports of different commits are compared, a dirty tree is flagged as it matches no commit
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL).decode().strip()
+		dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL).decode().strip() != ''
+	except (OSError, subprocess.CalledProcessError):
+		return None, None
+	return commit, dirty
+
+
+def get_percentile(values, percentile: float):
+	# Nearest rank on the sorted values
+	index = max(0, math.ceil(percentile / 100 * len(values)) - 1)
+	return values[index]
+
+
+def summarize(seconds, elapsed: float = None, errors: int = 0):
+	'''
+	Summarize timings
+
+	Parameters:
+		seconds (list): Duration of each call
+		elapsed (float): Wall time of the calls, the throughput is computed from it, defaults to their sum
+		errors (int): Number of failed calls, not part of seconds
+	Return:
+		Dict containing the count, errors, throughput, mean, median, p95, p99 and max in milliseconds
+	'''
+
+	values = sorted(seconds)
+	if(not values):
+		return {'count': 0, 'errors': errors}
+
+	elapsed = elapsed if elapsed is not None else sum(values)
+	return {
+		'count': len(values),
+		'errors': errors,
+		'per_second': len(values) / elapsed if elapsed else None,
+		'mean_ms': sum(values) / len(values) * 1000,
+		'median_ms': get_percentile(values, 50) * 1000,
+		'p95_ms': get_percentile(values, 95) * 1000,
+		'p99_ms': get_percentile(values, 99) * 1000,
+		'max_ms': values[-1] * 1000,
+	}
+
+
+def create_report(benchmark: str, parameters: dict, results: dict):
+	commit, dirty = get_commit()
+	return {
+		'benchmark': benchmark,
+		'commit': commit,
+		'dirty': dirty,
+		'date': datetime.now().isoformat(),
+		'python': platform.python_version(),
+		'machine': platform.machine(),
+		'parameters': parameters,
+		'results': results,
+	}
+
+
+def write_report(report: dict, output: str = None):
+	# Printed like the other benchmarks, and kept in a file for comparison with later commits
+	content = json.dumps(report, indent=2)
+	print(content)
+	if(output):
+		with open(output, 'w') as f:
+			f.write(content + '\n')
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float):
+	'''
+	Compare the results of two reports of the same benchmark
+
+	Return:
+		List of dicts containing the case, metric, both values, the relative change and whether it regressed by more
+		than threshold
+	'''
+
+	changes = []
+	for case, baseline_result in baseline['results'].items():
+		current_result = current['results'].get(case)
+		if(current_result is None):
+			continue
+		for metric, lower_is_better in COMPARED_METRICS.items():
+			before = baseline_result.get(metric)
+			after = current_result.get(metric)
+			if(not before or after is None):
+				continue
+			change = (after - before) / before
+			changes.append({
+				'case': case,
+				'metric': metric,
+				'baseline': before,
+				'current': after,
+				'change': change,
+				'regression': change > threshold if lower_is_better else change < -threshold,
+			})
+	return changes
+
+
+def main(args):
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+	with open(args.current) as f:
+		current = json.load(f)
+
+	if(baseline['benchmark'] != current['benchmark']):
+		print('[ERROR] reports of different benchmarks: {} and {}'.format(baseline['benchmark'], current['benchmark']))
+		sys.exit(2)
+	if(baseline['parameters'] != current['parameters']):
+		print('[INFO] the reports were run with different parameters, the comparison may not be meaningful')
+
+	changes = compare_reports(baseline, current, args.threshold)
+	print(json.dumps({
+		'benchmark': current['benchmark'],
+		'baseline_commit': baseline['commit'],
+		'current_commit': current['commit'],
+		'threshold': args.threshold,
+		'regressions': [change for change in changes if change['regression']],
+		'changes': changes,
+	}, indent=2))
+
+	# Non-zero so a CI job fails on a regression
+	if(any(change['regression'] for change in changes)):
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compares two reports of the same benchmark, e.g. of the previous and the current commit')
+	parser.add_argument('baseline', help='Report of the baseline, written with --output by a benchmark')
+	parser.add_argument('current', help='Report to compare with the baseline')
+	parser.add_argument('-t', '--threshold', type=float, default=0.1, help='Relative change counted as a regression')
+	args = parser.parse_args()
+	main(args)
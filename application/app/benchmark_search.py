@@ -0,0 +1,104 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, statistics, time
+from sqlalchemy import event, text
+from app import crud
+from app.database import SessionLocal, engine
+
+BENCHMARK_EMAIL = 'search-benchmark-{}@example.com'
+
+# New food types entered by hand when no food of the catalog matched
+NEW_FOOD_TYPES = ['homemade curry', 'grilled chicken salad', 'banana bread', 'egg fried rice', 'lentil soup', 'beef noodle soup', 'tuna sandwich', 'mango smoothie']
+
+
+def seed(db, users, meals, food_items):
+	# Generated in SQL, a million food items would take minutes through the ORM
+	db.execute(text('''
+		INSERT INTO "User" (email, name, account_type, disabled, date_created)
+		SELECT format(:email, n), 'Search benchmark ' || n, 0, false, now() FROM generate_series(1, :users) n
+		ON CONFLICT (email) DO NOTHING
+	'''), {'email': BENCHMARK_EMAIL.replace('{}', '%s'), 'users': users})
+	db.execute(text('''
+		INSERT INTO "Meal" (user_id, date_created)
+		SELECT "User".user_id, now() - m * interval '6 hours' FROM "User" CROSS JOIN generate_series(1, :meals) m
+		WHERE "User".email LIKE 'search-benchmark-%'
+	'''), {'meals': meals})
+	db.execute(text('''
+		WITH catalog AS (SELECT array_agg(food_id) AS food_ids FROM "Food"), types AS (SELECT CAST(:types AS VARCHAR[]) AS names)
+		INSERT INTO "FoodItem" (meal_id, food_id, measurement_id, new_food_type, volume_consumed, date_created)
+		SELECT "Meal".meal_id,
+			CASE WHEN random() < 0.9 THEN catalog.food_ids[1 + floor(random() * array_length(catalog.food_ids, 1))::int] END,
+			(SELECT min(measurement_id) FROM "Measurement"),
+			CASE WHEN random() >= 0.9 THEN types.names[1 + floor(random() * array_length(types.names, 1))::int] END,
+			random() * 300, "Meal".date_created
+		FROM "Meal" JOIN "User" ON "User".user_id = "Meal".user_id CROSS JOIN catalog CROSS JOIN types CROSS JOIN generate_series(1, :food_items) i
+		WHERE "User".email LIKE 'search-benchmark-%'
+	'''), {'types': NEW_FOOD_TYPES, 'food_items': food_items})
+	db.commit()
+	db.execute(text('ANALYZE "User"; ANALYZE "Meal"; ANALYZE "FoodItem"; ANALYZE "Food"'))
+
+
+def benchmark_search(args):
+	if(engine.dialect.name != 'postgresql'):
+		print('[INFO] the search indexes are Postgres specific, set POSTGRESQL_CONNECTION to a scratch database')
+		sys.exit(1)
+
+	db = SessionLocal()
+	if(args.seed):
+		start = time.perf_counter()
+		seed(db, args.users, args.meals, args.food_items)
+		print('[INFO] seeded {} users in {:.1f} s'.format(args.users, time.perf_counter() - start))
+
+	user_id = db.execute(text('SELECT user_id FROM "User" WHERE email = :email'), {'email': BENCHMARK_EMAIL.format(1)}).scalar()
+	if(user_id is None):
+		print('[INFO] no benchmark users, run with --seed first')
+		sys.exit(1)
+	food_item_count = db.execute(text('SELECT count(*) FROM "FoodItem"')).scalar()
+
+	# Keep the statement of the search so its plan can be reported
+	statements = []
+	event.listen(engine, 'before_cursor_execute', lambda conn, cursor, statement, parameters, context, executemany: statements.append((statement, parameters)))
+
+	results = {'food_items': food_item_count, 'queries': {}}
+	for query in args.queries:
+		timings = []
+		for _ in range(args.repeat):
+			statements.clear()
+			start = time.perf_counter()
+			meals = crud.get_user_meal_list(db, user_id, query, 0, 20)
+			timings.append(time.perf_counter() - start)
+
+		statement, parameters = statements[0]
+		plan = None
+		if(args.explain):
+			# The captured statement is in the paramstyle of the driver, run it on the raw cursor
+			cursor = db.connection().connection.cursor()
+			cursor.execute('EXPLAIN ANALYZE ' + statement, parameters)
+			plan = [row[0] for row in cursor.fetchall()]
+			cursor.close()
+		results['queries'][query] = {
+			'meals': len(meals),
+			'median_ms': statistics.median(timings) * 1000,
+			'max_ms': max(timings) * 1000,
+			'plan': plan,
+		}
+
+		food_start = time.perf_counter()
+		foods = crud.search_food(db, query, 0, 20)
+		results['queries'][query]['food_search_ms'] = (time.perf_counter() - food_start) * 1000
+		results['queries'][query]['foods'] = len(foods)
+
+	db.close()
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmarks the meal and food search of the list endpoints on a scratch database')
+	parser.add_argument('--seed', action='store_true', help='Generate the benchmark users, meals and food items first')
+	parser.add_argument('-u', '--users', type=int, default=1000, help='Number of users seeded')
+	parser.add_argument('-m', '--meals', type=int, default=333, help='Number of meals seeded per user')
+	parser.add_argument('-f', '--food-items', type=int, default=3, help='Number of food items seeded per meal')
+	parser.add_argument('-q', '--queries', nargs='+', default=['rice', 'chicken salad', 'soup', 'xyz'], help='Search queries timed')
+	parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of times each query is run')
+	parser.add_argument('--explain', action='store_true', help='Report the EXPLAIN ANALYZE plan of each query')
+	args = parser.parse_args()
+	benchmark_search(args)
@@ -0,0 +1,76 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, random, time
+from datetime import datetime, timedelta
+from app import models, schemas, fast_json
+
+
+def generate_meals(count, food_items_per_meal, nutritions_per_food):
+	# Transient ORM objects shaped like the result of crud.get_user_meal_list
+	measurement = models.Measurement(measurement_description='Gram', measurement_conversion_to_g=1.0, suffix='g')
+	nutritions = [
+		models.FoodNutrition(food_nutrition_id=index, nutrition_code='N{}'.format(index), nutrition_name='Nutrition {}'.format(index), nutrition_measurement_suffix='g')
+		for index in range(nutritions_per_food)
+	]
+
+	foods = []
+	for index in range(20):
+		food = models.Food(food_id='food_{}'.format(index), food_name='Food {}'.format(index))
+		food.food_nutritions = [
+			models.FoodNutritionAssociation(nutrition=nutrition, nutrition_value=round(random.uniform(0.1, 500), 2))
+			for nutrition in nutritions
+		]
+		foods.append(food)
+
+	meals = []
+	date_created = datetime(2020, 6, 1, 12, 30, 15, 123456)
+	for meal_id in range(count):
+		meal = models.Meal(meal_id=meal_id, user_id=1, image='{:064x}.jpg'.format(meal_id), blood_glucose=round(random.uniform(4, 9), 1),
+			date_created=date_created - timedelta(hours=meal_id))
+		meal.food_items = [
+			models.FoodItem(food_item_id=meal_id * food_items_per_meal + index, meal_id=meal_id, volume_consumed=round(random.uniform(10, 300), 1),
+				per_unit_measurement=1.0, food=random.choice(foods), measurement=measurement)
+			for index in range(food_items_per_meal)
+		]
+		meals.append(meal)
+
+	return meals
+
+
+def measure(function, repeat):
+	start = time.perf_counter()
+	for _ in range(repeat):
+		body = function()
+	return (time.perf_counter() - start) / repeat, len(body)
+
+
+def benchmark_serialization(args):
+	meals = generate_meals(args.meals, args.food_items, args.nutritions)
+
+	mismatch = fast_json.check_contract(schemas.MealWithFoodItems, meals)
+	if(mismatch is not None):
+		print('[ERROR] fast path output differs from the response_model path')
+		print(mismatch['expected'])
+		print(mismatch['actual'])
+		sys.exit(1)
+	print('[INFO] contract check passed for {} meals'.format(len(meals)))
+
+	pydantic_seconds, size = measure(lambda: fast_json.encode_pydantic(schemas.MealWithFoodItems, meals), args.repeat)
+	fast_seconds, _ = measure(lambda: fast_json.encode(schemas.MealWithFoodItems, meals), args.repeat)
+
+	print(json.dumps({
+		'meals_per_page': args.meals,
+		'bytes_per_page': size,
+		'pydantic_ms_per_page': pydantic_seconds * 1000,
+		'fast_json_ms_per_page': fast_seconds * 1000,
+		'speedup': pydantic_seconds / fast_seconds,
+	}, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmarks the serialization of meal list pages')
+	parser.add_argument('-m', '--meals', type=int, default=100, help='Number of meals per page')
+	parser.add_argument('-f', '--food-items', type=int, default=3, help='Number of food items per meal')
+	parser.add_argument('-n', '--nutritions', type=int, default=10, help='Number of nutritions per food')
+	parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of pages serialized')
+	args = parser.parse_args()
+	benchmark_serialization(args)
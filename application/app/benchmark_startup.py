@@ -0,0 +1,60 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, statistics, subprocess
+from app import benchmark_report
+
+# Run in a new interpreter per measurement, modules imported by a previous run would make the next one look free
+MEASURE_CODE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from app import inference
+models = [{load}(model_name) for model_name in inference.MODELS]
+loaded = time.perf_counter()
+print(json.dumps({{
+	'import_ms': (imported - start) * 1000,
+	'load_ms': (loaded - imported) * 1000,
+	'startup_ms': (loaded - start) * 1000,
+	'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+	'tensorflow_imported': 'tensorflow' in sys.modules,
+}}))
+'''
+
+# Processes measured as (module imported, function loading the models, INFERENCE_MODE)
+PROCESSES = {
+	'local': ('app.main', 'inference.get_backend', 'local'),
+	'lazy': ('app.main', 'inference.get_backend', 'lazy'),
+	'remote': ('app.main', 'inference.get_backend', 'remote'),
+	'inference_worker': ('app.inference_worker', 'inference.load_local_backend', 'local'),
+}
+
+
+def measure(module: str, load: str, mode: str):
+	# Models are loaded like the startup of the API or of the inference worker, without starting the rest of the app
+	env = dict(os.environ, INFERENCE_MODE=mode)
+	output = subprocess.check_output([sys.executable, '-c', MEASURE_CODE.format(module=module, load=load)],
+		cwd=os.path.join(os.path.dirname(__file__), '..'), env=env)
+	return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def benchmark_startup(args):
+	results = {}
+	for name, (module, load, mode) in PROCESSES.items():
+		if(args.processes is not None and name not in args.processes):
+			continue
+		print('[INFO] measuring {}'.format(name))
+		runs = [measure(module, load, mode) for _ in range(args.repeat)]
+		results[name] = {metric: statistics.median(run[metric] for run in runs) for metric in ('import_ms', 'load_ms', 'startup_ms', 'max_rss_mb')}
+		results[name]['tensorflow_imported'] = any(run['tensorflow_imported'] for run in runs)
+
+	parameters = {key: value for key, value in vars(args).items() if key != 'output'}
+	benchmark_report.write_report(benchmark_report.create_report('startup', parameters, results), args.output)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Measures the import time, model loading time and peak RSS of an API worker in each inference mode, and of the inference worker')
+	parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of new processes measured per mode, the medians are reported')
+	parser.add_argument('-p', '--processes', nargs='+', choices=list(PROCESSES), help='Processes to measure, all by default')
+	parser.add_argument('-o', '--output', help='File the JSON report is written to, compare reports with benchmark_report.py')
+	args = parser.parse_args()
+	benchmark_startup(args)
@@ -0,0 +1,60 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, time
+from datetime import datetime, timedelta
+import httpx
+from app import delta_sync
+
+
+def fetch(client, paths, headers):
+	# Bytes on the wire are the body as sent, i.e. compressed when Content-Encoding is set
+	wire_bytes = 0
+	start = time.perf_counter()
+	for path in paths:
+		with client.stream('GET', path, headers=headers) as response:
+			response.raise_for_status()
+			for chunk in response.iter_raw():
+				wire_bytes += len(chunk)
+	return time.perf_counter() - start, wire_bytes
+
+
+def measure(client, paths, headers, repeat):
+	elapsed, wire_bytes = 0, 0
+	for _ in range(repeat):
+		seconds, size = fetch(client, paths, headers)
+		elapsed += seconds
+		wire_bytes = size
+	return {'requests': len(paths), 'ms': elapsed / repeat * 1000, 'bytes': wire_bytes}
+
+
+def benchmark_sync(args):
+	headers = {'Authorization': 'Bearer {}'.format(args.token), 'Accept-Encoding': args.encoding}
+
+	# What the app fetches on every launch today
+	refetch_paths = ['/profile/']
+	refetch_paths += ['/meals/?skip={}&limit=20'.format(page * 20) for page in range(args.pages)]
+	refetch_paths += ['/health-records/?skip={}&limit=20'.format(page * 20) for page in range(args.pages)]
+
+	# The token the app would hold after syncing the previous day
+	token = delta_sync.encode_token(datetime.now() - timedelta(hours=args.hours))
+
+	with httpx.Client(base_url=args.url) as client:
+		results = {
+			'full_refetch': measure(client, refetch_paths, headers, args.repeat),
+			'full_sync': measure(client, ['/sync'], headers, args.repeat),
+			'delta_sync': measure(client, ['/sync?since={}'.format(token)], headers, args.repeat),
+		}
+
+	results['delta_sync']['hours'] = args.hours
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Compares a daily delta sync to the full refetch of the app on launch')
+	parser.add_argument('token', help='Access token of a user with a realistic history')
+	parser.add_argument('-u', '--url', default='http://localhost:8000', help='URL of a running server')
+	parser.add_argument('-p', '--pages', type=int, default=5, help='Number of pages of meals and health records refetched')
+	parser.add_argument('-H', '--hours', type=float, default=24, help='Age of the token of the delta sync')
+	parser.add_argument('-e', '--encoding', default='gzip', help='Accept-Encoding of the requests')
+	parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of times each request set is made')
+	args = parser.parse_args()
+	benchmark_sync(args)
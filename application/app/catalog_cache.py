@@ -0,0 +1,149 @@
+# catalog_cache.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import bisect
+import threading
+import traceback
+from sqlalchemy.orm import joinedload
+from app import models, notifications
+from app.database import SessionLocal
+
+# Postgres channel notified when the catalog version is bumped
+CATALOG_CHANNEL = 'catalog_changed'
+
+
+class CatalogSnapshot:
+	'''
+	Immutable copy of the reference tables (Food, FoodNutrition and Measurement) at a catalog version.
+	Rows are detached from their session, they are read only.
+	'''
+
+	def __init__(self, version: int, foods: list, nutritions: list, measurements: list):
+		self.version = version
+		self.foods = {food.food_id: food for food in foods}
+		self.enabled_foods = sorted([food for food in foods if food.enabled], key=lambda food: food.food_index)
+		self.enabled_food_indexes = [food.food_index for food in self.enabled_foods]
+		self.nutritions_by_code = {nutrition.nutrition_code: nutrition for nutrition in nutritions}
+		self.measurements_by_suffix = {measurement.suffix: measurement for measurement in measurements}
+
+
+def get_catalog_version(db):
+	db_catalog_version = db.query(models.CatalogVersion).first()
+	return db_catalog_version.version if db_catalog_version is not None else 0
+
+
+def load_snapshot():
+	db = SessionLocal()
+	try:
+		version = get_catalog_version(db)
+		foods = db.query(models.Food).options(
+			joinedload(models.Food.food_nutritions).joinedload(models.FoodNutritionAssociation.nutrition)
+		).all()
+		nutritions = db.query(models.FoodNutrition).all()
+		measurements = db.query(models.Measurement).all()
+		db.expunge_all()
+	finally:
+		db.close()
+
+	return CatalogSnapshot(version, foods, nutritions, measurements)
+
+
+class CatalogCache:
+	'''
+	Process local cache of the reference tables.
+
+	The snapshot is loaded at startup and reloaded when the catalog version changes,
+	either on a NOTIFY on the catalog_changed channel, received by notifications.listener,
+	or when polled every poll_interval seconds.
+	Until start() is called every lookup returns None and callers query the database.
+	'''
+
+	def __init__(self, poll_interval: float = 30):
+		self.poll_interval = poll_interval
+		self.snapshot = None
+		self.__thread = None
+		self.__stop = threading.Event()
+		self.__changed = threading.Event()
+
+	def start(self):
+		self.reload()
+		self.__stop.clear()
+		self.__thread = threading.Thread(target=self._watch, name='catalog-cache', daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		self.__stop.set()
+		self.__changed.set()
+
+	def notify(self, payload: str = None):
+		# Called by the notification listener thread, the snapshot is reloaded by the watch thread
+		self.__changed.set()
+
+	def reload(self):
+		# Swap in a complete snapshot, readers never see a partially loaded catalog
+		self.snapshot = load_snapshot()
+		print(f"[INFO] Catalog version {self.snapshot.version} loaded")
+
+	def reload_if_changed(self):
+		db = SessionLocal()
+		try:
+			version = get_catalog_version(db)
+		finally:
+			db.close()
+
+		if(self.snapshot is None or version != self.snapshot.version):
+			self.reload()
+
+	@property
+	def version(self):
+		return self.snapshot.version if self.snapshot is not None else None
+
+	def _watch(self):
+		# Notifications sent while the listener is disconnected are lost, the version is polled in any case
+		while not self.__stop.is_set():
+			self.__changed.wait(self.poll_interval)
+			self.__changed.clear()
+			if(not self.__stop.is_set()):
+				self._poll()
+
+	def _poll(self):
+		try:
+			self.reload_if_changed()
+		except Exception:
+			traceback.print_exc()
+
+	### Lookups, None if the cache has not been started
+	def get_food(self, food_id: str):
+		snapshot = self.snapshot
+		if(snapshot is None):
+			return None
+		return snapshot.foods.get(food_id)
+
+	def get_food_list(self, skip: int):
+		snapshot = self.snapshot
+		if(snapshot is None):
+			return None
+
+		return snapshot.enabled_foods[bisect.bisect_right(snapshot.enabled_food_indexes, skip):]
+
+	def get_food_nutrition_by_code(self, food_nutrition_code: str):
+		snapshot = self.snapshot
+		if(snapshot is None):
+			return None
+		return snapshot.nutritions_by_code.get(food_nutrition_code)
+
+	def get_measurements_by_suffix(self):
+		snapshot = self.snapshot
+		if(snapshot is None):
+			return None
+		return snapshot.measurements_by_suffix
+
+
+catalog = CatalogCache(poll_interval=float(os.getenv('CATALOG_POLL_INTERVAL') or 30))
+
+notifications.listener.subscribe(CATALOG_CHANNEL, catalog.notify)
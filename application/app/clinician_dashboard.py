@@ -0,0 +1,67 @@
+# clinician_dashboard.py
+
+### Imports
+from types import SimpleNamespace
+from sqlalchemy.orm import Session
+from app import crud, schemas, fast_json
+
+# Patients loaded per round of queries, each round is streamed before the next one starts
+DASHBOARD_BATCH_SIZE = 50
+
+
+def get_patient_summaries(db: Session, user_ids: list, meal_limit: int):
+	'''
+	Load the dashboard of a batch of patients with one query per table
+
+	Parameters:
+		db (Session): Database session
+		user_ids (list): Patient user IDs
+		meal_limit (int): Number of recent meals per patient
+	Return:
+		List of patient summaries, ordered as user_ids
+	'''
+
+	users = {user.user_id: user for user in crud.get_users_by_ids(db, user_ids)}
+	profiles = {profile.user_id: profile for profile in crud.get_profiles_by_user_ids(db, user_ids)}
+	health_records = {health_record.user_id: health_record for health_record in crud.get_latest_health_records_by_user_ids(db, user_ids)}
+
+	meals = crud.get_recent_meals_by_user_ids(db, user_ids, meal_limit)
+	food_items = {}
+	if(meals):
+		for food_item in crud.get_food_items_by_meal_ids(db, [meal.meal_id for meal in meals]):
+			food_items.setdefault(food_item.meal_id, []).append(food_item)
+
+	# Meals are summarized without their deleted food items, the relationship itself is left untouched
+	recent_meals = {}
+	for meal in meals:
+		summary = SimpleNamespace(**{name: getattr(meal, name) for name in schemas.Meal.__fields__})
+		summary.food_items = food_items.get(meal.meal_id, [])
+		recent_meals.setdefault(meal.user_id, []).append(summary)
+
+	summaries = []
+	for user_id in user_ids:
+		user = users.get(user_id)
+		if(user is None):
+			continue
+		summaries.append(SimpleNamespace(
+			user_id=user.user_id,
+			email=user.email,
+			name=user.name,
+			contact_information=user.contact_information,
+			profile=profiles.get(user_id),
+			latest_health_record=health_records.get(user_id),
+			recent_meals=recent_meals.get(user_id, []),
+		))
+
+	return summaries
+
+
+def iterate_dashboard(db: Session, clinician_id: int, meal_limit: int):
+	'''
+	Generate the dashboard of every patient with an accepted assignment as NDJSON, one patient per line
+	'''
+
+	user_ids = sorted(crud.get_accepted_patient_ids(db, clinician_id))
+	for start in range(0, len(user_ids), DASHBOARD_BATCH_SIZE):
+		summaries = get_patient_summaries(db, user_ids[start:start + DASHBOARD_BATCH_SIZE], meal_limit)
+		yield b''.join(fast_json.encode_object(schemas.ClinicianDashboardPatient, summary) + b'\n' for summary in summaries)
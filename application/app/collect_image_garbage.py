@@ -0,0 +1,35 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse
+from app import crud, smart_diet_watcher
+from app.database import SessionLocal
+
+
+def collect_image_garbage(args):
+	# initialize session
+	print('[INFO] initialize session')
+	db = SessionLocal()
+
+	# Images are shared between meals, only remove images which are no longer referenced by a meal
+	unreferenced_images = crud.get_unreferenced_meal_images(db)
+	print('[INFO] {} unreferenced images found'.format(len(unreferenced_images)))
+
+	deleted = 0
+	for row in unreferenced_images:
+		if(args.dry_run):
+			print('[INFO] would delete {}'.format(smart_diet_watcher.get_image_path(row.user_id, row.image)))
+			continue
+
+		# Meals uploaded since the query may reference the image, uploads wait for the lock until it is committed
+		crud.lock_image(db, row.image, shared=False)
+		if(crud.get_image_reference_count(db, row.image) == 0):
+			deleted += smart_diet_watcher.delete_image(row.user_id, row.image)
+		db.commit()
+
+	print('[INFO] {} files deleted'.format(deleted))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Deletes images and thumbnails which are only referenced by deleted meals')
+	parser.add_argument('-d', '--dry-run', action='store_const', const=True, default=False, help='List the images without deleting them')
+	args = parser.parse_args()
+	collect_image_garbage(args)
@@ -0,0 +1,148 @@
+# compression.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import gzip
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+# Brotli is optional, responses are only gzip compressed without it
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# Already compressed or streamed content, compressing it wastes CPU or breaks streaming
+EXCLUDED_CONTENT_TYPES = ('image/', 'video/', 'audio/', 'application/zip', 'application/gzip', 'text/event-stream')
+
+
+def get_accepted_encoding(accept_encoding: str):
+	accepted = {}
+	for value in (accept_encoding or '').split(','):
+		parts = value.split(';')
+		encoding = parts[0].strip().lower()
+		quality = 1.0
+		for parameter in parts[1:]:
+			name, _, parameter_value = parameter.strip().partition('=')
+			if(name == 'q'):
+				try:
+					quality = float(parameter_value)
+				except ValueError:
+					quality = 0.0
+		accepted[encoding] = quality
+
+	for encoding in ('br', 'gzip'):
+		if(encoding == 'br' and brotli is None):
+			continue
+		if(accepted.get(encoding, 0) > 0):
+			return encoding
+	return None
+
+
+def compress(body: bytes, encoding: str, level: int):
+	if(encoding == 'br'):
+		# Brotli qualities range from 0 to 11, gzip levels from 1 to 9
+		return brotli.compress(body, quality=min(11, level + 2))
+	return gzip.compress(body, compresslevel=level)
+
+
+class CompressionMiddleware:
+	'''
+	Compresses responses negotiated through Accept-Encoding with brotli or gzip.
+
+	Responses smaller than minimum_size, streamed responses, responses which already have a Content-Encoding,
+	and responses under the excluded path prefixes are sent as is.
+	Bodies larger than offload_size are compressed in the threadpool instead of on the event loop.
+	'''
+
+	def __init__(self, app, minimum_size: int = 1024, level: int = 6, offload_size: int = 256 * 1024, excluded_paths=()):
+		self.app = app
+		self.minimum_size = minimum_size
+		self.level = level
+		self.offload_size = offload_size
+		self.excluded_paths = tuple(excluded_paths)
+
+	async def __call__(self, scope, receive, send):
+		if(scope['type'] != 'http' or scope['path'].startswith(self.excluded_paths)):
+			await self.app(scope, receive, send)
+			return
+
+		encoding = get_accepted_encoding(Headers(scope=scope).get('accept-encoding'))
+		if(encoding is None):
+			await self.app(scope, receive, send)
+			return
+
+		await CompressionResponder(self, encoding)(scope, receive, send)
+
+
+class CompressionResponder:
+	def __init__(self, middleware: CompressionMiddleware, encoding: str):
+		self.middleware = middleware
+		self.encoding = encoding
+		self.send = None
+		self.initial_message = None
+		self.started = False
+		self.passthrough = False
+
+	async def __call__(self, scope, receive, send):
+		self.send = send
+		await self.middleware.app(scope, receive, self.send_compressed)
+
+	async def send_compressed(self, message):
+		if(message['type'] == 'http.response.start'):
+			# Held back until the body shows whether it is worth compressing
+			self.initial_message = message
+			return
+
+		if(message['type'] != 'http.response.body' or self.passthrough):
+			await self.send(message)
+			return
+
+		if(not self.started):
+			self.started = True
+			headers = MutableHeaders(raw=self.initial_message['headers'])
+			body = message.get('body', b'')
+
+			if(message.get('more_body', False) or not self.should_compress(headers, body)):
+				self.passthrough = True
+				await self.send(self.initial_message)
+				await self.send(message)
+				return
+
+			if(len(body) > self.middleware.offload_size):
+				body = await run_in_threadpool(compress, body, self.encoding, self.middleware.level)
+			else:
+				body = compress(body, self.encoding, self.middleware.level)
+
+			headers['Content-Encoding'] = self.encoding
+			headers['Content-Length'] = str(len(body))
+			headers.add_vary_header('Accept-Encoding')
+			message['body'] = body
+
+			await self.send(self.initial_message)
+			await self.send(message)
+
+	def should_compress(self, headers, body: bytes):
+		if(len(body) < self.middleware.minimum_size):
+			return False
+		if('content-encoding' in headers):
+			return False
+		return not headers.get('content-type', '').startswith(EXCLUDED_CONTENT_TYPES)
+
+
+def get_compression_options():
+	'''
+	Return:
+		Keyword arguments of CompressionMiddleware configured through the environment
+	'''
+
+	return {
+		'minimum_size': int(os.getenv('COMPRESSION_MINIMUM_SIZE') or 1024),
+		'level': int(os.getenv('COMPRESSION_LEVEL') or 6),
+		'offload_size': int(os.getenv('COMPRESSION_OFFLOAD_SIZE') or 256 * 1024),
+		'excluded_paths': ('/image/', '/thumbnail/'),
+	}
@@ -1,6 +1,13 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy import text, func, or_
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from app import models, schemas, security
+from types import SimpleNamespace
+from app import models, schemas, health_series, notifications
+from app.catalog_cache import catalog, CATALOG_CHANNEL
+from app.authorization_cache import clinician_authorization, ASSIGNMENT_CHANNEL
+from app.rate_limiter import USER_CREATED_CHANNEL
 
 # Function to process a food item and update its nutritional value with accordance to total weight
 def processFoodItem(food_item : schemas.FoodItemWithNutrition):
@@ -14,6 +21,9 @@ def processFoodItem(food_item : schemas.FoodItemWithNutrition):
 					food_item.food.food_nutritions[i].nutrition_value = round(raw_nutrition_values[i], 5)
 		return food_item
 
+# First key of the advisory locks on images, the second is the hash of the file name
+IMAGE_LOCK_NAMESPACE = 1
+
 ### User
 def get_user_by_id(db: Session, user_id: int): 
 	return db.query(models.User).filter(models.User.user_id == user_id).first()
@@ -21,44 +31,41 @@ def get_user_by_id(db: Session, user_id: int):
 def get_user_by_email(db: Session, email: str):
 	return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, email: str, password: str, account_type: int):
-	db_user = models.User(
-		email = email,
-		password = security.get_password_hash(password),
-		account_type = account_type,
-		date_created = datetime.now()
-	)
-
-	db.add(db_user)
+def create_user(db: Session, email: str, password_hash: str, account_type: int):
+	db_user = insert_returning(db, models.User, {
+		'email': email,
+		'password': password_hash,
+		'account_type': account_type,
+		'date_created': datetime.now(),
+	})
+	# Every worker forgets the email as an unknown username when the transaction commits
+	notifications.notify(db, USER_CREATED_CHANNEL, email.lower())
 	db.commit()
-	db.refresh(db_user)
-	
-	return db_user
-
-def verify_user_password(db: Session, user_id: int, password: str):
-	db_user = db.query(models.User).filter(models.User.user_id == user_id).first()
-
-	if(db_user is not None):
-		return security.verify_password(password, db_user.password)
 
-	return False
+	return db_user
 
-def update_user_password(db: Session, user_id: int, new_password: str):
+def update_user_password(db: Session, user_id: int, new_password_hash: str):
 	db.query(models.User).filter(models.User.user_id == user_id).update({
-		models.User.password: security.get_password_hash(new_password),
+		models.User.password: new_password_hash,
 		models.User.password_updated_date: datetime.now(),
 	})
 
 	db.commit()
 
-def update_user_info(db: Session, user_id: int, user_info: schemas.UserInfo):
-	db_user = get_user_by_id(db, user_id)
+def update_user_password_hash(db: Session, user_id: int, password_hash: str):
+	# Rehash of the same password, password_updated_date is kept so existing tokens stay valid
+	db.query(models.User).filter(models.User.user_id == user_id).update({
+		models.User.password: password_hash,
+	})
 
-	db_user.name = user_info.name
-	db_user.contact_information = user_info.contact_information
+	db.commit()
 
+def update_user_info(db: Session, user_id: int, user_info: schemas.UserInfo):
+	db_user = update_returning(db, models.User, models.User.user_id == user_id, {
+		'name': user_info.name,
+		'contact_information': user_info.contact_information,
+	})
 	db.commit()
-	db.refresh(db_user)
 
 	return db_user
 
@@ -95,39 +102,63 @@ def user_view_assignments(db: Session, user_id: int):
 def clinician_view_assignments(db: Session, clinician_id: int):
 	return db.query(models.ClinicianAssignment).filter(models.ClinicianAssignment.clinician_id == clinician_id).all()
 
-def create_clinician_assignment(db: Session, clinician_id: int, user_id: int):
+def get_accepted_patient_ids(db: Session, clinician_id: int):
+	patient_ids = clinician_authorization.get(clinician_id)
+	if patient_ids is not None:
+		return patient_ids
+
+	generation = clinician_authorization.generation
+	rows = db.query(models.ClinicianAssignment.user_id).filter(models.ClinicianAssignment.clinician_id == clinician_id, models.ClinicianAssignment.assignment_accepted == True).all()
+	return clinician_authorization.set(clinician_id, [row.user_id for row in rows], generation)
+
+def get_accepted_clinician_ids(db: Session, user_id: int):
+	rows = db.query(models.ClinicianAssignment.clinician_id).filter(models.ClinicianAssignment.user_id == user_id, models.ClinicianAssignment.assignment_accepted == True).all()
+	return [row.clinician_id for row in rows]
+
+def notify_clinician_assignment_changed(db: Session, clinician_id: int):
+	# Every worker drops the clinician's cached patients when the transaction commits, this one without waiting for the NOTIFY
+	notifications.notify(db, ASSIGNMENT_CHANNEL, str(clinician_id))
+	notifications.after_commit(db, lambda: clinician_authorization.invalidate(clinician_id))
+
+def create_clinician_assignment(db: Session, clinician_id: int, user_id: int, commit: bool = True):
 	db_clinician = get_user_by_id(db, clinician_id)
 	db_clinician_assignment = db.query(models.ClinicianAssignment).filter(models.ClinicianAssignment.clinician_id == clinician_id).filter(models.ClinicianAssignment.user_id == user_id).all()
 	# check if assignment exists and the clinician's account type
 	if(len(db_clinician_assignment) != 0 or db_clinician is None or db_clinician.account_type != 1):
 		return None
 	else:
-		db_clinician_assignment = models.ClinicianAssignment(
-			clinician_id = clinician_id,
-			user_id = user_id,
-		)
+		db_clinician_assignment = insert_returning(db, models.ClinicianAssignment, {
+			'clinician_id': clinician_id,
+			'user_id': user_id,
+		})
+		# Read before the commit expires the clinician
+		db_clinician_assignment.clinician = schemas.Clinician.from_orm(db_clinician)
 
-		db.add(db_clinician_assignment)
-		db.commit()
-		db.refresh(db_clinician_assignment)
+		notify_clinician_assignment_changed(db, clinician_id)
+		if commit:
+			db.commit()
 
 		return db_clinician_assignment
 
-def update_clinician_assignment_status(db: Session, clinician_assignment_id: int, status: bool):
-	db_clinician_assignment = db.query(models.ClinicianAssignment).filter(models.ClinicianAssignment.clinician_assignment_id == clinician_assignment_id).first()
+def update_clinician_assignment_status(db: Session, clinician_assignment_id: int, status: bool, commit: bool = True):
+	db_clinician_assignment = update_returning(db, models.ClinicianAssignment, models.ClinicianAssignment.clinician_assignment_id == clinician_assignment_id, {
+		'assignment_accepted': status,
+	})
 
-	db_clinician_assignment.assignment_accepted = status
-	db.commit()
+	notify_clinician_assignment_changed(db, db_clinician_assignment.clinician_id)
+	if commit:
+		db.commit()
 
-	db.refresh(db_clinician_assignment)
 	return db_clinician_assignment
 
-def delete_clinician_assignment(db: Session, clinician_assignment_id: int):
+def delete_clinician_assignment(db: Session, clinician_assignment_id: int, commit: bool = True):
 	db_clinician_assignment = db.query(models.ClinicianAssignment).filter(models.ClinicianAssignment.clinician_assignment_id == clinician_assignment_id).first()
 
 	if(db_clinician_assignment is not None):
 		db.delete(db_clinician_assignment)
-		db.commit()
+		notify_clinician_assignment_changed(db, db_clinician_assignment.clinician_id)
+		if commit:
+			db.commit()
 
 		return True
 	else:
@@ -137,6 +168,27 @@ def delete_clinician_assignment(db: Session, clinician_assignment_id: int):
 def clinician_generate_report(db: Session, parameters: str):
 	pass
 
+### Clinician Dashboard, one query per table for a batch of patients
+def get_users_by_ids(db: Session, user_ids: list):
+	return db.query(models.User).filter(models.User.user_id.in_(user_ids)).all()
+
+def get_profiles_by_user_ids(db: Session, user_ids: list):
+	return db.query(models.Profile).filter(models.Profile.user_id.in_(user_ids)).all()
+
+def get_latest_health_records_by_user_ids(db: Session, user_ids: list):
+	row_number = func.row_number().over(partition_by=models.HealthRecord.user_id, order_by=models.HealthRecord.date_created.desc()).label('row_number')
+	latest = db.query(models.HealthRecord.health_record_id, row_number).filter(models.HealthRecord.user_id.in_(user_ids), models.HealthRecord.date_deleted == None).subquery()
+	return db.query(models.HealthRecord).join(latest, latest.c.health_record_id == models.HealthRecord.health_record_id).filter(latest.c.row_number == 1).all()
+
+def get_recent_meals_by_user_ids(db: Session, user_ids: list, limit: int):
+	row_number = func.row_number().over(partition_by=models.Meal.user_id, order_by=models.Meal.meal_id.desc()).label('row_number')
+	recent = db.query(models.Meal.meal_id, row_number).filter(models.Meal.user_id.in_(user_ids), models.Meal.date_deleted == None).subquery()
+	return db.query(models.Meal).join(recent, recent.c.meal_id == models.Meal.meal_id).filter(recent.c.row_number <= limit).order_by(models.Meal.meal_id.desc()).all()
+
+def get_food_items_by_meal_ids(db: Session, meal_ids: list):
+	return db.query(models.FoodItem).options(joinedload(models.FoodItem.food)).filter(models.FoodItem.meal_id.in_(meal_ids), models.FoodItem.date_deleted == None).all()
+
+
 # debug
 def get_users(db: Session, skip: int, limit: int):
 	return db.query(models.User).offset(skip).limit(limit).all()
@@ -144,26 +196,44 @@ def get_users(db: Session, skip: int, limit: int):
 
 ### Food
 def create_food(db: Session, food = schemas.Food):
-	db_food = models.Food(
-		**food.dict()
-	)
-
-	db.add(db_food)
+	db_food = insert_returning(db, models.Food, food.dict())
 	db.commit()
-	db.refresh(db_food)
 
 	return db_food
 
 def get_food_list(db: Session, skip: int):
+	food_list = catalog.get_food_list(skip)
+	if food_list is not None:
+		return food_list
 	return db.query(models.Food).filter(models.Food.enabled == True, models.Food.food_index > skip).order_by(models.Food.food_index.asc()).all()
 
+def search_food(db: Session, query: str, skip: int, limit: int):
+	return db.query(models.Food).filter(models.Food.enabled == True, get_name_search_condition(db, models.Food.food_name, query)).order_by(models.Food.food_index.asc()).offset(skip).limit(limit).all()
+
 def get_food(db: Session, food_id: int):
+	# Foods added after the catalog was loaded are read from the database
+	food = catalog.get_food(food_id)
+	if food is not None:
+		return food
 	return db.query(models.Food).filter(models.Food.food_id == food_id).first()
 
 
 def get_food_by_type(db: Session):
 	pass
 
+def bump_catalog_version(db: Session):
+	# Reference tables changed, every worker reloads its catalog cache
+	updated = db.query(models.CatalogVersion).update({
+		models.CatalogVersion.version: models.CatalogVersion.version + 1,
+		models.CatalogVersion.date_modified: datetime.now(),
+	})
+	if not updated:
+		db.add(models.CatalogVersion(version = 1, date_modified = datetime.now()))
+
+	# Delivered to listeners when the transaction commits
+	notifications.notify(db, CATALOG_CHANNEL)
+	db.commit()
+
 
 
 ### FoodNutrition
@@ -171,10 +241,16 @@ def get_food_nutrition(db: Session, food_nutrition_id: int):
 	return db.query(models.FoodNutrition).filter(models.FoodNutrition.food_nutrition_id == food_nutrition_id).first()
 
 def get_food_nutrition_by_code(db: Session, food_nutrition_code: str):
+	food_nutrition = catalog.get_food_nutrition_by_code(food_nutrition_code)
+	if food_nutrition is not None:
+		return food_nutrition
 	return db.query(models.FoodNutrition).filter(models.FoodNutrition.nutrition_code == food_nutrition_code).first()
 
 
 def get_food_nutrition_list(db: Session, food_id: int):
+	food = catalog.get_food(food_id)
+	if food is not None:
+		return food
 	return db.query(models.Food).filter(models.Food.food_id == food_id).first()
 
 
@@ -194,26 +270,112 @@ def get_risk_score_value(db: Session, risk_score_value_id: int):
 
 
 
+### Search
+# Text search configuration of the full-text indexes, names are not stemmed
+SEARCH_CONFIGURATION = 'simple'
+
+def get_name_search_condition(db: Session, column, query: str):
+	# Substring match served by the pg_trgm index, or a match of every word served by the tsvector index
+	escaped_query = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+	condition = column.ilike(f"%{escaped_query}%", escape='\\')
+	if db.bind.dialect.name == 'postgresql':
+		condition = or_(condition, func.to_tsvector(SEARCH_CONFIGURATION, column).op('@@')(func.plainto_tsquery(SEARCH_CONFIGURATION, query)))
+	return condition
+
+
+### Single round trip writes
+def get_insert_values(table, values: dict):
+	# Like the ORM, a None value of a column with a default inserts the default, e.g. FoodItem.per_unit_measurement
+	return {key: table.columns[key].default.arg if value is None and table.columns[key].default is not None and table.columns[key].default.is_scalar else value for key, value in values.items()}
+
+
+def insert_returning(db: Session, model, values: dict):
+	'''
+	Insert a row and read it back in the same statement, INSERT ... RETURNING on Postgres
+
+	Return:
+		The row with every column as attributes, not tracked by the session so it stays readable after commit
+	'''
+
+	table = model.__table__
+	values = get_insert_values(table, values)
+	if db.bind.dialect.name == 'postgresql':
+		row = db.execute(table.insert().values(values).returning(*table.columns)).first()
+	else:
+		primary_key = db.execute(table.insert().values(values)).inserted_primary_key
+		row = db.execute(table.select().where(list(table.primary_key.columns)[0] == primary_key[0])).first()
+	return SimpleNamespace(**dict(row))
+
+
+def update_returning(db: Session, model, condition, values: dict):
+	'''
+	Update the row matching condition and read it back in the same statement, UPDATE ... RETURNING on Postgres
+
+	Return:
+		The updated row like insert_returning, None if no row matched
+	'''
+
+	table = model.__table__
+	if db.bind.dialect.name == 'postgresql':
+		row = db.execute(table.update().where(condition).values(values).returning(*table.columns)).first()
+	else:
+		db.execute(table.update().where(condition).values(values))
+		row = db.execute(table.select().where(condition)).first()
+	if row is None:
+		return None
+
+	# An instance of the row loaded earlier in the session would keep its old values, it is reloaded on next access
+	instance = db.identity_map.get(identity_key(model, tuple(row[column.name] for column in table.primary_key.columns)))
+	if instance is not None:
+		db.expire(instance)
+	return SimpleNamespace(**dict(row))
+
+
+### Bulk insert
+def insert_returning_ids(db: Session, model, rows: list):
+	# One multi-row INSERT ... RETURNING on Postgres, which returns the rows in the order of the VALUES list
+	if not rows:
+		return []
+	table = model.__table__
+	primary_key = list(table.primary_key.columns)[0]
+	rows = [get_insert_values(table, row) for row in rows]
+	if db.bind.dialect.name == 'postgresql':
+		return [row[0] for row in db.execute(table.insert().values(rows).returning(primary_key))]
+	return [db.execute(table.insert().values(row)).inserted_primary_key[0] for row in rows]
+
+
 ### Meal
 def get_meal(db: Session, meal_id: int):
 	return db.query(models.Meal).filter(models.Meal.meal_id == meal_id).first()
 
 
-def get_user_meal_list(db: Session, user_id: int, query: str, skip: int, limit: int):
-	meal_list = db.query(models.Meal).filter(models.Meal.user_id == user_id, models.Meal.date_deleted == None).order_by(models.Meal.meal_id.desc()).offset(skip).limit(limit).all()
+def get_user_meal_list(db: Session, user_id: int, query: str, skip: int, limit: int, start: datetime = None, end: datetime = None):
+	meal_query = db.query(models.Meal).filter(models.Meal.user_id == user_id, models.Meal.date_deleted == None)
+	if start is not None:
+		meal_query = meal_query.filter(models.Meal.date_created >= start)
+	if end is not None:
+		meal_query = meal_query.filter(models.Meal.date_created < end)
+	if query:
+		# Meals containing a food item whose food name or new food type matches
+		matching_meal_ids = db.query(models.FoodItem.meal_id).outerjoin(models.Food, models.Food.food_id == models.FoodItem.food_id).filter(
+			models.FoodItem.date_deleted == None,
+			or_(get_name_search_condition(db, models.Food.food_name, query), get_name_search_condition(db, models.FoodItem.new_food_type, query)),
+		)
+		meal_query = meal_query.filter(models.Meal.meal_id.in_(matching_meal_ids))
+
+	# Food items of the page in one query instead of one per meal
+	meal_list = meal_query.options(selectinload(models.Meal.food_items)).order_by(models.Meal.meal_id.desc()).offset(skip).limit(limit).all()
 	for count, meal in enumerate(meal_list):
 		meal_list[count].food_items = [food_item for food_item in meal.food_items if food_item.date_deleted is None]
 	return meal_list
 
-def create_meal(db: Session, user_id: int, image: str):
-	db_meal = models.Meal(
-		user_id = user_id,
-		image = image,
-		date_created = datetime.now(),
-	)
-
-	db.add(db_meal)
-	# db.flush()
+def create_meal(db: Session, user_id: int, image: str, food_predictions: str = None, commit: bool = True):
+	db_meal = insert_returning(db, models.Meal, {
+		'user_id': user_id,
+		'image': image,
+		'food_predictions': food_predictions,
+		'date_created': datetime.now(),
+	})
 
 	# for food_item in meal.food_items:
 	# 	db_food_item = models.FoodItem(
@@ -223,24 +385,47 @@ def create_meal(db: Session, user_id: int, image: str):
 	# 	)
 	# 	db.add(db_food_item)
 
-	db.commit()
-	db.refresh(db_meal)
+	if commit:
+		db.commit()
 
 	return db_meal
 
 
-def update_meal_blood_glucose(db: Session, meal_id: int, blood_glucose = schemas.MealUpdateBloodGlucose):
-	db.query(models.Meal).filter(models.Meal.meal_id == meal_id).update({
-		models.Meal.blood_glucose: blood_glucose.blood_glucose,
-		models.Meal.date_modified: datetime.now(),
+def update_meal_blood_glucose(db: Session, meal_id: int, blood_glucose = schemas.MealUpdateBloodGlucose, commit: bool = True):
+	db_meal = update_returning(db, models.Meal, models.Meal.meal_id == meal_id, {
+		'blood_glucose': blood_glucose.blood_glucose,
+		'date_modified': datetime.now(),
 	})
-	db.commit()
+	if commit:
+		db.commit()
 
-	return db.query(models.Meal).filter(models.Meal.meal_id == meal_id).first().blood_glucose
+	return db_meal.blood_glucose
 
-def delete_meal(db: Session, meal_id: int):
+def delete_meal(db: Session, meal_id: int, commit: bool = True):
 	db.query(models.Meal).filter(models.Meal.meal_id == meal_id).update({models.Meal.date_deleted: datetime.now()})
-	db.commit()
+	if commit:
+		db.commit()
+
+def get_meal_predictions_by_image(db: Session, image: str):
+	# Images are content addressed, a known image has already been classified
+	db_meal = db.query(models.Meal.food_predictions).filter(models.Meal.image == image, models.Meal.food_predictions != None).first()
+	if db_meal is None:
+		return None
+	return db_meal.food_predictions
+
+def get_image_reference_count(db: Session, image: str):
+	return db.query(models.Meal).filter(models.Meal.image == image, models.Meal.date_deleted == None).count()
+
+def lock_image(db: Session, image: str, shared: bool):
+	# Held until the transaction ends. Meal uploads share it, collect_image_garbage takes it exclusively to delete
+	if db.bind.dialect.name == 'postgresql':
+		function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+		db.execute(text(f"SELECT {function}(:namespace, hashtext(:image))"), {'namespace': IMAGE_LOCK_NAMESPACE, 'image': image})
+
+def get_unreferenced_meal_images(db: Session):
+	# Images only referenced by soft deleted meals
+	referenced_images = db.query(models.Meal.image).filter(models.Meal.date_deleted == None, models.Meal.image != None)
+	return db.query(models.Meal.user_id, models.Meal.image).filter(models.Meal.date_deleted != None, models.Meal.image != None, ~models.Meal.image.in_(referenced_images)).distinct().all()
 
 
 
@@ -253,47 +438,89 @@ def get_food_items_list_by_meal_id(db: Session, meal_id: int):
 	return db.query(models.FoodItem).filter(models.FoodItem.meal_id == meal_id, models.FoodItem.date_deleted == None).all()
 
 
-def create_food_item(db: Session, meal_id: int, food_item: schemas.FoodItemCreateUpdate):
-	db_food_item = models.FoodItem(
-		food_id = food_item.food_id,
-		volume_consumed = food_item.volume_consumed,
-		per_unit_measurement = food_item.per_unit_measurement,
-		new_food_type = food_item.new_food_type,
-		meal_id = meal_id,
-		date_created = datetime.now(),
-	)
-
-	db_food_item.measurement = get_measurement_by_suffix(db, food_item.measurement_suffix)
-	db.add(db_food_item)
-	db.commit()
-	db.refresh(db_food_item)
-
+def get_food_item_relations(db: Session, db_food_item, measurement: models.Measurement):
+	# The food and measurement of a written food item, from the catalog rather than lazy loads
+	db_food_item.food = get_food(db, db_food_item.food_id) if db_food_item.food_id is not None else None
+	db_food_item.measurement = measurement
 	return db_food_item
 
 
-def update_food_item(db: Session, food_item_id: int, food_item: schemas.FoodItemCreateUpdate):
-	db_food_item = db.query(models.FoodItem).filter(models.FoodItem.food_item_id == food_item_id).first()
+def create_food_item(db: Session, meal_id: int, food_item: schemas.FoodItemCreateUpdate, commit: bool = True):
+	# Cached measurements are shared between sessions, reference them by id
+	measurement = get_measurement_by_suffix(db, food_item.measurement_suffix)
+	db_food_item = insert_returning(db, models.FoodItem, {
+		'food_id': food_item.food_id,
+		'volume_consumed': food_item.volume_consumed,
+		'per_unit_measurement': food_item.per_unit_measurement,
+		'new_food_type': food_item.new_food_type,
+		'meal_id': meal_id,
+		'measurement_id': measurement.measurement_id,
+		'date_created': datetime.now(),
+	})
+	if commit:
+		db.commit()
+
+	return get_food_item_relations(db, db_food_item, measurement)
+
+
+def create_food_items(db: Session, food_items: list):
+	'''
+	Insert food items in one statement without committing
+
+	Parameters:
+		food_items (list): (meal_id, schemas.FoodItemCreateUpdate) tuples, food_id already resolved
+	Return:
+		Food item IDs, in the order of food_items
+	'''
+
+	date_created = datetime.now()
+	return insert_returning_ids(db, models.FoodItem, [{
+		'food_id': food_item.food_id,
+		'volume_consumed': food_item.volume_consumed,
+		'per_unit_measurement': food_item.per_unit_measurement,
+		'new_food_type': food_item.new_food_type,
+		'meal_id': meal_id,
+		'measurement_id': get_measurement_by_suffix(db, food_item.measurement_suffix).measurement_id,
+		'date_created': date_created,
+	} for meal_id, food_item in food_items])
+
+
+def update_food_item(db: Session, food_item_id: int, food_item: schemas.FoodItemCreateUpdate, commit: bool = True):
+	measurement = get_measurement_by_suffix(db, food_item.measurement_suffix)
+	db_food_item = update_returning(db, models.FoodItem, models.FoodItem.food_item_id == food_item_id, {
+		'food_id': food_item.food_id,
+		'new_food_type': food_item.new_food_type,
+		'volume_consumed': food_item.volume_consumed,
+		'per_unit_measurement': food_item.per_unit_measurement,
+		'measurement_id': measurement.measurement_id,
+		'date_modified': datetime.now(),
+	})
 	if not bool(db_food_item):
 		raise Exception("Food Item does not exist.")
-	db_food_item.food_id = food_item.food_id
-	db_food_item.new_food_type = food_item.new_food_type
-	db_food_item.volume_consumed = food_item.volume_consumed
-	db_food_item.per_unit_measurement = food_item.per_unit_measurement
-	db_food_item.measurement = get_measurement_by_suffix(db, food_item.measurement_suffix)
-	db_food_item.date_modified = datetime.now()
-	db.commit()
+	if commit:
+		db.commit()
 
+	return get_food_item_relations(db, db_food_item, measurement)
 
-def delete_food_item(db: Session, food_item_id: int):
+
+def delete_food_item(db: Session, food_item_id: int, commit: bool = True):
 	db.query(models.FoodItem).filter(models.FoodItem.food_item_id == food_item_id).update({models.FoodItem.date_deleted: datetime.now()})
-	db.commit()
+	if commit:
+		db.commit()
 
 ### Measurements
 def get_measurement_by_suffix(db: Session, measurement_suffix: str):
-	measurement = db.query(models.Measurement).filter(models.Measurement.suffix == measurement_suffix).first()
+	measurements = catalog.get_measurements_by_suffix()
+	if measurements is not None:
+		measurement = measurements.get(measurement_suffix)
+		available_measurements = " ,".join(measurements.keys())
+	else:
+		measurement = db.query(models.Measurement).filter(models.Measurement.suffix == measurement_suffix).first()
+		available_measurements = None
 	if bool(measurement):
 		return measurement 
-	available_measurements = " ,".join([i[0] for i in db.query(models.Measurement.suffix).all()])
+	if available_measurements is None:
+		available_measurements = " ,".join([i[0] for i in db.query(models.Measurement.suffix).all()])
 	raise Exception(f"Provided Measurement type does not exist. Available measurements are: {available_measurements}")
 
 
@@ -303,35 +530,32 @@ def get_profile(db: Session, user_id: int):
 
 
 def create_profile(db: Session, user_id: int, profile: schemas.ProfileBase):
-	db_profile = models.Profile(
-		**profile.dict(),
+	db_profile = insert_returning(db, models.Profile, dict(
+		profile.dict(),
 		date_created = datetime.now(),
 		user_id = user_id,
-	)
-
-	db.add(db_profile)
+	))
 	db.commit()
-	db.refresh(db_profile)
 
 	return db_profile
 
 
 def update_profile(db: Session, user_id: int, profile: schemas.ProfileBase):
-	db.query(models.Profile).filter(models.Profile.user_id == user_id).update({
-		models.Profile.date_of_birth: profile.date_of_birth,
-		models.Profile.height: profile.height,
-		models.Profile.gender: profile.gender,
-		models.Profile.ethnicity: profile.ethnicity,
-		models.Profile.family_history_diabetes_non_immediate: profile.family_history_diabetes_non_immediate,
-		models.Profile.family_history_diabetes_parents: profile.family_history_diabetes_parents,
-		models.Profile.family_history_diabetes_siblings: profile.family_history_diabetes_siblings,
-		models.Profile.family_history_diabetes_children: profile.family_history_diabetes_children,
-		models.Profile.high_blood_glucose_history: profile.high_blood_glucose_history,
-		models.Profile.high_blood_pressure_medication_history: profile.high_blood_pressure_medication_history,
-		models.Profile.date_modified: datetime.now(),
+	db_profile = update_returning(db, models.Profile, models.Profile.user_id == user_id, {
+		'date_of_birth': profile.date_of_birth,
+		'height': profile.height,
+		'gender': profile.gender,
+		'ethnicity': profile.ethnicity,
+		'family_history_diabetes_non_immediate': profile.family_history_diabetes_non_immediate,
+		'family_history_diabetes_parents': profile.family_history_diabetes_parents,
+		'family_history_diabetes_siblings': profile.family_history_diabetes_siblings,
+		'family_history_diabetes_children': profile.family_history_diabetes_children,
+		'high_blood_glucose_history': profile.high_blood_glucose_history,
+		'high_blood_pressure_medication_history': profile.high_blood_pressure_medication_history,
+		'date_modified': datetime.now(),
 	})
 	db.commit()
-	return db.query(models.Profile).filter(models.Profile.user_id == user_id).first()
+	return db_profile
 
 
 
@@ -344,47 +568,195 @@ def get_latest_health_record(db: Session, user_id: int):
 	return db.query(models.HealthRecord).filter(models.HealthRecord.user_id == user_id).filter(models.HealthRecord.date_deleted == None).order_by(models.HealthRecord.date_created.desc()).first()
 
 
-def get_user_health_record_list(db: Session, user_id: int, query: str, skip: int, limit: int):
-	return db.query(models.HealthRecord).filter(models.HealthRecord.user_id == user_id).filter(models.HealthRecord.date_deleted == None).order_by(models.HealthRecord.health_record_id.desc()).offset(skip).limit(limit).all()
+def get_user_health_record_list(db: Session, user_id: int, query: str, skip: int, limit: int, start: datetime = None, end: datetime = None):
+	# Health records have no text to search, only the date range applies
+	health_record_query = db.query(models.HealthRecord).filter(models.HealthRecord.user_id == user_id).filter(models.HealthRecord.date_deleted == None)
+	if start is not None:
+		health_record_query = health_record_query.filter(models.HealthRecord.date_created >= start)
+	if end is not None:
+		health_record_query = health_record_query.filter(models.HealthRecord.date_created < end)
+	return health_record_query.order_by(models.HealthRecord.health_record_id.desc()).offset(skip).limit(limit).all()
 
 
 def create_health_record(db: Session, user_id: int, health_record = schemas.HealthRecordCreate):
-	db_health_record = models.HealthRecord(
-		**health_record.dict(),
+	db_health_record = insert_returning(db, models.HealthRecord, dict(
+		health_record.dict(),
 		date_created = datetime.now(),
 		user_id = user_id,
-	)
-
-	db.add(db_health_record)
+	))
+	health_series.update_rollups(db, user_id, db_health_record.date_created)
 	db.commit()
-	db.refresh(db_health_record)
-	
+
 	return db_health_record
 
 
-def update_health_record(db: Session, user_id: int, health_record_id: int, health_record = schemas.HealthRecordUpdate):
-	db.query(models.HealthRecord).filter(models.HealthRecord.health_record_id == health_record_id).update({
-		models.HealthRecord.waist_circumference: health_record.waist_circumference,
-		models.HealthRecord.weight: health_record.weight,
-		models.HealthRecord.blood_pressure_medication: health_record.blood_pressure_medication,
-		models.HealthRecord.physical_exercise_hours: health_record.physical_exercise_hours,
-		models.HealthRecord.physical_exercise_minutes: health_record.physical_exercise_minutes,
-		models.HealthRecord.smoking: health_record.smoking,
-		models.HealthRecord.vegetable_fruit_berries_consumption: health_record.vegetable_fruit_berries_consumption,
-		models.HealthRecord.systolic_pressure: health_record.systolic_pressure,
-		models.HealthRecord.fasting_blood_glucose: health_record.fasting_blood_glucose,
-		models.HealthRecord.hdl_cholesterol: health_record.hdl_cholesterol,
-		models.HealthRecord.triglycerides: health_record.triglycerides,
-		models.HealthRecord.date_modified: datetime.now(),
+def create_health_records(db: Session, user_id: int, health_records: list):
+	# Insert health records in one statement without committing, the rollups of the day are updated once
+	date_created = datetime.now()
+	health_record_ids = insert_returning_ids(db, models.HealthRecord, [
+		dict(health_record.dict(), date_created = date_created, user_id = user_id) for health_record in health_records
+	])
+	health_series.update_rollups(db, user_id, date_created)
+	return health_record_ids
+
+
+def update_health_record(db: Session, user_id: int, health_record_id: int, health_record = schemas.HealthRecordUpdate, commit: bool = True):
+	db_health_record = update_returning(db, models.HealthRecord, models.HealthRecord.health_record_id == health_record_id, {
+		'waist_circumference': health_record.waist_circumference,
+		'weight': health_record.weight,
+		'blood_pressure_medication': health_record.blood_pressure_medication,
+		'physical_exercise_hours': health_record.physical_exercise_hours,
+		'physical_exercise_minutes': health_record.physical_exercise_minutes,
+		'smoking': health_record.smoking,
+		'vegetable_fruit_berries_consumption': health_record.vegetable_fruit_berries_consumption,
+		'systolic_pressure': health_record.systolic_pressure,
+		'fasting_blood_glucose': health_record.fasting_blood_glucose,
+		'hdl_cholesterol': health_record.hdl_cholesterol,
+		'triglycerides': health_record.triglycerides,
+		'date_modified': datetime.now(),
 	})
+	if db_health_record is not None:
+		health_series.update_rollups(db, db_health_record.user_id, db_health_record.date_created)
+	if commit:
+		db.commit()
+	else:
+		db.flush()
+
+	return db_health_record
+
+
+def delete_health_record(db: Session, health_record_id: int, commit: bool = True):
+	db_health_record = update_returning(db, models.HealthRecord, models.HealthRecord.health_record_id == health_record_id, {'date_deleted': datetime.now()})
+	if db_health_record is not None:
+		health_series.update_rollups(db, db_health_record.user_id, db_health_record.date_created)
+	if commit:
+		db.commit()
+	else:
+		db.flush()
+
+
+### Sync, rows created, modified or soft-deleted after a watermark, every row of the user when since is None
+def get_changed_condition(model, since: datetime):
+	if since is None:
+		return model.date_deleted == None
+	return or_(model.date_created > since, model.date_modified > since, model.date_deleted > since)
+
+
+def get_user_meals_changed_since(db: Session, user_id: int, since: datetime = None):
+	return db.query(models.Meal).filter(models.Meal.user_id == user_id, get_changed_condition(models.Meal, since)).order_by(models.Meal.meal_id.asc()).all()
+
+
+def get_user_food_items_changed_since(db: Session, user_id: int, since: datetime = None):
+	food_item_query = db.query(models.FoodItem).join(models.Meal, models.Meal.meal_id == models.FoodItem.meal_id).options(joinedload(models.FoodItem.food), joinedload(models.FoodItem.measurement)).filter(
+		models.Meal.user_id == user_id, get_changed_condition(models.FoodItem, since))
+	if since is None:
+		food_item_query = food_item_query.filter(models.Meal.date_deleted == None)
+	return food_item_query.order_by(models.FoodItem.food_item_id.asc()).all()
+
+
+def get_user_health_records_changed_since(db: Session, user_id: int, since: datetime = None):
+	return db.query(models.HealthRecord).filter(models.HealthRecord.user_id == user_id, get_changed_condition(models.HealthRecord, since)).order_by(models.HealthRecord.health_record_id.asc()).all()
+
+
+def get_profile_changed_since(db: Session, user_id: int, since: datetime = None):
+	# Profiles are never deleted
+	profile_query = db.query(models.Profile).filter(models.Profile.user_id == user_id)
+	if since is not None:
+		profile_query = profile_query.filter(or_(models.Profile.date_created > since, models.Profile.date_modified > since))
+	return profile_query.first()
+
+
+### Idempotency
+def get_idempotency_keys(db: Session, user_id: int, idempotency_keys: list, since: datetime):
+	return db.query(models.IdempotencyKey).filter(
+		models.IdempotencyKey.user_id == user_id,
+		models.IdempotencyKey.idempotency_key.in_(idempotency_keys),
+		models.IdempotencyKey.date_created >= since,
+	).all()
+
+
+def create_idempotency_keys(db: Session, user_id: int, endpoint: str, responses: list, since: datetime):
+	# Flushed in the transaction of the writes the keys protect, responses are (idempotency_key, status_code, response) tuples
+	date_created = datetime.now()
+	keys = [idempotency_key for idempotency_key, _, _ in responses]
+
+	# Keys expired before since may be reused, a live key stored concurrently fails the insert instead
+	db.query(models.IdempotencyKey).filter(
+		models.IdempotencyKey.user_id == user_id,
+		models.IdempotencyKey.idempotency_key.in_(keys),
+		models.IdempotencyKey.date_created < since,
+	).delete(synchronize_session=False)
+	db.add_all([models.IdempotencyKey(
+		user_id = user_id,
+		idempotency_key = idempotency_key,
+		endpoint = endpoint,
+		status_code = status_code,
+		response = response,
+		date_created = date_created,
+	) for idempotency_key, status_code, response in responses])
+	db.flush()
+
+
+def get_idempotency_key(db: Session, user_id: int, idempotency_key: str):
+	return db.query(models.IdempotencyKey).filter(models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.idempotency_key == idempotency_key).first()
+
+
+def claim_idempotency_key(db: Session, user_id: int, idempotency_key: str, endpoint: str, request_hash: str):
+	# Committed before the request runs so duplicates in every worker see it in flight, False if the key exists
+	db.add(models.IdempotencyKey(
+		user_id = user_id,
+		idempotency_key = idempotency_key,
+		endpoint = endpoint,
+		request_hash = request_hash,
+		date_created = datetime.now(),
+	))
+	try:
+		db.commit()
+		return True
+	except IntegrityError:
+		db.rollback()
+		return False
+
+
+def take_over_idempotency_key(db: Session, user_id: int, idempotency_key: str, endpoint: str, request_hash: str, date_created: datetime):
+	# Claim an expired key or one left in flight by a failed worker, only one of several concurrent requests succeeds
+	count = db.query(models.IdempotencyKey).filter(
+		models.IdempotencyKey.user_id == user_id,
+		models.IdempotencyKey.idempotency_key == idempotency_key,
+		models.IdempotencyKey.date_created == date_created,
+	).update({
+		models.IdempotencyKey.endpoint: endpoint,
+		models.IdempotencyKey.request_hash: request_hash,
+		models.IdempotencyKey.status_code: None,
+		models.IdempotencyKey.response: None,
+		models.IdempotencyKey.date_created: datetime.now(),
+	}, synchronize_session=False)
 	db.commit()
+	return count == 1
 
-	return db.query(models.HealthRecord).filter(models.HealthRecord.health_record_id == health_record_id).first()
+
+def complete_idempotency_key(db: Session, user_id: int, idempotency_key: str, status_code: int, response: str):
+	db.query(models.IdempotencyKey).filter(models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.idempotency_key == idempotency_key).update({
+		models.IdempotencyKey.status_code: status_code,
+		models.IdempotencyKey.response: response,
+	}, synchronize_session=False)
+	db.commit()
+
+
+def release_idempotency_key(db: Session, user_id: int, idempotency_key: str):
+	# The request failed without a response worth replaying, a retry runs it again
+	db.query(models.IdempotencyKey).filter(
+		models.IdempotencyKey.user_id == user_id,
+		models.IdempotencyKey.idempotency_key == idempotency_key,
+		models.IdempotencyKey.status_code == None,
+	).delete(synchronize_session=False)
+	db.commit()
 
 
-def delete_health_record(db: Session, health_record_id: int):
-	db.query(models.HealthRecord).filter(models.HealthRecord.health_record_id == health_record_id).update({models.HealthRecord.date_deleted: datetime.now()})
+def delete_expired_idempotency_keys(db: Session, before: datetime):
+	count = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.date_created < before).delete(synchronize_session=False)
 	db.commit()
+	return count
 
 
 def create_test_recording(db: Session, user_id: int, test_recording = schemas.TestRecordingBase):
@@ -396,7 +768,6 @@ def create_test_recording(db: Session, user_id: int, test_recording = schemas.Te
 
 	db.add(db_test_recording)
 	db.commit()
-	db.refresh(db_test_recording)
 
 def create_test_survey(db: Session, user_id: int, test_survey = schemas.TestSurveyBase):
 	db_test_survey = models.TestSurvey(
@@ -407,5 +778,4 @@ def create_test_survey(db: Session, user_id: int, test_survey = schemas.TestSurv
 
 	db.add(db_test_survey)
 	db.commit()
-	db.refresh(db_test_survey)
 
@@ -1,14 +1,40 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
+from app import metrics
 import os
 
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv('POSTGRESQL_CONNECTION')
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+pool_checkout_wait = metrics.Histogram('db_pool_checkout_seconds', documentation='Time waiting for a pooled connection, including opening new ones')
+
+
+class TimedQueuePool(QueuePool):
+    # Checkouts wait here when every connection of the pool is in use
+    def _do_get(self):
+        with pool_checkout_wait.time():
+            return super()._do_get()
+
+
+def collect_pool_metrics():
+    pool = engine.pool
+    if(not isinstance(pool, QueuePool)):
+        return []
+    return [
+        metrics.get_family('db_pool_size', metrics.GAUGE, 'Connections kept open by the pool', [('', [], pool.size())]),
+        metrics.get_family('db_pool_checked_out', metrics.GAUGE, 'Connections in use', [('', [], pool.checkedout())]),
+        metrics.get_family('db_pool_overflow', metrics.GAUGE, 'Connections opened beyond the pool size', [('', [], max(pool.overflow(), 0))]),
+    ]
+
+
+# Other databases, e.g. SQLite for development, keep their default pool
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=TimedQueuePool) if make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == 'postgresql' else create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+metrics.registry.register_collector(collect_pool_metrics)
 
 Base = declarative_base()
@@ -0,0 +1,20 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse
+from app import crud, idempotency
+from app.database import SessionLocal
+
+
+def delete_expired_idempotency_keys(args):
+	# initialize session
+	print('[INFO] initialize session')
+	db = SessionLocal()
+
+	# Expired keys are no longer replayed, only the index on date_created is scanned
+	deleted = crud.delete_expired_idempotency_keys(db, idempotency.get_live_since())
+	print('[INFO] {} expired idempotency keys deleted'.format(deleted))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Deletes the stored responses of idempotency keys older than IDEMPOTENCY_KEY_TTL, e.g. from a daily cron job')
+	args = parser.parse_args()
+	delete_expired_idempotency_keys(args)
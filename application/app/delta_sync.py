@@ -0,0 +1,71 @@
+# delta_sync.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import base64
+import binascii
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy.orm import Session
+from app import crud
+
+# Seconds a watermark is moved back, rows written by transactions still running at sync time or by workers
+# with a slightly late clock are sent again on the next sync rather than missed
+SYNC_OVERLAP = float(os.getenv('SYNC_OVERLAP') or 60)
+
+TOKEN_VERSION = '1'
+
+
+class InvalidSyncToken(ValueError):
+	pass
+
+
+def encode_token(watermark: datetime):
+	return base64.urlsafe_b64encode(f"{TOKEN_VERSION}:{watermark.isoformat()}".encode()).decode().rstrip('=')
+
+
+def decode_token(token: str):
+	'''
+	Return:
+		Watermark of the token, InvalidSyncToken if the token was not issued by encode_token
+	'''
+
+	try:
+		version, watermark = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode().split(':', 1)
+		if(version != TOKEN_VERSION):
+			raise InvalidSyncToken(token)
+		return datetime.fromisoformat(watermark)
+	except (binascii.Error, UnicodeDecodeError, ValueError):
+		raise InvalidSyncToken(token)
+
+
+def get_changes(db: Session, user_id: int, token: str = None):
+	'''
+	Read the rows of a user changed since a sync token, every live row without a token
+
+	Parameters:
+		db (Session): Database session
+		user_id (int): Owner of the rows
+		token (str): Token of the previous sync
+	Return:
+		Changes shaped like schemas.SyncChanges. Soft-deleted rows are included with date_deleted set, food items
+		of a deleted meal are not, and rows may repeat from the previous sync, clients upsert them by id.
+	'''
+
+	since = decode_token(token) if token else None
+
+	# Taken before reading so rows committed during the reads are sent again next time
+	watermark = datetime.now() - timedelta(seconds=SYNC_OVERLAP)
+
+	return SimpleNamespace(
+		token=encode_token(watermark),
+		full=since is None,
+		meals=crud.get_user_meals_changed_since(db, user_id, since),
+		food_items=crud.get_user_food_items_changed_since(db, user_id, since),
+		health_records=crud.get_user_health_records_changed_since(db, user_id, since),
+		profile=crud.get_profile_changed_since(db, user_id, since),
+	)
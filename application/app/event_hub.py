@@ -0,0 +1,157 @@
+# event_hub.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import json
+import asyncio
+import threading
+from app import notifications
+
+# Postgres channel carrying the events published by every worker
+EVENT_CHANNEL = 'user_events'
+
+# Event hub backends
+BACKEND_MEMORY = 'memory'
+BACKEND_POSTGRES = 'postgres'
+
+# Event types
+ASSIGNMENT_CREATED = 'assignment_created'
+ASSIGNMENT_ACCEPTED = 'assignment_accepted'
+ASSIGNMENT_DECLINED = 'assignment_declined'
+ASSIGNMENT_DELETED = 'assignment_deleted'
+MEAL_CREATED = 'meal_created'
+MEAL_UPDATED = 'meal_updated'
+MEAL_DELETED = 'meal_deleted'
+
+
+class EventHub:
+	'''
+	Fans out events to the subscriptions of a user.
+
+	Each subscription is a bounded asyncio queue on the event loop of the worker, an idle subscription costs
+	a queue and a waiting coroutine. With the postgres backend events are published through NOTIFY and
+	delivered to the subscriptions of every worker, with the memory backend only to those of the publishing worker.
+	Events only carry ids, clients fetch the changed records themselves.
+	'''
+
+	def __init__(self, backend: str = BACKEND_MEMORY, queue_size: int = 64):
+		self.backend = backend
+		self.queue_size = queue_size
+		self.loop = None
+		self.__subscriptions = {}
+		self.__lock = threading.Lock()
+		self.published = 0
+		self.dropped = 0
+
+		if(self.backend == BACKEND_POSTGRES):
+			notifications.listener.subscribe(EVENT_CHANNEL, self._receive)
+
+	def subscribe(self, user_id: int):
+		self.loop = asyncio.get_event_loop()
+		queue = asyncio.Queue(maxsize=self.queue_size)
+		with self.__lock:
+			self.__subscriptions.setdefault(user_id, set()).add(queue)
+		return queue
+
+	def unsubscribe(self, user_id: int, queue):
+		with self.__lock:
+			queues = self.__subscriptions.get(user_id)
+			if(queues is not None):
+				queues.discard(queue)
+				if(not queues):
+					del self.__subscriptions[user_id]
+
+	def publish(self, db, recipient_ids: list, event_type: str, **data):
+		'''
+		Publish an event to the subscriptions of users once the transaction of the session commits
+
+		Parameters:
+			db (Session): Session of the request, the event is dropped if its transaction rolls back.
+				Without a session the event is delivered immediately, with the memory backend only
+			recipient_ids (list): Users receiving the event
+			event_type (str): One of the event types, e.g. MEAL_CREATED
+			data: Ids of the records the event refers to
+		'''
+
+		self.published += 1
+		event = {'recipient_ids': list(recipient_ids), 'type': event_type, 'data': data}
+		if(self.backend == BACKEND_POSTGRES):
+			# A single NOTIFY for every recipient, sent by the commit of the request
+			notifications.notify(db, EVENT_CHANNEL, json.dumps(event))
+		elif(db is None):
+			self._deliver(event)
+		else:
+			notifications.after_commit(db, lambda: self._deliver(event))
+
+	def subscriber_count(self):
+		with self.__lock:
+			return sum(len(queues) for queues in self.__subscriptions.values())
+
+	def stats(self):
+		return {
+			'backend': self.backend,
+			'users': len(self.__subscriptions),
+			'subscriptions': self.subscriber_count(),
+			'published': self.published,
+			'dropped': self.dropped,
+		}
+
+	def _receive(self, payload: str):
+		# Called by the notification listener thread
+		self._deliver(json.loads(payload))
+
+	def _deliver(self, event: dict):
+		if(self.loop is None or not any(recipient_id in self.__subscriptions for recipient_id in event['recipient_ids'])):
+			return
+		self.loop.call_soon_threadsafe(self._dispatch, event)
+
+	def _dispatch(self, event: dict):
+		with self.__lock:
+			queues = [queue for recipient_id in event['recipient_ids'] for queue in self.__subscriptions.get(recipient_id, ())]
+
+		for queue in queues:
+			# Slow subscribers lose their oldest events rather than blocking the hub
+			if(queue.full()):
+				queue.get_nowait()
+				self.dropped += 1
+			queue.put_nowait(event)
+
+
+def format_event(event: dict):
+	'''
+	Format an event as a server-sent event
+	'''
+
+	return 'event: {}\ndata: {}\n\n'.format(event['type'], json.dumps(event['data']))
+
+
+async def iterate_events(request, user_id: int, keepalive_interval: float):
+	'''
+	Stream the events of a user as server-sent events until the client disconnects.
+	A comment is sent every keepalive_interval seconds so proxies keep idle connections open.
+	'''
+
+	queue = hub.subscribe(user_id)
+	try:
+		yield 'retry: 5000\n\n'
+		while True:
+			try:
+				event = await asyncio.wait_for(queue.get(), timeout=keepalive_interval)
+			except asyncio.TimeoutError:
+				if(await request.is_disconnected()):
+					break
+				yield ': keepalive\n\n'
+				continue
+			yield format_event(event)
+	finally:
+		hub.unsubscribe(user_id, queue)
+
+
+hub = EventHub(backend=os.getenv('EVENT_HUB_BACKEND') or BACKEND_MEMORY)
+
+# Seconds between keepalive comments on idle event streams
+EVENT_KEEPALIVE_INTERVAL = float(os.getenv('EVENT_KEEPALIVE_INTERVAL') or 15)
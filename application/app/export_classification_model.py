@@ -0,0 +1,63 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from app import smart_diet_watcher
+
+
+def list_images(image_directory):
+	return [os.path.join(image_directory, file_name) for file_name in sorted(os.listdir(image_directory))
+		if os.path.splitext(file_name)[1].lower() in ('.jpg', '.jpeg', '.png')]
+
+
+def export_tflite(args):
+	converter = tf.lite.TFLiteConverter.from_keras_model_file(args.model)
+
+	if(args.quantization == 'float16'):
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.target_spec.supported_types = [tf.float16]
+	elif(args.quantization == 'int8'):
+		if(args.images is None):
+			raise ValueError('int8 quantization requires --images for calibration')
+
+		input_size = load_model(args.model, compile=False).layers[0].input_shape[1:3]
+		image_paths = list_images(args.images)
+
+		# Calibrate activation ranges on real meal images
+		def representative_dataset():
+			for image_path in image_paths:
+				yield [smart_diet_watcher.load_classification_image(image_path, input_size).astype(np.float32)]
+
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.representative_dataset = representative_dataset
+		converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+		converter.inference_input_type = tf.int8
+		converter.inference_output_type = tf.int8
+
+	with open(args.output, 'wb') as f:
+		f.write(converter.convert())
+
+
+def export_onnx(args):
+	# Requires the keras2onnx package
+	import keras2onnx
+	model = load_model(args.model, compile=False)
+	onnx_model = keras2onnx.convert_keras(model, model.name)
+	keras2onnx.save_model(onnx_model, args.output)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Exports the food classification model for the tflite and onnx inference backends')
+	parser.add_argument('-m', '--model', required=True, help='Path to the Keras food classification model')
+	parser.add_argument('-o', '--output', required=True, help='Path to the exported model')
+	parser.add_argument('-f', '--format', choices=['tflite', 'onnx'], default='tflite', help='Export format')
+	parser.add_argument('-q', '--quantization', choices=['none', 'float16', 'int8'], default='none', help='Quantization of the tflite export')
+	parser.add_argument('-i', '--images', default=None, help='Path to a directory of images used to calibrate int8 quantization')
+	args = parser.parse_args()
+
+	if(args.format == 'tflite'):
+		export_tflite(args)
+	else:
+		export_onnx(args)
+	print('[INFO] model exported to {}'.format(args.output))
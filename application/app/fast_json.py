@@ -0,0 +1,143 @@
+# fast_json.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import orjson
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST
+from starlette.responses import Response
+from app import http_cache
+
+# Opt-in, list endpoints validate their response through pydantic unless enabled
+FAST_JSON_RESPONSES = (os.getenv('FAST_JSON_RESPONSES') or '0') == '1'
+
+# orjson and the json module only write floats identically in this range, e.g. 1e-05 is written as 0.00001 by orjson
+SAFE_FLOAT_RANGE = (1e-4, 1e16)
+
+
+# Attributes the object does not have
+MISSING = object()
+
+
+class UnsafeFloatError(Exception):
+	pass
+
+
+def to_float(value):
+	value = float(value)
+	if(value != 0 and not (SAFE_FLOAT_RANGE[0] <= abs(value) < SAFE_FLOAT_RANGE[1])):
+		raise UnsafeFloatError(value)
+	return value
+
+
+class Serializer:
+	'''
+	Builds the response dict of a pydantic model directly from an ORM object or row, without validation.
+	Fields are read in the order pydantic declares them so the encoded JSON matches the response_model path.
+	'''
+
+	def __init__(self, model):
+		self.model = model
+		self.fields = []
+		for name, field in model.__fields__.items():
+			self.fields.append((name, self._get_converter(field), field.default))
+
+	def _get_converter(self, field):
+		if(isinstance(field.type_, type) and issubclass(field.type_, BaseModel)):
+			convert = get_serializer(field.type_).to_dict
+		elif(field.type_ is float):
+			convert = to_float
+		else:
+			convert = None
+
+		if(field.shape == SHAPE_LIST):
+			if(convert is None):
+				return lambda values: list(values) if values is not None else None
+			return lambda values: [convert(value) for value in values] if values is not None else None
+
+		if(convert is None):
+			return None
+		return lambda value: convert(value) if value is not None else None
+
+	def to_dict(self, obj):
+		result = {}
+		for name, convert, default in self.fields:
+			value = getattr(obj, name, MISSING)
+			# Like from_orm, a missing attribute takes the default of the field, which pydantic does not validate
+			if(value is MISSING):
+				result[name] = default
+			else:
+				result[name] = convert(value) if convert is not None else value
+		return result
+
+
+serializers = {}
+
+def get_serializer(model):
+	serializer = serializers.get(model)
+	if(serializer is None):
+		serializer = serializers[model] = Serializer(model)
+	return serializer
+
+
+def encode_pydantic(model, objects: list):
+	# The response_model path: validate every object, then encode like JSONResponse
+	return http_cache.serialize([model.from_orm(obj) for obj in objects])
+
+
+def encode(model, objects: list):
+	'''
+	Encode a list of ORM objects or rows as the JSON of List[model]
+
+	Parameters:
+		model: Pydantic response model of each object
+		objects (list): ORM objects or rows
+	Return:
+		JSON bytes, identical to the bytes of the response_model path
+	'''
+
+	serializer = get_serializer(model)
+	try:
+		return orjson.dumps([serializer.to_dict(obj) for obj in objects])
+	except UnsafeFloatError:
+		return encode_pydantic(model, objects)
+
+
+def encode_object(model, obj):
+	# Single object, e.g. a line of an NDJSON stream
+	try:
+		return orjson.dumps(get_serializer(model).to_dict(obj))
+	except UnsafeFloatError:
+		return http_cache.serialize(model.from_orm(obj))
+
+
+def get_response(model, objects: list):
+	'''
+	Return:
+		Response containing the encoded objects, or the objects themselves for the response_model path
+	'''
+
+	if(not FAST_JSON_RESPONSES):
+		return objects
+	return Response(content=encode(model, objects), media_type='application/json')
+
+
+def check_contract(model, objects: list):
+	'''
+	Check that the fast path writes the same bytes as the response_model path
+
+	Return:
+		None if the outputs are identical, otherwise the first differing object and both encodings
+	'''
+
+	for obj in objects:
+		expected = encode_pydantic(model, [obj])
+		actual = encode(model, [obj])
+		if(actual != expected):
+			return {'object': obj, 'expected': expected, 'actual': actual}
+
+	return None
@@ -0,0 +1,180 @@
+# food_detector.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import threading
+from collections import OrderedDict
+import cv2
+from app import smart_diet_watcher
+from app.metrics import Histogram
+
+# Detection tiers
+TIER_CACHE = 'cache'
+TIER_PREFILTER = 'prefilter'
+TIER_MODEL = 'model'
+TIERS = (TIER_CACHE, TIER_PREFILTER, TIER_MODEL)
+
+
+def get_perceptual_hash(image):
+	'''
+	Compute the difference hash (dHash) of an image
+
+	Near-identical frames, e.g. consecutive camera preview frames, have hashes with a small hamming distance.
+
+	Parameters:
+		image: RGB image as a numpy array
+	Return:
+		64 bit integer
+	'''
+
+	gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+	gray = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+	difference = gray[:, 1:] > gray[:, :-1]
+
+	image_hash = 0
+	for bit in difference.flatten():
+		image_hash = (image_hash << 1) | int(bit)
+	return image_hash
+
+
+def get_hamming_distance(hash_a: int, hash_b: int):
+	return bin(hash_a ^ hash_b).count('1')
+
+
+class PerceptualHashCache:
+	'''
+	LRU cache of detection verdicts keyed by perceptual hash, matching hashes within a hamming distance
+	'''
+
+	def __init__(self, capacity: int = 256, max_distance: int = 4):
+		self.capacity = capacity
+		self.max_distance = max_distance
+		self.__entries = OrderedDict()
+		self.__lock = threading.Lock()
+
+	def get(self, image_hash: int):
+		with self.__lock:
+			if(image_hash in self.__entries):
+				self.__entries.move_to_end(image_hash)
+				return self.__entries[image_hash]
+
+			for cached_hash in reversed(self.__entries):
+				if(get_hamming_distance(image_hash, cached_hash) <= self.max_distance):
+					self.__entries.move_to_end(cached_hash)
+					return self.__entries[cached_hash]
+
+		return None
+
+	def put(self, image_hash: int, verdict: bool):
+		with self.__lock:
+			self.__entries[image_hash] = verdict
+			self.__entries.move_to_end(image_hash)
+			while(len(self.__entries) > self.capacity):
+				self.__entries.popitem(last=False)
+
+	def clear(self):
+		with self.__lock:
+			self.__entries.clear()
+
+
+class TieredFoodDetector:
+	'''
+	Detects food in an image through increasingly expensive tiers:
+		1. Perceptual hash cache of previous verdicts for near-identical frames
+		2. Optional lightweight pre-filter model (quantized or reduced resolution)
+		3. Full food detection model, only when the pre-filter is uncertain
+	'''
+
+	def __init__(self, model, prefilter_model=None, prefilter_confidence: float = 0.9, cache: PerceptualHashCache = None):
+		self.model = model
+		self.prefilter_model = prefilter_model
+		self.prefilter_confidence = prefilter_confidence
+		self.cache = cache if cache is not None else PerceptualHashCache()
+
+		self.__lock = threading.Lock()
+		self.__requests = 0
+		self.__hits = {tier: 0 for tier in TIERS}
+		self.latency = {tier: Histogram(f"food_detection_{tier}_seconds") for tier in TIERS}
+
+	def detect(self, image_data: str):
+		'''
+		Parameters:
+			image_data (str): Image data in Base64
+		Return:
+			True if food is detected, False if food is not detected
+		'''
+
+		image = smart_diet_watcher.decode_image_data(image_data)
+		self._count_request()
+
+		with self.latency[TIER_CACHE].time():
+			image_hash = get_perceptual_hash(image)
+			verdict = self.cache.get(image_hash)
+		if(verdict is not None):
+			self._count_hit(TIER_CACHE)
+			return verdict
+
+		verdict = None
+		if(self.prefilter_model is not None):
+			with self.latency[TIER_PREFILTER].time():
+				prediction = smart_diet_watcher.predict_food_presence(self.prefilter_model, image)
+			if(max(prediction[0], prediction[1]) >= self.prefilter_confidence):
+				self._count_hit(TIER_PREFILTER)
+				verdict = bool(prediction[0] > prediction[1])
+
+		if(verdict is None):
+			with self.latency[TIER_MODEL].time():
+				prediction = smart_diet_watcher.predict_food_presence(self.model, image)
+			self._count_hit(TIER_MODEL)
+			verdict = bool(prediction[0] > prediction[1])
+
+		self.cache.put(image_hash, verdict)
+		return verdict
+
+	def stats(self):
+		'''
+		Return:
+			Dict containing the hit rate and latency histogram of each tier
+		'''
+
+		with self.__lock:
+			requests = self.__requests
+			hits = dict(self.__hits)
+
+		return {
+			'requests': requests,
+			'tiers': {
+				tier: {
+					'hits': hits[tier],
+					'hit_rate': hits[tier] / requests if requests else 0,
+					'latency_seconds': self.latency[tier].snapshot(),
+				} for tier in TIERS
+			},
+		}
+
+	def _count_request(self):
+		with self.__lock:
+			self.__requests += 1
+
+	def _count_hit(self, tier: str):
+		with self.__lock:
+			self.__hits[tier] += 1
+
+
+def get_detector(model, prefilter_model=None):
+	'''
+	Create a tiered food detector configured through the environment
+	'''
+
+	cache = PerceptualHashCache(
+		capacity=int(os.getenv('FOOD_DETECTION_CACHE_SIZE') or 256),
+		max_distance=int(os.getenv('FOOD_DETECTION_CACHE_DISTANCE') or 4),
+	)
+	return TieredFoodDetector(model, prefilter_model,
+		prefilter_confidence=float(os.getenv('FOOD_DETECTION_PREFILTER_CONFIDENCE') or 0.9),
+		cache=cache,
+	)
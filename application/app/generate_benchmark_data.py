@@ -0,0 +1,206 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import argparse, json, random, time
+from datetime import datetime, timedelta
+from app import models, security, health_series
+from app.benchmark_report import PATIENT_EMAIL, CLINICIAN_EMAIL
+from app.database import SessionLocal
+
+BENCHMARK_EMAIL_PATTERN = 'benchmark-%@example.com'
+
+# Rows inserted per statement
+CHUNK_SIZE = 5000
+
+# Foods entered by hand when no food of the catalog matched
+NEW_FOOD_TYPES = ['homemade curry', 'grilled chicken salad', 'banana bread', 'egg fried rice', 'lentil soup', 'tuna sandwich']
+
+
+def insert(db, model, rows):
+	# Core inserts of the model tables, the ORM unit of work would take minutes for millions of rows
+	for start in range(0, len(rows), CHUNK_SIZE):
+		db.execute(model.__table__.insert(), rows[start:start + CHUNK_SIZE])
+
+
+def delete_benchmark_data(db):
+	user_ids = [user_id for user_id, in db.query(models.User.user_id).filter(models.User.email.like(BENCHMARK_EMAIL_PATTERN))]
+	if(not user_ids):
+		return 0
+
+	meal_ids = db.query(models.Meal.meal_id).filter(models.Meal.user_id.in_(user_ids)).subquery()
+	db.query(models.FoodItem).filter(models.FoodItem.meal_id.in_(meal_ids)).delete(synchronize_session=False)
+	for model in (models.Meal, models.HealthRecord, models.HealthRecordRollup, models.Profile, models.IdempotencyKey):
+		db.query(model).filter(model.user_id.in_(user_ids)).delete(synchronize_session=False)
+	db.query(models.ClinicianAssignment).filter(models.ClinicianAssignment.user_id.in_(user_ids) | models.ClinicianAssignment.clinician_id.in_(user_ids)).delete(synchronize_session=False)
+	db.query(models.User).filter(models.User.user_id.in_(user_ids)).delete(synchronize_session=False)
+	db.commit()
+	return len(user_ids)
+
+
+def create_users(db, rng, email, count, account_type, password_hash, now):
+	insert(db, models.User, [{
+		'email': email.format(index),
+		'password': password_hash,
+		'disabled': False,
+		'account_type': account_type,
+		'name': 'Benchmark {} {}'.format('clinician' if account_type == 1 else 'patient', index),
+		'date_created': now - timedelta(days=rng.randint(0, 365)),
+	} for index in range(count)])
+	emails = [email.format(index) for index in range(count)]
+	ids = dict(db.query(models.User.email, models.User.user_id).filter(models.User.email.in_(emails)))
+	return [ids[email] for email in emails]
+
+
+def get_profile(rng, user_id, now):
+	return {
+		'user_id': user_id,
+		'date_of_birth': (now - timedelta(days=rng.randint(20 * 365, 80 * 365))).date(),
+		'gender': rng.choice(['male', 'female']),
+		'height': round(rng.uniform(150, 195), 1),
+		'ethnicity': rng.randint(0, 3),
+		'family_history_diabetes_non_immediate': rng.random() < 0.3,
+		'family_history_diabetes_parents': rng.random() < 0.2,
+		'family_history_diabetes_siblings': rng.random() < 0.1,
+		'family_history_diabetes_children': rng.random() < 0.05,
+		'high_blood_glucose_history': rng.random() < 0.2,
+		'high_blood_pressure_medication_history': rng.random() < 0.2,
+		'date_created': now,
+		'date_modified': now,
+	}
+
+
+def get_health_records(rng, user_id, count, days, now):
+	# A baseline per patient with small variations, so the series and the trend report have something to rank
+	weight = rng.uniform(55, 110)
+	glucose = rng.uniform(4.5, 8)
+	records = []
+	for index in range(count):
+		date_created = now - timedelta(days=days * (count - index) / count, minutes=rng.randint(0, 600))
+		records.append({
+			'user_id': user_id,
+			'waist_circumference': round(rng.uniform(70, 120), 1),
+			'weight': round(weight + rng.gauss(0, 1.5), 1),
+			'blood_pressure_medication': rng.random() < 0.2,
+			'physical_exercise_hours': rng.randint(0, 5),
+			'physical_exercise_minutes': rng.randint(0, 59),
+			'smoking': rng.random() < 0.15,
+			'vegetable_fruit_berries_consumption': rng.random() < 0.6,
+			'systolic_pressure': round(rng.uniform(105, 160), 0),
+			'fasting_blood_glucose': round(glucose + rng.gauss(0, 0.6), 1),
+			'hdl_cholesterol': round(rng.uniform(0.8, 2.2), 2),
+			'triglycerides': round(rng.uniform(0.5, 3), 2),
+			'date_created': date_created,
+			'date_modified': date_created,
+		})
+	return records
+
+
+def get_rollups(user_id, records):
+	# Built like health_series.update_rollups, bucketed first as recomputing every period from all records is quadratic
+	records = [models.HealthRecord(**record) for record in sorted(records, key=lambda record: record['date_created'])]
+	rollups = []
+	for resolution in health_series.RESOLUTIONS:
+		periods = {}
+		for record in records:
+			periods.setdefault(health_series.get_period_start(record.date_created, resolution), []).append(record)
+		for period_start, period_records in periods.items():
+			rollups += health_series.compute_rollups(user_id, period_records, [(resolution, period_start)])
+
+	columns = [column.name for column in models.HealthRecordRollup.__table__.columns]
+	return [{column: getattr(rollup, column) for column in columns} for rollup in rollups]
+
+
+def generate(args):
+	rng = random.Random(args.seed)
+	now = datetime.now().replace(microsecond=0)
+	db = SessionLocal()
+
+	deleted = delete_benchmark_data(db)
+	if(deleted):
+		print('[INFO] deleted the data of {} previous benchmark users'.format(deleted))
+
+	food_ids = [food_id for food_id, in db.query(models.Food.food_id).filter(models.Food.enabled == True).order_by(models.Food.food_id)]
+	measurement_ids = [measurement_id for measurement_id, in db.query(models.Measurement.measurement_id).order_by(models.Measurement.measurement_id)]
+	if(not measurement_ids):
+		print('[ERROR] no measurements, populate the catalog with populate_database_metadata.py first')
+		sys.exit(1)
+
+	start = time.perf_counter()
+	# Every user shares the password, a hash per user would take minutes of bcrypt
+	password_hash = security.get_password_hash(args.password)
+	clinician_ids = create_users(db, rng, CLINICIAN_EMAIL, args.clinicians, 1, password_hash, now)
+	patient_ids = create_users(db, rng, PATIENT_EMAIL, args.patients, 0, password_hash, now)
+	insert(db, models.Profile, [get_profile(rng, user_id, now) for user_id in patient_ids])
+
+	assignments = []
+	for user_id in patient_ids:
+		for clinician_id in rng.sample(clinician_ids, min(args.assignments, len(clinician_ids))):
+			assignments.append({'clinician_id': clinician_id, 'user_id': user_id, 'assignment_accepted': rng.random() < args.accepted})
+	insert(db, models.ClinicianAssignment, assignments)
+
+	counts = {'meals': 0, 'food_items': 0, 'health_records': 0, 'health_record_rollups': 0}
+	for user_id in patient_ids:
+		meals = []
+		for index in range(args.meals):
+			date_created = now - timedelta(days=args.days * (args.meals - index) / args.meals, minutes=rng.randint(0, 120))
+			meals.append({
+				'user_id': user_id,
+				# Content addressed names of images which are not on disk, list pages do not read them
+				'image': '{:064x}.jpg'.format(rng.getrandbits(256)),
+				'blood_glucose': round(rng.uniform(4, 10), 1) if rng.random() < 0.7 else None,
+				'food_predictions': ','.join(str(class_index) for class_index in rng.sample(range(100), 10)),
+				'date_created': date_created,
+				'date_modified': date_created,
+			})
+		insert(db, models.Meal, meals)
+
+		food_items = []
+		for meal_id, date_created in db.query(models.Meal.meal_id, models.Meal.date_created).filter(models.Meal.user_id == user_id).order_by(models.Meal.meal_id):
+			for _ in range(rng.randint(max(0, args.food_items - 1), args.food_items + 1)):
+				catalog_food = food_ids and rng.random() < 0.9
+				food_items.append({
+					'meal_id': meal_id,
+					'food_id': rng.choice(food_ids) if catalog_food else None,
+					'new_food_type': None if catalog_food else rng.choice(NEW_FOOD_TYPES),
+					'measurement_id': rng.choice(measurement_ids),
+					'food_item_count': 1,
+					'volume_consumed': round(rng.uniform(10, 400), 1),
+					'per_unit_measurement': 0,
+					'date_created': date_created,
+					'date_modified': date_created,
+				})
+		insert(db, models.FoodItem, food_items)
+
+		health_records = get_health_records(rng, user_id, args.health_records, args.days, now)
+		insert(db, models.HealthRecord, health_records)
+		rollups = get_rollups(user_id, health_records)
+		insert(db, models.HealthRecordRollup, rollups)
+		db.commit()
+
+		counts['meals'] += len(meals)
+		counts['food_items'] += len(food_items)
+		counts['health_records'] += len(health_records)
+		counts['health_record_rollups'] += len(rollups)
+
+	db.close()
+	print(json.dumps(dict(counts,
+		seed=args.seed,
+		clinicians=len(clinician_ids),
+		patients=len(patient_ids),
+		assignments=len(assignments),
+		seconds=time.perf_counter() - start,
+	), indent=2))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Replaces the benchmark users with reproducible synthetic data, run populate_database_metadata.py first for the catalog')
+	parser.add_argument('-p', '--patients', type=int, default=200, help='Number of patients')
+	parser.add_argument('-c', '--clinicians', type=int, default=10, help='Number of clinicians')
+	parser.add_argument('-a', '--assignments', type=int, default=1, help='Number of clinicians assigned to each patient')
+	parser.add_argument('--accepted', type=float, default=0.9, help='Share of accepted assignments')
+	parser.add_argument('-m', '--meals', type=int, default=300, help='Number of meals per patient')
+	parser.add_argument('-f', '--food-items', type=int, default=3, help='Average number of food items per meal')
+	parser.add_argument('-r', '--health-records', type=int, default=100, help='Number of health records per patient')
+	parser.add_argument('-d', '--days', type=int, default=365, help='Number of days the meals and health records span')
+	parser.add_argument('--password', default='benchmark', help='Password of every generated user')
+	parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed, the same seed generates the same data')
+	args = parser.parse_args()
+	generate(args)
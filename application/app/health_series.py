@@ -0,0 +1,147 @@
+# health_series.py
+
+### Imports
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app import models
+
+# HealthRecord columns available as time series
+METRICS = ('weight', 'systolic_pressure', 'fasting_blood_glucose', 'hdl_cholesterol', 'triglycerides')
+
+# Rollup resolutions, periods start at midnight, on Monday and on the first day of the month like date_trunc
+RESOLUTIONS = ('day', 'week', 'month')
+
+# Namespace of the advisory locks serializing the rollup updates of a user, next to crud.IMAGE_LOCK_NAMESPACE
+ROLLUP_LOCK_NAMESPACE = 2
+
+
+def get_period_start(date: datetime, resolution: str):
+	day = datetime(date.year, date.month, date.day)
+	if(resolution == 'day'):
+		return day
+	if(resolution == 'week'):
+		return day - timedelta(days=day.weekday())
+	if(resolution == 'month'):
+		return day.replace(day=1)
+
+	raise ValueError(f"Unknown resolution: {resolution}")
+
+
+def get_period_end(period_start: datetime, resolution: str):
+	if(resolution == 'day'):
+		return period_start + timedelta(days=1)
+	if(resolution == 'week'):
+		return period_start + timedelta(days=7)
+	if(period_start.month == 12):
+		return period_start.replace(year=period_start.year + 1, month=1)
+	return period_start.replace(month=period_start.month + 1)
+
+
+def compute_rollups(user_id: int, records: list, periods: list):
+	'''
+	Aggregate the records falling in each period
+
+	Parameters:
+		user_id (int): Owner of the records
+		records (list): HealthRecords ordered by date_created
+		periods (list): (resolution, period_start) tuples
+	Return:
+		List of HealthRecordRollup, periods without values are omitted
+	'''
+
+	rollups = []
+	for resolution, period_start in periods:
+		period_end = get_period_end(period_start, resolution)
+		period_records = [record for record in records if period_start <= record.date_created < period_end]
+
+		for metric in METRICS:
+			values = [(record.date_created, getattr(record, metric)) for record in period_records if getattr(record, metric) is not None]
+			if(not values):
+				continue
+
+			rollups.append(models.HealthRecordRollup(
+				user_id = user_id,
+				metric = metric,
+				resolution = resolution,
+				period_start = period_start,
+				minimum = min(value for _, value in values),
+				maximum = max(value for _, value in values),
+				total = sum(value for _, value in values),
+				count = len(values),
+				last = values[-1][1],
+				last_date = values[-1][0],
+			))
+
+	return rollups
+
+
+def update_rollups(db: Session, user_id: int, date: datetime):
+	'''
+	Recompute the daily, weekly and monthly rollups of a user containing date, in the current transaction.
+	Only the records of the enclosing periods are read, i.e. at most a month and a week of records.
+	'''
+
+	if(date is None):
+		return
+
+	# Concurrent updates would both delete then insert the same rollups, the second one waits for the first to commit
+	if(db.bind.dialect.name == 'postgresql'):
+		db.execute(text("SELECT pg_advisory_xact_lock(:namespace, :user_id)"), {'namespace': ROLLUP_LOCK_NAMESPACE, 'user_id': user_id})
+
+	periods = [(resolution, get_period_start(date, resolution)) for resolution in RESOLUTIONS]
+	range_start = min(period_start for _, period_start in periods)
+	range_end = max(get_period_end(period_start, resolution) for resolution, period_start in periods)
+
+	records = db.query(models.HealthRecord).filter(
+		models.HealthRecord.user_id == user_id,
+		models.HealthRecord.date_deleted == None,
+		models.HealthRecord.date_created >= range_start,
+		models.HealthRecord.date_created < range_end,
+	).order_by(models.HealthRecord.date_created.asc()).all()
+
+	for resolution, period_start in periods:
+		db.query(models.HealthRecordRollup).filter(
+			models.HealthRecordRollup.user_id == user_id,
+			models.HealthRecordRollup.resolution == resolution,
+			models.HealthRecordRollup.period_start == period_start,
+		).delete(synchronize_session=False)
+
+	db.add_all(compute_rollups(user_id, records, periods))
+
+
+def get_series(db: Session, user_id: int, metric: str, resolution: str, start: datetime = None, end: datetime = None):
+	'''
+	Read a metric of a user at a resolution, one row per period displayed
+
+	Return:
+		Dict of columnar arrays: period_start, minimum, maximum, mean, last and count
+	'''
+
+	query = db.query(
+		models.HealthRecordRollup.period_start,
+		models.HealthRecordRollup.minimum,
+		models.HealthRecordRollup.maximum,
+		models.HealthRecordRollup.total,
+		models.HealthRecordRollup.count,
+		models.HealthRecordRollup.last,
+	).filter(
+		models.HealthRecordRollup.user_id == user_id,
+		models.HealthRecordRollup.metric == metric,
+		models.HealthRecordRollup.resolution == resolution,
+	)
+	if(start is not None):
+		query = query.filter(models.HealthRecordRollup.period_start >= get_period_start(start, resolution))
+	if(end is not None):
+		query = query.filter(models.HealthRecordRollup.period_start < end)
+
+	series = {'metric': metric, 'resolution': resolution, 'period_start': [], 'minimum': [], 'maximum': [], 'mean': [], 'last': [], 'count': []}
+	for row in query.order_by(models.HealthRecordRollup.period_start.asc()).all():
+		series['period_start'].append(row.period_start)
+		series['minimum'].append(row.minimum)
+		series['maximum'].append(row.maximum)
+		series['mean'].append(row.total / row.count)
+		series['last'].append(row.last)
+		series['count'].append(row.count)
+
+	return series
@@ -0,0 +1,166 @@
+# http_cache.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import json
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+# Brotli is optional, payloads are only gzip compressed without it
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESSION_MINIMUM_SIZE = 256
+
+# Payloads are compressed on demand when their data changes, the highest levels cost too much CPU for little gain
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+class CachedPayload:
+	'''
+	JSON body serialized once, with its precompressed encodings and a strong ETag
+	'''
+
+	def __init__(self, body: bytes):
+		self.body = body
+		self.digest = hashlib.sha256(body).hexdigest()[:32]
+
+		# Each encoding is a different representation and carries its own ETag
+		self.encodings = {}
+		if(len(body) >= COMPRESSION_MINIMUM_SIZE):
+			if(brotli is not None):
+				self.encodings['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+			self.encodings['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+	def get_etag(self, encoding: str = None):
+		if(encoding is None):
+			return f'"{self.digest}"'
+		return f'"{self.digest}-{encoding}"'
+
+	def matches(self, if_none_match: str):
+		'''
+		Check if any of the ETags in an If-None-Match header belongs to this payload, in any encoding
+		'''
+
+		if(if_none_match is None):
+			return False
+
+		for etag in if_none_match.split(','):
+			etag = etag.strip()
+			if(etag == '*'):
+				return True
+			if(etag.startswith('W/')):
+				etag = etag[2:]
+			if(etag.strip('"').split('-')[0] == self.digest):
+				return True
+		return False
+
+	def select_encoding(self, accept_encoding: str):
+		accepted = [value.split(';')[0].strip() for value in (accept_encoding or '').split(',')]
+		for encoding in ('br', 'gzip'):
+			if(encoding in self.encodings and encoding in accepted):
+				return encoding
+		return None
+
+
+def serialize(content):
+	# Same JSON as the responses generated by FastAPI
+	return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+class PayloadCache:
+	'''
+	LRU cache of serialized payloads keyed by (key, version).
+	A payload is regenerated only when the version of its key changes, e.g. the catalog version.
+	'''
+
+	def __init__(self, capacity: int = 1024):
+		self.capacity = capacity
+		self.__entries = OrderedDict()
+		self.__lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, version, build):
+		'''
+		Parameters:
+			key: Cache key, e.g. the endpoint and its parameters
+			version: Version of the data, payloads built for other versions are discarded
+			build: Function returning the content to serialize
+		Return:
+			CachedPayload
+		'''
+
+		# Data without a version is never cached
+		if(version is None):
+			return CachedPayload(serialize(build()))
+
+		with self.__lock:
+			entry = self.__entries.get(key)
+			if(entry is not None and entry[0] == version):
+				self.__entries.move_to_end(key)
+				self.hits += 1
+				return entry[1]
+
+		payload = CachedPayload(serialize(build()))
+		with self.__lock:
+			self.misses += 1
+			self.__entries[key] = (version, payload)
+			self.__entries.move_to_end(key)
+			while(len(self.__entries) > self.capacity):
+				self.__entries.popitem(last=False)
+
+		return payload
+
+	async def get_async(self, key, version, build):
+		# Building and compressing a payload is CPU bound, it runs in the threadpool to keep the event loop free
+		return await run_in_threadpool(self.get, key, version, build)
+
+	def stats(self):
+		with self.__lock:
+			return {'entries': len(self.__entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def get_response(request, payload: CachedPayload):
+	'''
+	Create the response for a cached payload, 304 Not Modified if the client already has it
+
+	Parameters:
+		request (Request): Incoming request, If-None-Match and Accept-Encoding are read from its headers
+		payload (CachedPayload): Payload to send
+	Return:
+		Response
+	'''
+
+	headers = {
+		# Clients may store the payload but have to revalidate it with its ETag
+		'Cache-Control': 'no-cache',
+		'Vary': 'Accept-Encoding',
+	}
+
+	encoding = payload.select_encoding(request.headers.get('accept-encoding'))
+	headers['ETag'] = payload.get_etag(encoding)
+
+	if(payload.matches(request.headers.get('if-none-match'))):
+		return Response(status_code=304, headers=headers)
+
+	if(encoding is not None):
+		headers['Content-Encoding'] = encoding
+		return Response(content=payload.encodings[encoding], media_type='application/json', headers=headers)
+
+	return Response(content=payload.body, media_type='application/json', headers=headers)
+
+
+catalog_payloads = PayloadCache()
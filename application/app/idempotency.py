@@ -0,0 +1,164 @@
+# idempotency.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import time
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+from app import crud, http_cache
+
+# Seconds a response is replayed for a retried idempotency key, after which the key may be reused
+IDEMPOTENCY_KEY_TTL = float(os.getenv('IDEMPOTENCY_KEY_TTL') or 86400)
+
+# Longest idempotency key accepted, clients send UUIDs
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+# Seconds a duplicate waits for the request in flight before giving up with a 409
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT') or 30)
+
+# Seconds after which a request still in flight is presumed lost with its worker, a retry then runs it again
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT = float(os.getenv('IDEMPOTENCY_IN_FLIGHT_TIMEOUT') or 300)
+
+# Requests in flight in this worker, duplicates in the same worker wait on their event instead of polling
+in_flight = {}
+
+
+def get_live_since():
+	# Keys stored before this are expired
+	return datetime.now() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+
+
+def get_request_hash(*parts):
+	digest = hashlib.sha256()
+	for part in parts:
+		digest.update(str(part).encode('utf-8'))
+		digest.update(b'\0')
+	return digest.hexdigest()
+
+
+def get_replayed_response(stored):
+	return Response(content=stored.response, status_code=stored.status_code, media_type='application/json', headers={'Idempotent-Replayed': 'true'})
+
+
+async def wait_for_response(db: Session, user_id: int, idempotency_key: str):
+	'''
+	Wait until the request in flight with the key completes
+
+	Return:
+		The completed IdempotencyKey, None if the request failed and released the key
+	'''
+
+	event = in_flight.get((user_id, idempotency_key))
+	deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+	interval = 0.05
+	while True:
+		if(event is not None):
+			try:
+				await asyncio.wait_for(event.wait(), timeout=deadline - time.monotonic())
+			except asyncio.TimeoutError:
+				pass
+			event = None
+		else:
+			# Requests in other workers are polled
+			await asyncio.sleep(interval)
+			interval = min(interval * 2, 1)
+
+		# End the transaction to see the rows committed since
+		db.rollback()
+		stored = crud.get_idempotency_key(db, user_id, idempotency_key)
+		if(stored is None or stored.status_code is not None):
+			return stored
+		if(time.monotonic() >= deadline):
+			raise HTTPException(status_code=409, detail='A request with this Idempotency-Key is still in progress')
+
+
+async def claim(db: Session, user_id: int, idempotency_key: str, endpoint: str, request_hash: str):
+	'''
+	Claim the key for this request
+
+	Return:
+		None once claimed, otherwise the stored response of the first request to replay
+	'''
+
+	while not crud.claim_idempotency_key(db, user_id, idempotency_key, endpoint, request_hash):
+		stored = crud.get_idempotency_key(db, user_id, idempotency_key)
+		if(stored is None):
+			# Released in the meantime
+			continue
+
+		expired = stored.date_created < get_live_since()
+		lost = stored.status_code is None and stored.date_created < datetime.now() - timedelta(seconds=IDEMPOTENCY_IN_FLIGHT_TIMEOUT)
+		if(expired or lost):
+			if(crud.take_over_idempotency_key(db, user_id, idempotency_key, endpoint, request_hash, stored.date_created)):
+				return None
+			continue
+
+		if(stored.endpoint != endpoint or stored.request_hash != request_hash):
+			raise HTTPException(status_code=422, detail='Idempotency-Key was already used for a different request')
+
+		if(stored.status_code is None):
+			stored = await wait_for_response(db, user_id, idempotency_key)
+			if(stored is None):
+				continue
+		return stored
+
+	return None
+
+
+async def run(db: Session, user_id: int, idempotency_key: str, endpoint: str, request_hash: str, response_model, handler):
+	'''
+	Run a request once per idempotency key, retries replay the response of the first request and
+	duplicates arriving while it is in flight wait for it rather than running it again
+
+	Parameters:
+		db (Session): Database session
+		user_id (int): User sending the request, keys are scoped per user
+		idempotency_key (str): Idempotency-Key header, the handler simply runs without one
+		endpoint (str): Method and path, a key cannot be reused on another endpoint
+		request_hash (str): get_request_hash of the request, a key cannot be reused with another request
+		response_model: Pydantic model of the response
+		handler: Coroutine function running the request
+	Return:
+		Response with the JSON of the handler result, or the stored response of the first request
+	'''
+
+	if(idempotency_key is None):
+		return await handler()
+	if(len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH):
+		raise HTTPException(status_code=400, detail='Idempotency-Key is too long')
+
+	stored = await claim(db, user_id, idempotency_key, endpoint, request_hash)
+	if(stored is not None):
+		return get_replayed_response(stored)
+
+	event = in_flight[(user_id, idempotency_key)] = asyncio.Event()
+	try:
+		try:
+			result = await handler()
+		except HTTPException as exc:
+			# Client errors are replayed, server errors are retried
+			db.rollback()
+			if(exc.status_code < 500):
+				crud.complete_idempotency_key(db, user_id, idempotency_key, exc.status_code, http_cache.serialize({'detail': exc.detail}).decode('utf-8'))
+			else:
+				crud.release_idempotency_key(db, user_id, idempotency_key)
+			raise
+		except Exception:
+			db.rollback()
+			crud.release_idempotency_key(db, user_id, idempotency_key)
+			raise
+
+		content = http_cache.serialize(response_model.from_orm(result))
+		crud.complete_idempotency_key(db, user_id, idempotency_key, 200, content.decode('utf-8'))
+		return Response(content=content, media_type='application/json')
+	finally:
+		del in_flight[(user_id, idempotency_key)]
+		event.set()
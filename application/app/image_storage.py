@@ -0,0 +1,139 @@
+# image_storage.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import uuid
+import aiofiles
+from abc import ABC, abstractmethod
+from starlette.concurrency import run_in_threadpool
+from app.metrics import Histogram
+
+# fsync policies
+FSYNC_NONE = 'none'				# leave flushing to the operating system
+FSYNC_FILE = 'file'				# fsync the written file
+FSYNC_DIRECTORY = 'directory'	# fsync the written file and its parent directory so the rename is durable
+
+write_latency = Histogram('image_storage_write_seconds')
+
+
+class ImageStorage(ABC):
+	'''
+	Stores image files under a root directory, keyed by a relative path.
+	All operations are coroutines and never block the event loop.
+	'''
+
+	def __init__(self, root_directory: str):
+		self.root_directory = root_directory
+
+	def get_path(self, key: str):
+		return os.path.join(self.root_directory, key)
+
+	async def exists(self, key: str):
+		return await run_in_threadpool(os.path.exists, self.get_path(key))
+
+	async def write(self, key: str, data: bytes):
+		with write_latency.time():
+			await self._write(key, data)
+
+	async def delete(self, key: str):
+		'''
+		Return:
+			True if the file was deleted, False if it did not exist
+		'''
+
+		try:
+			await run_in_threadpool(os.remove, self.get_path(key))
+			return True
+		except FileNotFoundError:
+			return False
+
+	@abstractmethod
+	async def _write(self, key: str, data: bytes):
+		pass
+
+
+class AsyncFileStorage(ImageStorage):
+	'''
+	Writes files on the local filesystem through aiofiles
+	'''
+
+	def __init__(self, root_directory: str, fsync_policy: str = FSYNC_NONE):
+		super().__init__(root_directory)
+		if(fsync_policy not in (FSYNC_NONE, FSYNC_FILE, FSYNC_DIRECTORY)):
+			raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+		self.fsync_policy = fsync_policy
+
+	async def _write(self, key: str, data: bytes):
+		path = self.get_path(key)
+		directory = os.path.dirname(path)
+		await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+
+		# Write to a temporary file and move it into place, readers never see a partial file
+		temporary_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+		async with aiofiles.open(temporary_path, 'wb') as f:
+			await f.write(data)
+			if(self.fsync_policy != FSYNC_NONE):
+				await f.flush()
+				await run_in_threadpool(os.fsync, f.fileno())
+		await run_in_threadpool(os.replace, temporary_path, path)
+
+		if(self.fsync_policy == FSYNC_DIRECTORY):
+			await run_in_threadpool(fsync_directory, directory)
+
+
+class LocalObjectStorage(ImageStorage):
+	'''
+	Local filesystem stand-in for an object store backend.
+	Objects are written whole to a staging area and published under their key in a single rename,
+	mirroring the put semantics of an object store.
+	'''
+
+	def __init__(self, root_directory: str):
+		super().__init__(root_directory)
+		# Next to the root directory so staged objects are not served, on the same filesystem so the rename is atomic
+		root_directory = os.path.abspath(root_directory)
+		self.staging_directory = os.path.join(os.path.dirname(root_directory), '.{}-staging'.format(os.path.basename(root_directory)))
+
+	async def _write(self, key: str, data: bytes):
+		await run_in_threadpool(self._put_object, key, data)
+
+	def _put_object(self, key: str, data: bytes):
+		os.makedirs(self.staging_directory, exist_ok=True)
+		staging_path = os.path.join(self.staging_directory, uuid.uuid4().hex)
+		with open(staging_path, 'wb') as f:
+			f.write(data)
+
+		path = self.get_path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		os.replace(staging_path, path)
+
+
+def fsync_directory(directory: str):
+	fd = os.open(directory, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+def get_storage(root_directory: str):
+	'''
+	Create the image storage backend configured by IMAGE_STORAGE_BACKEND
+
+	Parameters:
+		root_directory (str): Directory the files are stored in
+	Return:
+		ImageStorage
+	'''
+
+	backend = os.getenv('IMAGE_STORAGE_BACKEND') or 'file'
+	if(backend == 'file'):
+		return AsyncFileStorage(root_directory, os.getenv('IMAGE_STORAGE_FSYNC') or FSYNC_NONE)
+	if(backend == 'object'):
+		return LocalObjectStorage(root_directory)
+
+	raise ValueError(f"Unknown image storage backend: {backend}")
@@ -0,0 +1,327 @@
+# inference.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import io
+import os
+import threading
+import httpx
+import numpy as np
+from app.metrics import Family, Histogram
+
+# Inference backends
+BACKEND_KERAS = 'keras'
+BACKEND_TFLITE = 'tflite'
+BACKEND_ONNX = 'onnx'
+BACKEND_REMOTE = 'remote'
+
+# Models of the app
+MODEL_CLASSIFICATION = 'classification'
+MODEL_DETECTION = 'detection'
+MODEL_DETECTION_PREFILTER = 'detection_prefilter'
+MODELS = (MODEL_CLASSIFICATION, MODEL_DETECTION, MODEL_DETECTION_PREFILTER)
+
+# Where the models run
+MODE_LOCAL = 'local'
+MODE_LAZY = 'lazy'
+MODE_REMOTE = 'remote'
+
+# local: loaded at startup, lazy: loaded by their first prediction, remote: run by the inference worker,
+# only local loads Keras and TensorFlow at startup
+INFERENCE_MODE = os.getenv('INFERENCE_MODE') or MODE_LOCAL
+
+# URL of the inference worker of the remote mode, see inference_worker.py
+INFERENCE_WORKER_URL = os.getenv('INFERENCE_WORKER_URL') or 'http://127.0.0.1:9001'
+
+# Seconds before a request to the inference worker fails
+INFERENCE_WORKER_TIMEOUT = float(os.getenv('INFERENCE_WORKER_TIMEOUT') or 30)
+
+# Batch size buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+inference_latency = Family(Histogram, 'inference_seconds', ('model', 'backend'), 'Latency of the models per batch')
+inference_batch_size = Family(Histogram, 'inference_batch_size', ('model', 'backend'), 'Images per batch run by the models', buckets=BATCH_SIZE_BUCKETS)
+
+
+# Images and predictions exchanged with the inference worker
+NPY_CONTENT_TYPE = 'application/x-npy'
+
+
+def encode_array(array):
+	f = io.BytesIO()
+	np.save(f, np.asarray(array), allow_pickle=False)
+	return f.getvalue()
+
+
+def decode_array(content: bytes):
+	return np.load(io.BytesIO(content), allow_pickle=False)
+
+
+def quantize(image, scale: float, zero_point: int, dtype):
+	'''
+	Quantizes a float image to the integer dtype of a quantized input, rounded to the nearest step and saturated,
+	casting alone would truncate and wrap around
+	'''
+	limits = np.iinfo(dtype)
+	return np.clip(np.round(image / scale + zero_point), limits.min, limits.max).astype(dtype)
+
+
+def dequantize(prediction, scale: float, zero_point: int):
+	return (prediction.astype(np.float32) - zero_point) * scale
+
+
+class InferenceUnavailableError(Exception):
+	pass
+
+
+class InferenceBackend:
+	'''
+	Runs a model on a batch of preprocessed images
+	'''
+
+	# Name of the backend in the metrics
+	name = None
+
+	# Model of the app run by the backend, e.g. classification
+	model_name = None
+
+	# (height, width) of the model input
+	input_size = None
+
+	def predict(self, images):
+		'''
+		Parameters:
+			images: float32 numpy array of shape (batch, height, width, channels)
+		Return:
+			Numpy array of shape (batch, classes) containing the class probabilities
+		'''
+
+		inference_batch_size.labels(self.model_name, self.name).observe(len(images))
+		with inference_latency.labels(self.model_name, self.name).time():
+			return self._predict(images)
+
+	def _predict(self, images):
+		raise NotImplementedError
+
+
+class KerasBackend(InferenceBackend):
+	name = BACKEND_KERAS
+
+	def __init__(self, model_path: str):
+		from keras.models import load_model
+		self.model = load_model(model_path, compile=False)
+		self.input_size = tuple(self.model.layers[0].input_shape[1:3])
+
+	def _predict(self, images):
+		return self.model.predict(images)
+
+
+class TFLiteBackend(InferenceBackend):
+	'''
+	Runs a TFLite export of the model, float16 and int8 quantized exports are supported
+	'''
+
+	name = BACKEND_TFLITE
+
+	def __init__(self, model_path: str, threads: int = None):
+		import tensorflow as tf
+		self.interpreter = tf.lite.Interpreter(model_path=model_path)
+		if(threads is not None and hasattr(self.interpreter, 'set_num_threads')):
+			self.interpreter.set_num_threads(threads)
+		self.interpreter.allocate_tensors()
+
+		self.input_details = self.interpreter.get_input_details()[0]
+		self.output_details = self.interpreter.get_output_details()[0]
+		self.input_size = tuple(self.input_details['shape'][1:3])
+
+	def _predict(self, images):
+		input_scale, input_zero_point = self.input_details['quantization']
+		output_scale, output_zero_point = self.output_details['quantization']
+
+		predictions = []
+		for image in images:
+			# Quantize the input of int8 models
+			if(input_scale != 0):
+				image = quantize(image, input_scale, input_zero_point, self.input_details['dtype'])
+			self.interpreter.set_tensor(self.input_details['index'], np.array([image], dtype=self.input_details['dtype']))
+			self.interpreter.invoke()
+
+			prediction = self.interpreter.get_tensor(self.output_details['index'])[0]
+			if(output_scale != 0):
+				prediction = dequantize(prediction, output_scale, output_zero_point)
+			else:
+				prediction = prediction.astype(np.float32)
+			predictions.append(prediction)
+
+		return np.array(predictions)
+
+
+class OnnxBackend(InferenceBackend):
+	'''
+	Runs an ONNX export of the model through ONNX Runtime, requires the onnxruntime package
+	'''
+
+	name = BACKEND_ONNX
+
+	def __init__(self, model_path: str, threads: int = None):
+		try:
+			import onnxruntime
+		except ImportError:
+			raise ImportError("The onnx inference backend requires onnxruntime. Install it with: pip install onnxruntime")
+
+		options = onnxruntime.SessionOptions()
+		if(threads is not None):
+			options.intra_op_num_threads = threads
+		self.session = onnxruntime.InferenceSession(model_path, options)
+		self.input_name = self.session.get_inputs()[0].name
+		self.input_size = tuple(self.session.get_inputs()[0].shape[1:3])
+
+	def _predict(self, images):
+		return self.session.run(None, {self.input_name: images.astype(np.float32)})[0]
+
+
+class LazyBackend(InferenceBackend):
+	'''
+	Loads its model on the first prediction or input size lookup, instead of at startup
+	'''
+
+	def __init__(self, model_name: str):
+		self.model_name = model_name
+		self.__backend = None
+		self.__lock = threading.Lock()
+
+	@property
+	def name(self):
+		return self._get_backend().name
+
+	@property
+	def input_size(self):
+		return self._get_backend().input_size
+
+	def predict(self, images):
+		# The loaded backend records the metrics
+		return self._get_backend().predict(images)
+
+	def _get_backend(self):
+		if(self.__backend is None):
+			with self.__lock:
+				if(self.__backend is None):
+					print(f"[INFO] Loading {self.model_name} model")
+					self.__backend = load_local_backend(self.model_name)
+		return self.__backend
+
+
+class RemoteBackend(InferenceBackend):
+	'''
+	Runs a model in the inference worker, images and predictions are sent as .npy files
+	'''
+
+	name = BACKEND_REMOTE
+
+	def __init__(self, model_name: str, url: str = INFERENCE_WORKER_URL, timeout: float = INFERENCE_WORKER_TIMEOUT):
+		self.model_name = model_name
+		self.client = httpx.Client(base_url=url, timeout=timeout)
+		self.__input_size = None
+
+	@property
+	def input_size(self):
+		# Asked on first use, the worker may start after the API
+		if(self.__input_size is None):
+			self.__input_size = tuple(self._request('GET', f"/models/{self.model_name}").json()['input_size'])
+		return self.__input_size
+
+	def _predict(self, images):
+		response = self._request('POST', f"/models/{self.model_name}/predict", content=encode_array(images), headers={'Content-Type': NPY_CONTENT_TYPE})
+		return decode_array(response.content)
+
+	def _request(self, method: str, url: str, **kwargs):
+		try:
+			response = self.client.request(method, url, **kwargs)
+			response.raise_for_status()
+		except httpx.HTTPError as e:
+			raise InferenceUnavailableError(f"The inference worker failed to run the {self.model_name} model: {e}")
+		return response
+
+
+def load_backend(backend: str, model_path: str, threads: int = None, model_name: str = MODEL_CLASSIFICATION):
+	'''
+	Load a model with the given inference backend
+
+	Parameters:
+		backend (str): keras, tflite or onnx
+		model_path (str): Path to the model, or its export for the backend
+		threads (int): Number of threads used by the tflite and onnx backends
+		model_name (str): Model of the app, in the metrics
+	Return:
+		InferenceBackend
+	'''
+
+	if(backend == BACKEND_KERAS):
+		model = KerasBackend(model_path)
+	elif(backend == BACKEND_TFLITE):
+		model = TFLiteBackend(model_path, threads)
+	elif(backend == BACKEND_ONNX):
+		model = OnnxBackend(model_path, threads)
+	else:
+		raise ValueError(f"Unknown inference backend: {backend}")
+
+	model.model_name = model_name
+	return model
+
+
+def get_model_config(model_name: str):
+	'''
+	Return:
+		(backend, model path, threads) of a model of the app, the model path is None if it is not configured
+	'''
+
+	if(model_name == MODEL_CLASSIFICATION):
+		backend = os.getenv('FOOD_CLASSIFICATION_BACKEND') or BACKEND_KERAS
+		model_path = os.getenv('FOOD_CLASSIFICATION_MODEL')
+		if(backend != BACKEND_KERAS):
+			model_path = os.getenv('FOOD_CLASSIFICATION_EXPORT') or model_path
+		threads = os.getenv('FOOD_CLASSIFICATION_THREADS')
+		return backend, model_path or None, int(threads) if threads else None
+	if(model_name == MODEL_DETECTION):
+		return BACKEND_KERAS, os.getenv('FOOD_DETECTION_MODEL') or None, None
+	if(model_name == MODEL_DETECTION_PREFILTER):
+		return BACKEND_KERAS, os.getenv('FOOD_DETECTION_PREFILTER_MODEL') or None, None
+
+	raise ValueError(f"Unknown model: {model_name}")
+
+
+def load_local_backend(model_name: str):
+	'''
+	Load a model of the app in this process, with the backend configured by the environment
+
+	Return:
+		InferenceBackend, or None if the model is not configured
+	'''
+
+	backend, model_path, threads = get_model_config(model_name)
+	if(model_path is None):
+		return None
+	return load_backend(backend, model_path, threads, model_name)
+
+
+def get_backend(model_name: str, mode: str = INFERENCE_MODE):
+	'''
+	Get a model of the app for the configured inference mode, only the local mode loads it here
+
+	Return:
+		InferenceBackend, or None if the model is not configured
+	'''
+
+	if(get_model_config(model_name)[1] is None):
+		return None
+	if(mode == MODE_LOCAL):
+		return load_local_backend(model_name)
+	if(mode == MODE_LAZY):
+		return LazyBackend(model_name)
+	if(mode == MODE_REMOTE):
+		return RemoteBackend(model_name)
+
+	raise ValueError(f"Unknown inference mode: {mode}")
@@ -0,0 +1,60 @@
+# inference_worker.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+from fastapi import FastAPI, HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, PlainTextResponse
+from starlette.status import HTTP_404_NOT_FOUND, HTTP_415_UNSUPPORTED_MEDIA_TYPE
+from app import inference, metrics
+
+# Runs the models for API workers started with INFERENCE_MODE=remote, only this process imports Keras and TensorFlow.
+# Started by start.sh next to the API, on the port of INFERENCE_WORKER_URL:
+# uvicorn app.inference_worker:app --host 127.0.0.1 --port 9001
+app = FastAPI(title='Inference worker', openapi_url=None)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Loaded models by name
+models = {}
+
+
+@app.on_event('startup')
+def startup():
+	for model_name in inference.MODELS:
+		model = inference.load_local_backend(model_name)
+		if(model is not None):
+			print(f"[INFO] Loaded {model_name} model")
+			models[model_name] = model
+	metrics.start_flushing()
+
+
+def get_model(model_name: str):
+	if(model_name not in models):
+		raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"The {model_name} model is not loaded")
+	return models[model_name]
+
+
+@app.get('/models/{model_name}')
+def get_model_info(model_name: str):
+	model = get_model(model_name)
+	return {'backend': model.name, 'input_size': [int(size) for size in model.input_size]}
+
+
+@app.post('/models/{model_name}/predict')
+async def predict(model_name: str, request: Request):
+	model = get_model(model_name)
+	if(request.headers.get('content-type') != inference.NPY_CONTENT_TYPE):
+		raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Images must be sent as {inference.NPY_CONTENT_TYPE}")
+
+	images = inference.decode_array(await request.body())
+	predictions = await run_in_threadpool(model.predict, images)
+	return Response(inference.encode_array(predictions), media_type=inference.NPY_CONTENT_TYPE)
+
+
+@app.get('/metrics')
+def get_metrics():
+	return PlainTextResponse(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
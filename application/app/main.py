@@ -5,10 +5,9 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import traceback
-from keras.models import load_model
-from app.database import SessionLocal
+from app.database import SessionLocal, engine
 from app.nutrition_service import NutritionService
-from app import crud, models, schemas, security, smart_diet_watcher, trend_analyzer, push_service
+from app import crud, models, schemas, security, smart_diet_watcher, trend_analyzer, push_service, image_storage, food_detector, inference, rate_limiter, catalog_cache, http_cache, fast_json, compression, clinician_dashboard, notifications, authorization_cache, event_hub, health_series, delta_sync, batch, idempotency, sql_instrumentation, metrics, profiler
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from jwt import PyJWTError
@@ -17,9 +16,10 @@ from sqlalchemy.orm import Session
 from typing import List
 from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND, HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_503_SERVICE_UNAVAILABLE
 from starlette.staticfiles import StaticFiles
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.requests import Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi import FastAPI, Depends, HTTPException, Response, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Response, BackgroundTasks, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import json
@@ -46,6 +46,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    compression.CompressionMiddleware,
+    **compression.get_compression_options(),
+)
+sql_instrumentation.instrument(engine)
+app.add_middleware(sql_instrumentation.SQLInstrumentationMiddleware)
+app.add_middleware(profiler.RequestProfilerMiddleware)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 # For offline development
 # from fastapi.openapi.docs import (
 # 	get_redoc_html,
@@ -79,15 +87,28 @@ def get_db():
 
 
 class ListDependencies:
-    def __init__(self, query: str = None, skip: int = 0, limit: int = 20):
-        self.query = query
+    def __init__(self, query: str = None, skip: int = 0, limit: int = 20, start: datetime = None, end: datetime = None):
+        self.query = query.strip() if query else None
         self.skip = skip
         self.limit = limit
+        self.start = start
+        self.end = end
+
+
+class ImageStaticFiles(StaticFiles):
+    """
+    Serves images from /{user_id}/{file_name}, resolving content addressed images to their sharded directory
+    """
+
+    def get_path(self, scope) -> str:
+        path = super().get_path(scope)
+        user_id, file_name = os.path.split(path)
+        return smart_diet_watcher.get_relative_path(user_id, file_name)
 
 
 # Mount Static Files
-app.mount('/image', StaticFiles(directory=os.getenv('IMAGE_DIRECTORY')), name='static')
-app.mount('/thumbnail', StaticFiles(directory=os.getenv('THUMBNAIL_DIRECTORY')), name='static')
+app.mount('/image', ImageStaticFiles(directory=os.getenv('IMAGE_DIRECTORY')), name='static')
+app.mount('/thumbnail', ImageStaticFiles(directory=os.getenv('THUMBNAIL_DIRECTORY')), name='static')
 
 
 # Frontend Fallback
@@ -108,14 +129,10 @@ async def root():
 # App Initialization
 @app.on_event('startup')
 def startup():
-    # Food classification model
-    print('[INFO] Loading food classification model')
+    # Only the local inference mode loads the models, and Keras and TensorFlow, here
+    print('[INFO] Loading inference models ({} mode)'.format(inference.INFERENCE_MODE))
     global food_classification_model, prediction_classes
-    if(os.getenv('FOOD_CLASSIFICATION_MODEL') != ''):
-        food_classification_model = load_model(
-            os.getenv('FOOD_CLASSIFICATION_MODEL'), compile=False)
-    else:
-        food_classification_model = None
+    food_classification_model = inference.get_backend(inference.MODEL_CLASSIFICATION)
 
     prediction_classes = []
     with open(os.getenv('MODEL_CLASSES')) as f:
@@ -124,31 +141,74 @@ def startup():
             if(prediction_class != ''):
                 prediction_classes.append(prediction_class)
 
-    print('[INFO] Loading food detection model')
-    global food_detection_model
-    if(os.getenv('FOOD_DETECTION_MODEL') != ''):
-        food_detection_model = load_model(
-            os.getenv('FOOD_DETECTION_MODEL'), compile=False)
+    global tiered_food_detector
+    food_detection_model = inference.get_backend(inference.MODEL_DETECTION)
+    food_detection_prefilter_model = inference.get_backend(inference.MODEL_DETECTION_PREFILTER)
+    if(food_detection_model is not None):
+        tiered_food_detector = food_detector.get_detector(
+            food_detection_model, food_detection_prefilter_model)
     else:
-        food_detection_model = None
+        tiered_food_detector = None
+
+    print('[INFO] Loading catalog')
+    catalog_cache.catalog.start()
+    notifications.listener.start()
+    metrics.start_flushing()
     print('[INFO] Startup complete')
 
 
+@app.on_event('shutdown')
+def shutdown():
+    security.password_hasher.shutdown()
+    catalog_cache.catalog.stop()
+    notifications.listener.stop()
+
+
+# Password hashing is saturated, reject instead of queueing
+@app.exception_handler(security.PasswordHasherBusyError)
+async def password_hasher_busy_handler(request: Request, exc: security.PasswordHasherBusyError):
+    return JSONResponse(status_code=HTTP_503_SERVICE_UNAVAILABLE, content={'detail': str(exc)}, headers={'Retry-After': '1'})
+
+
+# The inference worker is down or failed
+@app.exception_handler(inference.InferenceUnavailableError)
+async def inference_unavailable_handler(request: Request, exc: inference.InferenceUnavailableError):
+    print('[ERROR] {}'.format(exc))
+    return JSONResponse(status_code=HTTP_503_SERVICE_UNAVAILABLE, content={'detail': 'Food recognition is unavailable'}, headers={'Retry-After': '5'})
+
+
 # Authentication
 SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_DURATION = int(os.getenv('ACCESS_TOKEN_EXPIRE_DURATION'))
 ACCESS_TOKEN_EXPIRE = int(os.getenv('ACCESS_TOKEN_EXPIRE'))
 
+# Emails of the users allowed on the admin endpoints, e.g. the profiler
+ADMIN_EMAILS = {email.strip().lower() for email in (os.getenv('ADMIN_EMAILS') or '').split(',') if email.strip()}
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/token')
 
+login_shield = rate_limiter.get_login_shield()
+
 # Assorted Functions
-def authenticate_user(db: Session, username: str, password: str):
+async def verify_user_password(db: Session, user: models.User, password: str):
+    verified, new_password_hash = await security.password_hasher.verify_and_update(password, user.password)
+
+    # Rehash passwords hashed with outdated parameters, e.g. a changed cost factor
+    if(verified and new_password_hash is not None):
+        crud.update_user_password_hash(db, user.user_id, new_password_hash)
+
+    return verified
+
+
+async def authenticate_user(db: Session, username: str, password: str):
     user = crud.get_user_by_email(db, username)
 
     if not user:
+        # Reject further attempts for this username before querying the database
+        login_shield.unknown_usernames.add(username)
         return False
-    if not security.verify_password(password, user.password):
+    if not await verify_user_password(db, user, password):
         return False
 
     return user
@@ -172,6 +232,19 @@ def check_password_length(password: str):
     else:
         return False
 
+# Events are sent when the transaction of the write commits, publish them before committing it
+def publish_assignment_event(db: Session, clinician_id: int, user_id: int, clinician_assignment_id: int, event_type: str):
+    # Both the clinician and the patient refresh their assignment lists
+    event_hub.hub.publish(db, [clinician_id, user_id], event_type,
+                          clinician_assignment_id=clinician_assignment_id)
+
+
+def publish_meal_event(db: Session, user_id: int, meal_id: int, event_type: str):
+    # The patient's other devices and their clinicians refresh the meal
+    event_hub.hub.publish(db, [user_id] + crud.get_accepted_clinician_ids(db, user_id), event_type,
+                          user_id=user_id, meal_id=meal_id)
+
+
 # better suited for a background task if possible
 def push_notification(db: Session, userid: int, title: str, message: str, extra=None):
     from exponent_server_sdk import (DeviceNotRegisteredError, PushServerError)
@@ -184,19 +257,33 @@ def push_notification(db: Session, userid: int, title: str, message: str, extra=
             while(retries < 3 and push_service.send_push_message(user.push_token, title, message, extra)):
                 # Will retry on ConnectionError or HTTPError or PushTicketError
                 retries += 1
+            push_service.dispatch_outcomes.labels('failed' if retries == 3 else 'sent').inc()
         except (TokenEmptyError, PushServerError) as exc:
             # Token is empty or Push message malformed, just handle handle it as failed push
+            push_service.dispatch_outcomes.labels('token_empty' if isinstance(exc, TokenEmptyError) else 'server_error').inc()
             print(f"{exc}")
             pass
         except DeviceNotRegisteredError:
             # Disable user's token if suspected device not registered
+            push_service.dispatch_outcomes.labels('device_not_registered').inc()
             crud.disable_user_push_token(db, user.push_token)
 
 
 @app.post('/token')
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(
-        db, form_data.username.lower(), form_data.password)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    username = form_data.username.lower()
+
+    # Drop abusive attempts before any database or bcrypt work
+    rejection = login_shield.check(username, request.client.host)
+    if(rejection is not None and rejection != rate_limiter.REJECTED_UNKNOWN_USERNAME):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(login_shield.get_retry_after(rejection))},
+        )
+
+    # Known unknown usernames get the answer of a wrong password
+    user = await authenticate_user(db, username, form_data.password) if rejection is None else False
 
     # check if user is found
     if(not user):
@@ -260,12 +347,16 @@ async def get_clinician(user: schemas.User = Depends(get_user), db: Session = De
     return user
 
 
-async def check_clinician_assignment(db: Session, clinician_uid: int, user_id: int):
-    db_clinician_assignment = crud.get_clinician_assignment(
-        db, clinician_uid, user_id)
+async def get_admin(user: schemas.User = Depends(get_user)):
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail='Unauthorized')
+    return user
+
 
-    if(db_clinician_assignment is not None):
-        return db_clinician_assignment.assignment_accepted
+async def check_clinician_assignment(db: Session, clinician_uid: int, user_id: int):
+    # Set lookup, the clinician's accepted patients are cached after their first request
+    if(user_id in crud.get_accepted_patient_ids(db, clinician_uid)):
+        return True
     else:
         raise HTTPException(
             status_code=HTTP_401_UNAUTHORIZED, detail='Unauthorized')
@@ -297,7 +388,9 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
             status_code=400, detail='Please enter a password between 8 and 128 characters long.')
 
     # return user
-    return crud.create_user(db, user.email, user.password, 0)
+    db_user = crud.create_user(db, user.email, await security.password_hasher.hash(user.password), 0)
+    login_shield.unknown_usernames.discard(db_user.email.lower())
+    return db_user
 
 
 @app.post('/users/register-username/', response_model=schemas.User)
@@ -315,7 +408,9 @@ async def create_user_by_username(user: schemas.UserCreateByUsername, db: Sessio
     if not check_password_length(user.password):
         raise HTTPException(
             status_code=400, detail='Please enter a password between 8 and 128 characters long.')
-    return crud.create_user(db, email, user.password, 0)
+    db_user = crud.create_user(db, email, await security.password_hasher.hash(user.password), 0)
+    login_shield.unknown_usernames.discard(db_user.email.lower())
+    return db_user
 
 
 @app.get('/users/me', response_model=schemas.User)
@@ -330,14 +425,14 @@ async def update_user_info(user_info: schemas.UserInfo, db: Session = Depends(ge
 
 @app.post('/users/me/change-password')
 async def change_password(password: schemas.PasswordChange, db: Session = Depends(get_db), current_user=Depends(get_user)):
-    if(crud.verify_user_password(db, current_user.user_id, password.current_password)):
+    if(await verify_user_password(db, current_user, password.current_password)):
         # check password length
         if not check_password_length(password.new_password):
             raise HTTPException(
                 status_code=400, detail='Please enter a password between 8 and 128 characters long.')
 
         crud.update_user_password(
-            db, current_user.user_id, password.new_password)
+            db, current_user.user_id, await security.password_hasher.hash(password.new_password))
         db_user = crud.get_user_by_id(db, current_user.user_id)
         access_token = create_access_token(data={
             'user_id': db_user.user_id,
@@ -383,7 +478,15 @@ async def assign_clinician(clinician: schemas.ClinicianAssignmentCreate, backgro
             # Send to background a push notification
             background_tasks.add_task(push_notification, db, db_existing_assignment.clinician_id,
                                       title="New Request from Patient", message="A new request from user", extra=json.dumps({"navigator": "ClinicianTab", "screen": "Assignments"}))
-            return crud.update_clinician_assignment_status(db, db_existing_assignment.clinician_assignment_id, None)
+            # Read before the update expires the existing assignment
+            clinician = schemas.Clinician.from_orm(db_existing_assignment.clinician)
+            db_clinician_assignment = crud.update_clinician_assignment_status(
+                db, db_existing_assignment.clinician_assignment_id, None, commit=False)
+            db_clinician_assignment.clinician = clinician
+            publish_assignment_event(db, db_clinician_assignment.clinician_id, db_clinician_assignment.user_id,
+                                     db_clinician_assignment.clinician_assignment_id, event_hub.ASSIGNMENT_CREATED)
+            db.commit()
+            return db_clinician_assignment
         else:
             raise HTTPException(
                 status_code=403, detail='Clinician assignment already exists.')
@@ -392,12 +495,15 @@ async def assign_clinician(clinician: schemas.ClinicianAssignmentCreate, backgro
     background_tasks.add_task(push_notification, db, clinician.clinician_id,
                               title="New Request from Patient1", message="A new request from user", extra=json.dumps({"navigator": "ClinicianTab", "screen": "Assignments"}))
     db_clinician_assignment = crud.create_clinician_assignment(
-        db, clinician.clinician_id, current_user.user_id)
+        db, clinician.clinician_id, current_user.user_id, commit=False)
 
     if(db_clinician_assignment is None):
         raise HTTPException(
             status_code=403, detail='The selected user is not a clinician.')
 
+    publish_assignment_event(db, db_clinician_assignment.clinician_id, db_clinician_assignment.user_id,
+                             db_clinician_assignment.clinician_assignment_id, event_hub.ASSIGNMENT_CREATED)
+    db.commit()
     return db_clinician_assignment
 
 
@@ -410,7 +516,12 @@ async def delete_clinician_assignment(clinician_assignment_id: int, db: Session
                             detail='Clinician assignment does not exist.')
 
     if(db_clinician_assignment.user_id == current_user.user_id):
-        return crud.delete_clinician_assignment(db, clinician_assignment_id)
+        clinician_id = db_clinician_assignment.clinician_id
+        deleted = crud.delete_clinician_assignment(db, clinician_assignment_id, commit=False)
+        publish_assignment_event(db, clinician_id, current_user.user_id,
+                                 clinician_assignment_id, event_hub.ASSIGNMENT_DELETED)
+        db.commit()
+        return deleted
     else:
         raise HTTPException(
             status_code=HTTP_401_UNAUTHORIZED, detail='Unauthorized')
@@ -422,6 +533,14 @@ async def get_clinician_assigned_users(db: Session = Depends(get_db), current_us
     return crud.clinician_view_assignments(db, current_user.user_id)
 
 
+@app.get('/clinician/dashboard/')
+async def get_clinician_dashboard(meal_limit: int = 5, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_clinician)):
+    # One schemas.ClinicianDashboardPatient per line, streamed in batches of patients
+    return StreamingResponse(
+        clinician_dashboard.iterate_dashboard(db, current_user.user_id, meal_limit),
+        media_type='application/x-ndjson')
+
+
 @app.get('/clinician/assignments/{clinician_assignment_id}/accept', response_model=schemas.ClinicianAssignment)
 async def clinician_accept_assignment(clinician_assignment_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_clinician)):
     db_clinician_assignment = crud.get_clinician_assignment_by_id(
@@ -433,7 +552,11 @@ async def clinician_accept_assignment(clinician_assignment_id: int, background_t
     # Send to background a push notification
     background_tasks.add_task(push_notification, db, db_clinician_assignment.user_id,
                               title="Notification Title", message="Message here (Accepted)", extra=json.dumps({"navigator": "ClinicianNavigator", "screen": "Assignment"}))
-    return crud.update_clinician_assignment_status(db, clinician_assignment_id, True)
+    db_clinician_assignment = crud.update_clinician_assignment_status(db, clinician_assignment_id, True, commit=False)
+    publish_assignment_event(db, db_clinician_assignment.clinician_id, db_clinician_assignment.user_id,
+                             clinician_assignment_id, event_hub.ASSIGNMENT_ACCEPTED)
+    db.commit()
+    return db_clinician_assignment
 
 
 @app.get('/clinician/assignments/{clinician_assignment_id}/decline')
@@ -447,7 +570,11 @@ async def clinician_decline_assignment(clinician_assignment_id: int, background_
     # Send to background a push notification
     background_tasks.add_task(push_notification, db, db_clinician_assignment.user_id,
                               title="Notification Title", message="Message here (Declined)", extra=json.dumps({"navigator": "ClinicianNavigator", "screen": "Assignment"}))
-    return crud.update_clinician_assignment_status(db, clinician_assignment_id, False)
+    db_clinician_assignment = crud.update_clinician_assignment_status(db, clinician_assignment_id, False, commit=False)
+    publish_assignment_event(db, db_clinician_assignment.clinician_id, db_clinician_assignment.user_id,
+                             clinician_assignment_id, event_hub.ASSIGNMENT_DECLINED)
+    db.commit()
+    return db_clinician_assignment
 
 
 @app.get('/clinician/assigned-users/{user_id}/health-profile/', response_model=schemas.Profile)
@@ -461,7 +588,14 @@ async def clinician_view_user_health_profile(user_id: int, db: Session = Depends
 async def clinician_view_user_health_records_list(user_id: int, list_query: ListDependencies = Depends(ListDependencies), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_clinician)):
     await check_clinician_assignment(db, current_user.user_id, user_id)
 
-    return crud.get_user_health_record_list(db, user_id, list_query.query, list_query.skip, list_query.limit)
+    return fast_json.get_response(schemas.HealthRecord, crud.get_user_health_record_list(db, user_id, list_query.query, list_query.skip, list_query.limit, list_query.start, list_query.end))
+
+
+@app.get('/clinician/assigned-users/{user_id}/health-records/series', response_model=schemas.HealthRecordSeries)
+async def clinician_view_user_health_records_series(user_id: int, metric: str, resolution: str = 'day', start: datetime = None, end: datetime = None, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_clinician)):
+    await check_clinician_assignment(db, current_user.user_id, user_id)
+
+    return get_health_record_series(db, user_id, metric, resolution, start, end)
 
 
 @app.get('/clinician/view-health-record/{health_record_id}')
@@ -477,7 +611,7 @@ async def clinician_view_user_health_record(health_record_id: int, db: Session =
 async def clinician_view_user_meal_list(user_id: int, list_query: ListDependencies = Depends(ListDependencies), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_clinician)):
     await check_clinician_assignment(db, current_user.user_id, user_id)
 
-    return crud.get_user_meal_list(db, user_id, list_query.query, list_query.skip, list_query.limit)
+    return fast_json.get_response(schemas.MealWithFoodItems, crud.get_user_meal_list(db, user_id, list_query.query, list_query.skip, list_query.limit, list_query.start, list_query.end))
 
 
 @app.get('/clinician/view-meal/{meal_id}')
@@ -491,8 +625,11 @@ async def clinician_view_user_meal(meal_id: int, db: Session = Depends(get_db),
 
 # Trend Analyzer
 @app.get('/trend-analyzer/features/', response_model=List[str])
-async def get_available_features():
-    return trend_analyzer.get_graph_features()
+async def get_available_features(request: Request):
+    # The features do not change while the server is running
+    payload = http_cache.catalog_payloads.get(
+        'trend-analyzer-features', 0, trend_analyzer.get_graph_features)
+    return http_cache.get_response(request, payload)
 
 
 @app.post('/trend-analyzer/generate-report/', response_model=schemas.TrendAnalyzerReport)
@@ -511,6 +648,37 @@ async def generate_report(report_settings: schemas.GenerateReportConfig, db: Ses
                                           )
 
 
+# Sync
+@app.get('/sync', response_model=schemas.SyncChanges)
+async def sync_changes(since: str = None, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+    # Rows of the user changed since the token of the previous sync, every row without one
+    try:
+        changes = delta_sync.get_changes(db, current_user.user_id, since)
+    except delta_sync.InvalidSyncToken:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Invalid sync token')
+
+    if(fast_json.FAST_JSON_RESPONSES):
+        return Response(content=fast_json.encode_object(schemas.SyncChanges, changes), media_type='application/json')
+    return changes
+
+
+# Batch
+@app.post('/batch', response_model=schemas.BatchResponse)
+async def run_batch(batch_request: schemas.BatchRequest, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+    """
+    Executes queued offline changes in order, in one transaction, with a result per operation.
+    Operations with an idempotency_key that already succeeded replay their stored result instead of running again.
+    """
+    if(len(batch_request.operations) > batch.BATCH_MAX_OPERATIONS):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"A batch is limited to {batch.BATCH_MAX_OPERATIONS} operations")
+
+    results, events = await batch.execute_batch(db, current_user.user_id, batch_request.operations)
+    for meal_id, event_type in sorted(events):
+        publish_meal_event(db, current_user.user_id, meal_id, event_type)
+    db.commit()
+    return {'results': results}
+
+
 # Health Monitor
 # Health Profile
 @app.get('/profile/', response_model=schemas.Profile)
@@ -535,7 +703,23 @@ async def update_health_profile(profile: schemas.ProfileBase, db: Session = Depe
 # Health Records
 @app.get('/health-records/', response_model=List[schemas.HealthRecord])
 async def get_health_records_list(list_query: ListDependencies = Depends(ListDependencies), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
-    return crud.get_user_health_record_list(db, current_user.user_id, list_query.query, list_query.skip, list_query.limit)
+    return fast_json.get_response(schemas.HealthRecord, crud.get_user_health_record_list(db, current_user.user_id, list_query.query, list_query.skip, list_query.limit, list_query.start, list_query.end))
+
+
+def get_health_record_series(db: Session, user_id: int, metric: str, resolution: str, start: datetime, end: datetime):
+    if(metric not in health_series.METRICS):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail='Available metrics are: ' + ', '.join(health_series.METRICS))
+    if(resolution not in health_series.RESOLUTIONS):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail='Available resolutions are: ' + ', '.join(health_series.RESOLUTIONS))
+
+    return health_series.get_series(db, user_id, metric, resolution, start, end)
+
+
+@app.get('/health-records/series', response_model=schemas.HealthRecordSeries)
+async def get_health_records_series(metric: str, resolution: str = 'day', start: datetime = None, end: datetime = None, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+    return get_health_record_series(db, current_user.user_id, metric, resolution, start, end)
 
 
 @app.get('/health-records/latest', response_model=schemas.HealthRecord)
@@ -593,13 +777,27 @@ async def delete_health_record(health_record_id: int, db: Session = Depends(get_
 # Smart Diet Watcher
 # Food
 @app.get('/food/', response_model=List[schemas.Food])
-async def list_food(db: Session = Depends(get_db), skip: int = 0):
-    return crud.get_food_list(db, skip)
+async def list_food(request: Request, db: Session = Depends(get_db), skip: int = 0, query: str = None, limit: int = 20):
+    if query and query.strip():
+        # Search results are not cached, the catalog pages are
+        return fast_json.get_response(schemas.Food, crud.search_food(db, query.strip(), skip, limit))
+
+    if skip != 0:
+        # Only the full catalog is cached, a payload per client chosen offset would evict it
+        return fast_json.get_response(schemas.Food, crud.get_food_list(db, skip))
+
+    payload = await http_cache.catalog_payloads.get_async(
+        'food', catalog_cache.catalog.version,
+        lambda: [schemas.Food.from_orm(food) for food in crud.get_food_list(db, skip)])
+    return http_cache.get_response(request, payload)
 
 @app.get('/food-id-strings/', response_model=List[str])
-async def get_food_id_strings(db: Session = Depends(get_db)):
+async def get_food_id_strings(request: Request):
     global prediction_classes
-    return prediction_classes
+    # Prediction classes are loaded once at startup
+    payload = http_cache.catalog_payloads.get(
+        'food-id-strings', 0, lambda: prediction_classes)
+    return http_cache.get_response(request, payload)
 
 
 @app.get('/food/{food_id}', response_model=schemas.Food)
@@ -617,28 +815,41 @@ async def get_food(food_id: str, db: Session = Depends(get_db)):
 
 @app.post('/food/detect/')
 async def detect_food(food_image: schemas.FoodImage, db: Session = Depends(get_db)):
-    global food_detection_model
+    global tiered_food_detector
 
-    if(food_detection_model != None):
-        return smart_diet_watcher.detect_food(food_detection_model, food_image.data)
+    if(tiered_food_detector != None):
+        return tiered_food_detector.detect(food_image.data)
     else:
         return False
 
 
 # Food Nutrition
 @app.get('/food/{food_id}/food-nutrition/', response_model=schemas.FoodWithNutrition)
-async def get_food_nutrition_list(food_id: str, db: Session = Depends(get_db)):
-    return crud.get_food_nutrition_list(db, food_id)
+async def get_food_nutrition_list(request: Request, food_id: str, db: Session = Depends(get_db)):
+    food = crud.get_food_nutrition_list(db, food_id)
+    if(food is None):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND,
+                            detail='Food not found')
+
+    payload = await http_cache.catalog_payloads.get_async(
+        ('food-nutrition', food.food_id), catalog_cache.catalog.version,
+        lambda: schemas.FoodWithNutrition.from_orm(food))
+    return http_cache.get_response(request, payload)
 
 
 # Meal
 @app.get('/meals/', response_model=List[schemas.MealWithFoodItems])
 async def get_user_meal_list(list_query: ListDependencies = Depends(ListDependencies), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
-    return crud.get_user_meal_list(db, current_user.user_id, list_query.query, list_query.skip, list_query.limit)
+    return fast_json.get_response(schemas.MealWithFoodItems, crud.get_user_meal_list(db, current_user.user_id, list_query.query, list_query.skip, list_query.limit, list_query.start, list_query.end))
 
 
 @app.get('/meals/{meal_id}', response_model=schemas.MealWithPredictions)
-async def get_user_meal(meal_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+async def get_user_meal(meal_id: int, top_k: int = Query(None, ge=1), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+    """
+    Returns the meal with its food predictions.
+    If top_k is given, only the top k predictions are returned in predictions with their food ID and probability,
+    instead of every class in food_predictions.
+    """
     meal = crud.get_meal(db, meal_id)
 
     if not bool(meal):
@@ -648,32 +859,64 @@ async def get_user_meal(meal_id: int, db: Session = Depends(get_db), current_use
     if(meal.user_id != current_user.user_id):
         raise HTTPException(status_code=403, detail='Access forbidden')
 
-    # predict food types
-    global food_classification_model
-    meal.food_predictions = smart_diet_watcher.predict_classes(food_classification_model, os.path.join(
-        os.getenv('IMAGE_DIRECTORY'), str(current_user.user_id), meal.image))
+    global food_classification_model, prediction_classes
+    image_path = smart_diet_watcher.get_image_path(current_user.user_id, meal.image)
 
-    return meal
+    # Built apart from the meal, the session must not see the predictions as changes to the row
+    response = schemas.MealWithPredictions.from_orm(meal)
+    if(top_k is not None):
+        response.predictions = smart_diet_watcher.predict_top_classes(food_classification_model, image_path, prediction_classes, top_k)
+        response.food_predictions = None
+    # predict food types if they were not stored with the meal
+    elif(meal.food_predictions is None):
+        response.food_predictions = smart_diet_watcher.predict_classes(food_classification_model, image_path)
+
+    return response
 
 
 @app.post('/meals/', response_model=schemas.MealWithPredictions)
-async def create_meal(meal_data: schemas.MealCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+async def create_meal(meal_data: schemas.MealCreate, top_k: int = Query(None, ge=1), idempotency_key: str = Header(None), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+    """
+    Creates a meal and predicts the food in its image.
+    If top_k is given, only the top k predictions are returned in predictions with their food ID and probability,
+    instead of every class in food_predictions.
+    Retried uploads with the same Idempotency-Key header replay the response of the first upload.
+    """
+    request_hash = idempotency.get_request_hash(meal_data.image, top_k)
+    return await idempotency.run(db, current_user.user_id, idempotency_key, 'POST /meals/', request_hash, schemas.MealWithPredictions,
+                                 lambda: save_meal(meal_data, top_k, db, current_user))
+
+
+async def save_meal(meal_data: schemas.MealCreate, top_k: int, db: Session, current_user: schemas.User):
     # save image to database
-    image = smart_diet_watcher.save_image(
+    image = await smart_diet_watcher.save_image(
         current_user.user_id, meal_data.image)
 
     if(image is None):
         raise HTTPException(status_code=415, detail='Format not supported')
 
-    # predict food types
-    global food_classification_model
-    predictions = smart_diet_watcher.predict_classes(food_classification_model, os.path.join(
-        os.getenv('IMAGE_DIRECTORY'), str(current_user.user_id), image))
-
-    meal = crud.create_meal(db, current_user.user_id, image)
-
-    meal.food_predictions = predictions
+    # collect_image_garbage may have deleted an existing copy before this lock, it cannot until the meal is committed
+    crud.lock_image(db, image, shared=True)
+    if(not await smart_diet_watcher.image_exists(current_user.user_id, image)):
+        await smart_diet_watcher.save_image(current_user.user_id, meal_data.image)
 
+    global food_classification_model, prediction_classes
+    image_path = smart_diet_watcher.get_image_path(current_user.user_id, image)
+
+    # predict food types, identical images have already been classified
+    predictions = crud.get_meal_predictions_by_image(db, image)
+    if(predictions is None):
+        predictions = smart_diet_watcher.predict_classes(food_classification_model, image_path)
+
+    meal = crud.create_meal(db, current_user.user_id, image, predictions, commit=False)
+    publish_meal_event(db, current_user.user_id, meal.meal_id, event_hub.MEAL_CREATED)
+    db.commit()
+
+    # The stored predictions are kept, the response only has the top k with their probabilities.
+    # The meal is the row returned by the insert, it is not tracked by the session
+    if(top_k is not None):
+        meal.predictions = smart_diet_watcher.predict_top_classes(food_classification_model, image_path, prediction_classes, top_k)
+        meal.food_predictions = None
     return meal
 
 
@@ -685,7 +928,9 @@ async def delete_meal(meal_id: int, db: Session = Depends(get_db), current_user:
                             detail='Meal not found')
 
     if(meal.user_id == current_user.user_id):
-        crud.delete_meal(db, meal.meal_id)
+        crud.delete_meal(db, meal.meal_id, commit=False)
+        publish_meal_event(db, current_user.user_id, meal_id, event_hub.MEAL_DELETED)
+        db.commit()
     else:
         raise HTTPException(status_code=403, detail='Not allowed')
 
@@ -704,7 +949,9 @@ async def update_meal_blood_glucose_reading(meal_id: int, blood_glucose: schemas
                             detail='Meal not found')
 
     db_blood_glucose = crud.update_meal_blood_glucose(
-        db, meal_id, blood_glucose)
+        db, meal_id, blood_glucose, commit=False)
+    publish_meal_event(db, current_user.user_id, meal_id, event_hub.MEAL_UPDATED)
+    db.commit()
     return {'detail': str(db_blood_glucose)}
 
 
@@ -737,12 +984,19 @@ async def get_food_items(meal_id: int, db: Session = Depends(get_db), current_us
 
 
 @app.post('/meals/{meal_id}/food-items/', response_model=schemas.FoodItemWithNutrition)
-async def create_food_item(meal_id: int, food_item: schemas.FoodItemCreateUpdate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
+async def create_food_item(meal_id: int, food_item: schemas.FoodItemCreateUpdate, idempotency_key: str = Header(None), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
     """
     Creates a food item for the meal.
     Either a food_id or new_food_type has to be provided for creation of the food item.
     If both are provided, the food_id will take precedence.
+    Retried requests with the same Idempotency-Key header replay the response of the first request.
     """
+    request_hash = idempotency.get_request_hash(meal_id, food_item.json())
+    return await idempotency.run(db, current_user.user_id, idempotency_key, 'POST /meals/{meal_id}/food-items/', request_hash, schemas.FoodItemWithNutrition,
+                                 lambda: save_food_item(meal_id, food_item, db, current_user))
+
+
+async def save_food_item(meal_id: int, food_item: schemas.FoodItemCreateUpdate, db: Session, current_user: schemas.User):
     meal = crud.get_meal(db, meal_id)
     if(not meal.user_id == current_user.user_id):
         raise HTTPException(status_code=401, detail='Not allowed')
@@ -777,10 +1031,14 @@ async def create_food_item(meal_id: int, food_item: schemas.FoodItemCreateUpdate
         if food_model.food_id in food_ids:
             raise ValueError("Cannot have duplicate food item in meal.")
         food_item.food_id = food_model.food_id
-        return crud.create_food_item(db, meal_id, food_item)
+        db_food_item = crud.create_food_item(db, meal_id, food_item, commit=False)
     except Exception as exc:
         raise HTTPException(status_code=422, detail=str(exc))
 
+    publish_meal_event(db, current_user.user_id, meal_id, event_hub.MEAL_UPDATED)
+    db.commit()
+    return db_food_item
+
 
 @app.put('/food-items/{food_item_id}', response_model=schemas.FoodItemWithNutrition)
 async def update_food_item(food_item_id: int, food_item: schemas.FoodItemCreateUpdate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
@@ -819,12 +1077,14 @@ async def update_food_item(food_item_id: int, food_item: schemas.FoodItemCreateU
         if food_ids.count(food_model.food_id) >= 1 and db_food_item.food_id != food_model.food_id:
             raise ValueError("Cannot have duplicate food item in meal.")
         food_item.food_id = food_model.food_id
-        crud.update_food_item(db, food_item_id, food_item)
+        updated_food_item = crud.update_food_item(db, food_item_id, food_item, commit=False)
     except Exception as exc:
         traceback.print_exc()
         raise HTTPException(status_code=422, detail=str(exc))
 
-    return crud.get_food_item(db, food_item_id)
+    publish_meal_event(db, current_user.user_id, meal.meal_id, event_hub.MEAL_UPDATED)
+    db.commit()
+    return updated_food_item
 
 
 @app.delete('/meals/{meal_id}/food-items/{food_item_id}', response_model=schemas.DefaultResponse)
@@ -837,13 +1097,115 @@ async def delete_food_item(meal_id: int, food_item_id: int, db: Session = Depend
                             detail='Food item not found')
 
     if(food_item.meal_id == meal_id):
-        crud.delete_food_item(db, food_item_id)
+        crud.delete_food_item(db, food_item_id, commit=False)
+        publish_meal_event(db, current_user.user_id, meal_id, event_hub.MEAL_UPDATED)
+        db.commit()
     else:
         raise HTTPException(status_code=403, detail='Not allowed')
 
     return {'detail': str(food_item_id)}
 
 
+# Events
+@app.get('/events/')
+async def subscribe_events(request: Request, token: str = None, db: Session = Depends(get_db)):
+    """
+    Server-sent events for the assignments and meals of the current user.
+    EventSource cannot send headers, the access token may be passed as the token query parameter.
+    """
+    authorization = request.headers.get('authorization')
+    if(token is None and authorization is not None and authorization.lower().startswith('bearer ')):
+        token = authorization[7:]
+    if(token is None):
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED,
+                            detail='Not authenticated')
+
+    user = await get_user(token, db)
+    user_id = user.user_id
+
+    # Idle streams do not hold a database connection
+    db.close()
+
+    return StreamingResponse(
+        event_hub.iterate_events(request, user_id, event_hub.EVENT_KEEPALIVE_INTERVAL),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# Metrics
+def collect_app_metrics():
+    global tiered_food_detector
+    # Hit rates of the caches, read from their stats on every collection
+    cache_stats = {
+        'catalog_payloads': http_cache.catalog_payloads.stats(),
+        'clinician_authorization': authorization_cache.clinician_authorization.stats(),
+    }
+    classification = smart_diet_watcher.predict_probabilities.cache_info()
+    cache_stats['classification'] = {'hits': classification.hits, 'misses': classification.misses}
+
+    families = [
+        metrics.get_family('cache_hits_total', metrics.COUNTER, 'Cache hits', [('', [('cache', cache)], stats['hits']) for cache, stats in cache_stats.items()]),
+        metrics.get_family('cache_misses_total', metrics.COUNTER, 'Cache misses', [('', [('cache', cache)], stats['misses']) for cache, stats in cache_stats.items()]),
+        metrics.get_family('cache_entries', metrics.GAUGE, 'Entries held by each cache', [
+            ('', [('cache', 'catalog_payloads')], cache_stats['catalog_payloads']['entries']),
+            ('', [('cache', 'clinician_authorization')], cache_stats['clinician_authorization']['clinicians']),
+        ]),
+        metrics.get_family('login_attempts_total', metrics.COUNTER, 'Login attempts by result', [('', [('result', result)], count) for result, count in login_shield.stats().items()]),
+    ]
+
+    # Not loaded yet before startup
+    if(catalog_cache.catalog.version is not None):
+        families.append(metrics.get_family('catalog_version', metrics.GAUGE, 'Catalog version served by the worker', [('', [], catalog_cache.catalog.version)]))
+
+    event_stats = event_hub.hub.stats()
+    families += [
+        metrics.get_family('event_subscriptions', metrics.GAUGE, 'Open event streams', [('', [], event_stats['subscriptions'])]),
+        metrics.get_family('events_published_total', metrics.COUNTER, 'Events published', [('', [], event_stats['published'])]),
+        metrics.get_family('events_dropped_total', metrics.COUNTER, 'Events dropped for slow subscribers', [('', [], event_stats['dropped'])]),
+    ]
+
+    if(tiered_food_detector is not None):
+        detection_stats = tiered_food_detector.stats()
+        families += [
+            metrics.get_family('food_detection_requests_total', metrics.COUNTER, 'Detection requests', [('', [], detection_stats['requests'])]),
+            metrics.get_family('food_detection_hits_total', metrics.COUNTER, 'Detections answered by each tier', [('', [('tier', tier)], stats['hits']) for tier, stats in detection_stats['tiers'].items()]),
+        ]
+    return families
+
+
+metrics.registry.register_collector(collect_app_metrics)
+
+
+@app.get('/metrics')
+def get_metrics():
+    # Not async, reading the files of the other workers would block the event loop
+    return PlainTextResponse(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+# Contains the text of slow and repeated statements, the query counts are in /metrics
+@app.get('/metrics/sql/')
+async def get_sql_metrics(current_user: schemas.User = Depends(get_admin)):
+    return sql_instrumentation.query_stats.stats()
+
+
+# Admin
+@app.post('/admin/profiler/')
+async def run_profiler(seconds: float = 10, interval_ms: float = profiler.PROFILER_INTERVAL * 1000, current_user: schemas.User = Depends(get_admin)):
+    '''
+    Samples the worker handling the request for a number of seconds.
+    Returns the collapsed stacks, e.g. for flamegraph.pl or speedscope.
+    '''
+
+    if(seconds <= 0 or seconds > profiler.PROFILER_MAX_SECONDS):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"seconds must be between 0 and {profiler.PROFILER_MAX_SECONDS}")
+    try:
+        sampler = await profiler.profile(seconds, interval_ms / 1000)
+    except profiler.ProfilerBusyError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+    return PlainTextResponse(sampler.collapsed(), headers=sampler.get_headers())
+
+
 # Test
 @app.post('/test/recording/')
 async def create_test_recording(recording: schemas.TestRecordingBase, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_user)):
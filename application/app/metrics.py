@@ -0,0 +1,403 @@
+# metrics.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Directory shared by the workers of a gunicorn or multi-worker uvicorn server, each worker writes its metrics to it
+# and a scrape of any worker reports the metrics of all of them. Empty it before starting the server.
+METRICS_MULTIPROCESS_DIRECTORY = os.getenv('METRICS_MULTIPROCESS_DIRECTORY') or None
+
+# Seconds between writes of the metrics of a worker to the multiprocess directory
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL') or 5)
+
+# Metric types
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+	'''
+	Metrics and collectors exported by the /metrics endpoint
+	'''
+
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__metrics = {}
+		self.__collectors = []
+
+	def register(self, metric):
+		# Registering a name again, e.g. for a recreated detector, replaces the previous metric
+		with self.__lock:
+			self.__metrics[metric.name] = metric
+
+	def register_collector(self, collector):
+		'''
+		Register a function called on every collection, returning a list of families built with get_family
+		'''
+
+		with self.__lock:
+			self.__collectors.append(collector)
+
+	def collect(self):
+		'''
+		Return:
+			List of dicts containing the name, type, documentation and samples of each metric of this process
+		'''
+
+		with self.__lock:
+			metrics = list(self.__metrics.values())
+			collectors = list(self.__collectors)
+
+		families = [get_family(metric.name, metric.type, metric.documentation, metric.samples()) for metric in metrics]
+		for collector in collectors:
+			families += collector()
+		return families
+
+
+registry = Registry()
+
+
+def get_family(name: str, metric_type: str, documentation: str, samples):
+	'''
+	Parameters:
+		name (str): Metric name
+		metric_type (str): counter, gauge or histogram
+		documentation (str): HELP text
+		samples: List of (suffix, labels, value), labels being a list of (name, value) pairs
+	Return:
+		Dict describing the metric family
+	'''
+
+	return {'name': name, 'type': metric_type, 'documentation': documentation, 'samples': [(suffix, [list(label) for label in labels], value) for suffix, labels, value in samples]}
+
+
+class Counter:
+	'''
+	Monotonically increasing count, e.g. of requests. Counter names end with _total.
+	'''
+
+	type = COUNTER
+
+	def __init__(self, name: str, documentation: str = '', register: bool = True):
+		self.name = name
+		self.documentation = documentation
+		self.__lock = threading.Lock()
+		self.__value = 0
+		if(register):
+			registry.register(self)
+
+	def inc(self, amount: float = 1):
+		with self.__lock:
+			self.__value += amount
+
+	@property
+	def value(self):
+		return self.__value
+
+	def samples(self):
+		return [('', [], self.__value)]
+
+
+class Gauge:
+	'''
+	Value that goes up and down, either set or read from a function on every collection
+	'''
+
+	type = GAUGE
+
+	def __init__(self, name: str, documentation: str = '', function=None, register: bool = True):
+		self.name = name
+		self.documentation = documentation
+		self.function = function
+		self.__value = 0
+		if(register):
+			registry.register(self)
+
+	def set(self, value: float):
+		self.__value = value
+
+	@property
+	def value(self):
+		return self.function() if self.function is not None else self.__value
+
+	def samples(self):
+		return [('', [], self.value)]
+
+
+class Histogram:
+	'''
+	Cumulative histogram of observed values, e.g. latencies in seconds
+	'''
+
+	type = HISTOGRAM
+
+	def __init__(self, name: str, buckets=DEFAULT_BUCKETS, documentation: str = '', register: bool = True):
+		self.name = name
+		self.documentation = documentation
+		self.buckets = tuple(sorted(buckets))
+		self.__lock = threading.Lock()
+		self.__counts = [0] * (len(self.buckets) + 1)
+		self.__sum = 0.0
+		self.__count = 0
+		if(register):
+			registry.register(self)
+
+	def observe(self, value: float):
+		index = bisect.bisect_left(self.buckets, value)
+		with self.__lock:
+			self.__counts[index] += 1
+			self.__sum += value
+			self.__count += 1
+
+	@contextmanager
+	def time(self):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - start)
+
+	def snapshot(self):
+		'''
+		Return:
+			Dict containing the cumulative bucket counts, sum and count of observed values
+		'''
+
+		with self.__lock:
+			counts = list(self.__counts)
+			total = self.__sum
+			count = self.__count
+
+		cumulative = 0
+		buckets = {}
+		for upper_bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+			cumulative += bucket_count
+			buckets[str(upper_bound)] = cumulative
+
+		return {'buckets': buckets, 'sum': total, 'count': count}
+
+	def samples(self):
+		snapshot = self.snapshot()
+		samples = [('_bucket', [('le', upper_bound)], count) for upper_bound, count in snapshot['buckets'].items()]
+		samples.append(('_sum', [], snapshot['sum']))
+		samples.append(('_count', [], snapshot['count']))
+		return samples
+
+
+class Family:
+	'''
+	Metrics of one name told apart by label values, e.g. a latency histogram per route
+
+		request_latency = Family(Histogram, 'http_request_duration_seconds', ('route',))
+		request_latency.labels('get_meals').observe(0.012)
+	'''
+
+	def __init__(self, metric_class, name: str, labelnames, documentation: str = '', **kwargs):
+		self.type = metric_class.type
+		self.name = name
+		self.labelnames = tuple(labelnames)
+		self.documentation = documentation
+		self.metric_class = metric_class
+		self.kwargs = kwargs
+		self.__lock = threading.Lock()
+		self.__children = {}
+		registry.register(self)
+
+	def labels(self, *values):
+		child = self.__children.get(values)
+		if(child is None):
+			with self.__lock:
+				child = self.__children.get(values)
+				if(child is None):
+					child = self.__children[values] = self.metric_class(self.name, register=False, **self.kwargs)
+		return child
+
+	def samples(self):
+		with self.__lock:
+			children = list(self.__children.items())
+
+		samples = []
+		for values, child in children:
+			labels = list(zip(self.labelnames, values))
+			samples += [(suffix, labels + child_labels, value) for suffix, child_labels, value in child.samples()]
+		return samples
+
+
+def get_endpoint_name(scope):
+	# The router sets the endpoint on the scope, paths would split the metrics per id
+	endpoint = scope.get('endpoint')
+	if(endpoint is None):
+		return 'unmatched'
+	return getattr(endpoint, '__name__', type(endpoint).__name__)
+
+
+class RequestMetricsMiddleware:
+	'''
+	Counts requests and records their latency per route, method and status
+	'''
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if(scope['type'] != 'http'):
+			await self.app(scope, receive, send)
+			return
+
+		status_code = 500
+
+		async def send_with_status(message):
+			nonlocal status_code
+			if(message['type'] == 'http.response.start'):
+				status_code = message['status']
+			await send(message)
+
+		start = time.perf_counter()
+		try:
+			await self.app(scope, receive, send_with_status)
+		finally:
+			route = get_endpoint_name(scope)
+			request_latency.labels(route, scope['method']).observe(time.perf_counter() - start)
+			request_count.labels(route, scope['method'], str(status_code)).inc()
+
+
+request_latency = Family(Histogram, 'http_request_duration_seconds', ('route', 'method'), 'Latency of requests until their response is sent')
+request_count = Family(Counter, 'http_requests_total', ('route', 'method', 'status'), 'Requests handled')
+
+
+def get_process_path(pid: int):
+	return os.path.join(METRICS_MULTIPROCESS_DIRECTORY, f"{pid}.json")
+
+
+def write_process_metrics():
+	# Written to a temporary file first so other workers never read a partial file
+	path = get_process_path(os.getpid())
+	with open(path + '.tmp', 'w') as f:
+		json.dump(registry.collect(), f)
+	os.replace(path + '.tmp', path)
+
+
+def start_flushing():
+	'''
+	Periodically write the metrics of this worker to the multiprocess directory, does nothing without one
+	'''
+
+	if(METRICS_MULTIPROCESS_DIRECTORY is None):
+		return
+
+	def flush():
+		while True:
+			try:
+				write_process_metrics()
+			except OSError as exc:
+				print(f"[ERROR] writing metrics failed: {exc}")
+			time.sleep(METRICS_FLUSH_INTERVAL)
+
+	threading.Thread(target=flush, name='metrics-flush', daemon=True).start()
+
+
+def is_process_alive(pid: int):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+def merge_families(process_families):
+	'''
+	Merge the metrics of several workers. Counters and histograms of workers which exited are kept so totals do not
+	go down, gauges are summed over the live workers only.
+
+	Parameters:
+		process_families: List of (alive, families) per worker
+	Return:
+		List of merged families
+	'''
+
+	merged = {}
+	for alive, families in process_families:
+		for family in families:
+			if(family['type'] == GAUGE and not alive):
+				continue
+			target = merged.setdefault(family['name'], {'name': family['name'], 'type': family['type'], 'documentation': family['documentation'], 'values': {}})
+			for suffix, labels, value in family['samples']:
+				key = (suffix, tuple(tuple(label) for label in labels))
+				target['values'][key] = target['values'].get(key, 0) + value
+
+	return [get_family(family['name'], family['type'], family['documentation'], [(suffix, labels, value) for (suffix, labels), value in family['values'].items()]) for family in merged.values()]
+
+
+def collect():
+	'''
+	Return:
+		Families of this worker, or of every worker when a multiprocess directory is configured
+	'''
+
+	if(METRICS_MULTIPROCESS_DIRECTORY is None):
+		return registry.collect()
+
+	write_process_metrics()
+	process_families = []
+	for file_name in os.listdir(METRICS_MULTIPROCESS_DIRECTORY):
+		if(not file_name.endswith('.json')):
+			continue
+		try:
+			with open(os.path.join(METRICS_MULTIPROCESS_DIRECTORY, file_name)) as f:
+				families = json.load(f)
+		except (OSError, ValueError):
+			continue
+		process_families.append((is_process_alive(int(file_name[:-len('.json')])), families))
+	return merge_families(process_families)
+
+
+def format_value(value):
+	if(isinstance(value, float)):
+		if(value != value):
+			return 'NaN'
+		if(value in (float('inf'), float('-inf'))):
+			return '+Inf' if value > 0 else '-Inf'
+		return repr(value)
+	return str(value)
+
+
+def format_labels(labels):
+	if(not labels):
+		return ''
+	escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in labels)
+	return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render(families=None):
+	'''
+	Render metric families in the Prometheus text exposition format
+
+	Return:
+		String of the exposition, every worker's metrics by default
+	'''
+
+	lines = []
+	for family in sorted(families if families is not None else collect(), key=lambda family: family['name']):
+		if(family['documentation']):
+			lines.append(f"# HELP {family['name']} {family['documentation']}")
+		lines.append(f"# TYPE {family['name']} {family['type']}")
+		for suffix, labels, value in family['samples']:
+			lines.append(f"{family['name']}{suffix}{format_labels(labels)} {format_value(value)}")
+	return '\n'.join(lines) + '\n'
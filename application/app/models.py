@@ -1,7 +1,7 @@
 from datetime import datetime
 from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, DateTime, Float, Sequence
 from sqlalchemy.orm import relationship
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import UniqueConstraint, Index
 from sqlalchemy.sql.functions import next_value
 
 from app.database import Base
@@ -124,7 +124,7 @@ class Meal(Base):
 	# Columns
 	meal_id = Column(Integer, primary_key=True, index=True)
 	user_id = Column(Integer, ForeignKey('User.user_id'), nullable=False)
-	image = Column(String)
+	image = Column(String, index=True)
 	blood_glucose = Column(Float)
 	food_predictions = Column(String)
 	date_created = Column(DateTime)
@@ -136,6 +136,13 @@ class Meal(Base):
 	food_items = relationship('FoodItem', back_populates='meal')
 	# blood_glucose = relationship('MealBloodGlucose', back_populates='meal')
 
+	# The trigram and full-text indexes searched by crud.get_name_search_condition are Postgres specific and only created by the migration
+	__table_args__ = (
+		Index('ix_Meal_user_id_date_created', 'user_id', 'date_created'),
+		Index('ix_Meal_user_id_date_modified', 'user_id', 'date_modified'),
+		Index('ix_Meal_user_id_date_deleted', 'user_id', 'date_deleted'),
+	)
+
 
 class RiskScoreValue(Base):
 	__tablename__ = 'RiskScoreValue'
@@ -188,6 +195,13 @@ class FoodItem(Base):
 	meal = relationship('Meal', back_populates='food_items')
 	measurement = relationship('Measurement', back_populates='food_item')
 
+	# Food items have no user_id, a sync finds the changed ones of every user then keeps those of the user's meals
+	__table_args__ = (
+		Index('ix_FoodItem_date_created', 'date_created'),
+		Index('ix_FoodItem_date_modified', 'date_modified'),
+		Index('ix_FoodItem_date_deleted', 'date_deleted'),
+	)
+
 class HealthRecord(Base):
 	__tablename__ = 'HealthRecord'
 
@@ -214,6 +228,57 @@ class HealthRecord(Base):
 	user = relationship('User', back_populates='health_records')
 	# risk_score_value = relationship('RiskScoreValue', back_populates='health_records')
 
+	__table_args__ = (
+		Index('ix_HealthRecord_user_id_date_created', 'user_id', 'date_created'),
+		Index('ix_HealthRecord_user_id_date_modified', 'user_id', 'date_modified'),
+		Index('ix_HealthRecord_user_id_date_deleted', 'user_id', 'date_deleted'),
+	)
+
+class HealthRecordRollup(Base):
+	__tablename__ = 'HealthRecordRollup'
+
+	# Columns, one row per user, metric and period. Partitioned by resolution in Postgres
+	user_id = Column(Integer, ForeignKey('User.user_id'), primary_key=True)
+	metric = Column(String, primary_key=True)
+	resolution = Column(String, primary_key=True)
+	period_start = Column(DateTime, primary_key=True)
+	minimum = Column(Float, nullable=False)
+	maximum = Column(Float, nullable=False)
+	total = Column(Float, nullable=False)
+	count = Column(Integer, nullable=False)
+	last = Column(Float, nullable=False)
+	last_date = Column(DateTime, nullable=False)
+
+class CatalogVersion(Base):
+	__tablename__ = 'CatalogVersion'
+
+	# Columns
+	catalog_version_id = Column(Integer, primary_key=True)
+	version = Column(Integer, nullable=False, default=1)
+	date_modified = Column(DateTime)
+
+class RateLimitBucket(Base):
+	__tablename__ = 'RateLimitBucket'
+
+	# Columns
+	key = Column(String, primary_key=True)
+	tokens = Column(Float, nullable=False)
+	date_modified = Column(DateTime, nullable=False)
+
+class IdempotencyKey(Base):
+	__tablename__ = 'IdempotencyKey'
+
+	# Columns
+	user_id = Column(Integer, ForeignKey('User.user_id'), primary_key=True)
+	idempotency_key = Column(String, primary_key=True)
+	endpoint = Column(String, nullable=False)
+	# Hash of the request, a key reused for a different request is rejected
+	request_hash = Column(String)
+	# NULL while the first request is in flight
+	status_code = Column(Integer)
+	response = Column(String)
+	date_created = Column(DateTime, index=True, nullable=False)
+
 class TestRecording(Base):
 	__tablename__ = 'TestRecording'
 
@@ -0,0 +1,120 @@
+# notifications.py
+
+### Imports
+import select
+import threading
+import traceback
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app.database import SQLALCHEMY_DATABASE_URL
+
+# Key of the callbacks waiting for the transaction to commit, in Session.info
+AFTER_COMMIT_CALLBACKS = 'after_commit_callbacks'
+
+
+class NotificationListener:
+	'''
+	Listens to Postgres NOTIFY channels in a background thread and calls the callbacks subscribed to each channel
+	with the notification payload. The connection is re-established after errors, notifications sent while
+	disconnected are lost so subscribers should not rely on them alone.
+	'''
+
+	def __init__(self, reconnect_interval: float = 10):
+		self.reconnect_interval = reconnect_interval
+		self.__callbacks = {}
+		self.__thread = None
+		self.__stop = threading.Event()
+
+	def subscribe(self, channel: str, callback):
+		self.__callbacks.setdefault(channel, []).append(callback)
+
+	def start(self):
+		if(self.__thread is not None or not self.__callbacks):
+			return
+		self.__stop.clear()
+		self.__thread = threading.Thread(target=self._run, name='notification-listener', daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		self.__stop.set()
+		self.__thread = None
+
+	def _run(self):
+		try:
+			import psycopg2
+		except ImportError:
+			print('[INFO] psycopg2 unavailable, database notifications are disabled')
+			return
+
+		while not self.__stop.is_set():
+			try:
+				self._listen(psycopg2)
+			except Exception:
+				traceback.print_exc()
+			self.__stop.wait(self.reconnect_interval)
+
+	def _listen(self, psycopg2):
+		connection = psycopg2.connect(SQLALCHEMY_DATABASE_URL)
+		try:
+			connection.autocommit = True
+			cursor = connection.cursor()
+			for channel in self.__callbacks:
+				cursor.execute(f"LISTEN {channel}")
+
+			while not self.__stop.is_set():
+				if(select.select([connection], [], [], 1) == ([], [], [])):
+					continue
+
+				connection.poll()
+				while connection.notifies:
+					notify = connection.notifies.pop(0)
+					self._dispatch(notify.channel, notify.payload)
+		finally:
+			connection.close()
+
+	def _dispatch(self, channel: str, payload: str):
+		for callback in self.__callbacks.get(channel, []):
+			try:
+				callback(payload)
+			except Exception:
+				traceback.print_exc()
+
+
+def notify(db, channel: str, payload: str = ''):
+	'''
+	Send a notification on a channel when the transaction of the session commits.
+	Other databases have no NOTIFY, e.g. SQLite in development, the notification is skipped.
+	'''
+
+	if(db.bind.dialect.name == 'postgresql'):
+		db.execute(text("SELECT pg_notify(:channel, :payload)"), {'channel': channel, 'payload': payload})
+
+
+def after_commit(db, callback):
+	'''
+	Call callback once the transaction of the session commits, like a NOTIFY it is dropped if the transaction rolls back
+	'''
+
+	db.info.setdefault(AFTER_COMMIT_CALLBACKS, []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_callbacks(db):
+	# Savepoints commit within the transaction
+	if(db.transaction is not None and db.transaction.nested):
+		return
+
+	for callback in db.info.pop(AFTER_COMMIT_CALLBACKS, []):
+		try:
+			callback()
+		except Exception:
+			traceback.print_exc()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_commit_callbacks(db, previous_transaction):
+	if(previous_transaction.parent is None):
+		db.info.pop(AFTER_COMMIT_CALLBACKS, None)
+
+
+listener = NotificationListener()
@@ -1,7 +1,9 @@
 from typing import Dict, Optional
 from decimal import Decimal
 from app import crud, models
+from app.metrics import Family, Counter, Histogram
 import httpx
+import time
 from httpx import HTTPStatusError
 from dotenv import load_dotenv
 import os
@@ -9,6 +11,10 @@ load_dotenv()
 
 from sqlalchemy.orm.session import Session
 
+api_latency = Family(Histogram, 'nutrition_api_seconds', ('endpoint', 'outcome'), 'Latency of the external food and nutrition API')
+# Foods found in the database are cache hits, foods fetched from the API misses
+lookups = Family(Counter, 'nutrition_lookups_total', ('result',), 'Food nutrition lookups by where the food was found')
+
 class NutritionService:
     def __init__(self, db: Session):
         self.__db = db
@@ -40,6 +46,7 @@ class NutritionService:
         food = self._check_database_for_food(food_id)
         if bool(food):
             # print("Food ID available in database, returning DB data") # debug only
+            lookups.labels('database').inc()
             return food
 
         # Call the food parse API for API's food ID, must always have parsed text for querying
@@ -64,6 +71,7 @@ class NutritionService:
         food = self._check_database_for_food(api_id)
         if bool(food):
             # print("API ID available in database, returning DB data") # debug only
+            lookups.labels('database_by_api_id').inc()
             return food
 
         # Try to get the nutritional data from API
@@ -87,13 +95,19 @@ class NutritionService:
             # Round value to closest 5 decimal points
             nutrition_value = Decimal(str(nutrition_info[key_code]['quantity']))
             association = models.FoodNutritionAssociation(nutrition_value = round(nutrition_value, 5))
-            association.nutrition = crud.get_food_nutrition_by_code(db, key_code)
-            if(association.nutrition is not None):
+            nutrition = crud.get_food_nutrition_by_code(db, key_code)
+            if(nutrition is not None):
                 # A chance that nutrition could be None
+                # Cached nutrition rows are shared between sessions, reference them by id
+                association.food_nutrition_id = nutrition.food_nutrition_id
                 food.food_nutritions.append(association)
 
         db.add(food)
         db.commit()
+        lookups.labels('api').inc()
+
+        # Let every worker pick up the new food in its catalog cache
+        crud.bump_catalog_version(db)
         db.refresh(food)
         return food
 
@@ -120,8 +134,7 @@ class NutritionService:
 
         # Used for live requests
         async with httpx.AsyncClient() as client:
-            response = await client.post(nutrition_url, json = nutrition_data_request, headers=headers)
-            response.raise_for_status()
+            response = await self._timed('nutrients', client.post(nutrition_url, json = nutrition_data_request, headers=headers))
         return response.json()
 
         # # Used for debugging purposes
@@ -139,8 +152,7 @@ class NutritionService:
 
         # Used for live requests
         async with httpx.AsyncClient() as client:
-            response = await client.get(food_url, params=parameters, headers=headers)
-            response.raise_for_status()
+            response = await self._timed('parser', client.get(food_url, params=parameters, headers=headers))
         return response.json()
 
         # # Used for debugging purposes
@@ -149,6 +161,18 @@ class NutritionService:
         #     data = json.load(f)
         # return data
 
+    async def _timed(self, endpoint: str, request):
+        # Records the latency of an API request by outcome, raising for error statuses
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = await request
+            response.raise_for_status()
+            outcome = 'ok'
+            return response
+        finally:
+            api_latency.labels(endpoint, outcome).observe(time.perf_counter() - start)
+
     def _check_database_for_food(self, food_id: str) -> Optional[models.Food]:
         return crud.get_food(self.__db, food_id)
 
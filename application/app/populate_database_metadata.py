@@ -1,7 +1,7 @@
 import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
 import csv, argparse
 import copy
-from app import models, schemas
+from app import crud, models, schemas
 from app.database import SessionLocal
 
 # Utility
@@ -23,6 +23,10 @@ def populate_database_metadata(args):
 	sync_food_nutrition_types(db, args.nutrition, args.nutrition_disable)
 	sync_measurement(db, args.measurement, args.measurement_disable)
 
+	# Reload the catalog cache of running workers
+	crud.bump_catalog_version(db)
+	print('[INFO] catalog version updated')
+
 def update_risk_scores(db):
 	# delete existing data
 	print('[INFO] deleting existing data')
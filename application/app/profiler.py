@@ -0,0 +1,250 @@
+# profiler.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import re
+import sys
+import time
+import hmac
+import asyncio
+import functools
+import threading
+from collections import Counter
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse
+
+# Secret sent in the X-Profile header to profile a single request, per request profiling is disabled without it
+PROFILER_TOKEN = os.getenv('PROFILER_TOKEN') or None
+
+# Seconds between samples
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL') or 0.005)
+
+# Longest a profile may run, a profiled request is cancelled after it
+PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS') or 60)
+
+# Share of the profiled time sampling may take, the interval is doubled whenever sampling costs more
+PROFILER_MAX_OVERHEAD = float(os.getenv('PROFILER_MAX_OVERHEAD') or 0.02)
+
+# Shortest and longest interval between samples
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 0.5
+
+# Deepest stack recorded, deeper frames are cut from the root side
+MAX_STACK_DEPTH = 128
+
+# Number of distinct stacks recorded, further stacks are counted as truncated
+MAX_STACKS = 10000
+
+PROFILE_HEADER = 'x-profile'
+
+# Leaf frames of threads waiting for work, samples of idle threads are dropped
+IDLE_FRAMES = {
+	('selectors.py', 'select'),
+	('threading.py', 'wait'),
+	('thread.py', '_worker'),
+	('queue.py', 'get'),
+}
+
+# Threads running the app, the event loop and the threadpool of sync endpoints and dependencies
+THREADPOOL_PREFIX = 'ThreadPoolExecutor'
+
+# One profile at a time per worker, overlapping samplers would double the overhead and mix their samples
+lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+	pass
+
+
+# Installed packages and the standard library are shortened to their package, e.g. starlette/routing.py
+LIBRARY_PATH = re.compile(r'[/\\](?:site-packages|dist-packages|lib[/\\]python[\d.]+)[/\\](.*)$')
+
+
+@functools.lru_cache(maxsize=4096)
+def get_frame_name(filename: str, function: str):
+	match = LIBRARY_PATH.search(filename)
+	if(match is not None):
+		filename = match.group(1)
+	elif(os.path.isabs(filename)):
+		filename = os.path.relpath(filename)
+	return f"{function} ({filename})".replace(';', ':')
+
+
+def get_thread_name(thread: threading.Thread, loop_thread_id: int):
+	if(thread.ident == loop_thread_id):
+		return 'event-loop'
+	return re.sub(r'[-_]\d+$', '', thread.name)
+
+
+class Sampler:
+	'''
+	Statistical profiler sampling the stacks of the threads running the app from a background thread
+
+	Nothing is hooked into the interpreter, the cost is the time taken by each sample, which is capped at
+	PROFILER_MAX_OVERHEAD of the profiled time by backing off the interval. With a task, samples of the event loop
+	are only kept while that task runs, work run in the threadpool by concurrent requests may still be sampled.
+	'''
+
+	def __init__(self, interval: float = PROFILER_INTERVAL, task=None):
+		self.interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+		self.task = task
+		# Created on the event loop, its thread is the one sampled with the threadpool
+		self.loop = asyncio.get_event_loop()
+		self.loop_thread_id = threading.get_ident()
+		self.stacks = Counter()
+		self.samples = 0
+		self.truncated = 0
+		self.sampling_seconds = 0.0
+		self.seconds = 0.0
+		self.__stop = threading.Event()
+		self.__thread = None
+
+	def start(self):
+		self.__thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		self.__stop.set()
+		self.__thread.join()
+
+	def collapsed(self):
+		'''
+		Return:
+			Stacks in the collapsed format of flamegraph.pl and speedscope, one "frame;frame;frame count" per line
+		'''
+
+		lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+		if(self.truncated):
+			lines.append(f"[truncated] {self.truncated}")
+		return '\n'.join(lines) + '\n'
+
+	def get_headers(self):
+		return {
+			'X-Profile-Samples': str(self.samples),
+			'X-Profile-Seconds': '{:.3f}'.format(self.seconds),
+			'X-Profile-Interval-Ms': '{:.1f}'.format(self.interval * 1000),
+			'X-Profile-Overhead': '{:.4f}'.format(self.sampling_seconds / self.seconds if self.seconds else 0),
+			'X-Profile-Worker': str(os.getpid()),
+		}
+
+	def _run(self):
+		start = time.perf_counter()
+		while not self.__stop.wait(self.interval):
+			sample_start = time.perf_counter()
+			self._sample()
+			now = time.perf_counter()
+			self.sampling_seconds += now - sample_start
+
+			# Sampling holds the GIL, its time is taken from the app
+			if(self.sampling_seconds > PROFILER_MAX_OVERHEAD * (now - start) and self.interval < MAX_INTERVAL):
+				self.interval = min(self.interval * 2, MAX_INTERVAL)
+		self.seconds = time.perf_counter() - start
+
+	def _sample(self):
+		own_ident = threading.get_ident()
+		frames = sys._current_frames()
+		for thread in threading.enumerate():
+			if(thread.ident == own_ident or thread.ident not in frames):
+				continue
+			event_loop = thread.ident == self.loop_thread_id
+			if(not event_loop and not thread.name.startswith(THREADPOOL_PREFIX)):
+				continue
+			if(event_loop and self.task is not None and asyncio.current_task(self.loop) is not self.task):
+				continue
+
+			stack = self._get_stack(frames[thread.ident])
+			if(stack is not None):
+				self._record(get_thread_name(thread, self.loop_thread_id) + ';' + stack)
+
+	def _get_stack(self, frame):
+		code = frame.f_code
+		if((os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES):
+			return None
+
+		names = []
+		while(frame is not None and len(names) < MAX_STACK_DEPTH):
+			names.append(get_frame_name(frame.f_code.co_filename, frame.f_code.co_name))
+			frame = frame.f_back
+		return ';'.join(reversed(names))
+
+	def _record(self, stack: str):
+		self.samples += 1
+		if(stack in self.stacks or len(self.stacks) < MAX_STACKS):
+			self.stacks[stack] += 1
+		else:
+			self.truncated += 1
+
+
+async def profile(seconds: float, interval: float = PROFILER_INTERVAL):
+	'''
+	Sample the threads of this worker for a number of seconds
+
+	Return:
+		Stopped Sampler, ProfilerBusyError if this worker is already being profiled
+	'''
+
+	if(not lock.acquire(blocking=False)):
+		raise ProfilerBusyError('A profile is already running on this worker')
+	try:
+		sampler = Sampler(interval)
+		sampler.start()
+		try:
+			await asyncio.sleep(min(seconds, PROFILER_MAX_SECONDS))
+		finally:
+			sampler.stop()
+	finally:
+		lock.release()
+	return sampler
+
+
+class RequestProfilerMiddleware:
+	'''
+	Profiles requests sent with the X-Profile header set to PROFILER_TOKEN, their response is replaced by the
+	collapsed stacks and the status of the original response is sent in X-Profile-Status.
+
+	Without a token the middleware only passes requests through. Requests arriving while the worker is already being
+	profiled are handled as usual.
+	'''
+
+	def __init__(self, app, token: str = PROFILER_TOKEN):
+		self.app = app
+		self.token = token
+
+	async def __call__(self, scope, receive, send):
+		if(self.token is None or scope['type'] != 'http'):
+			await self.app(scope, receive, send)
+			return
+
+		value = Headers(scope=scope).get(PROFILE_HEADER)
+		if(value is None or not hmac.compare_digest(value.encode(), self.token.encode()) or not lock.acquire(blocking=False)):
+			await self.app(scope, receive, send)
+			return
+
+		status_code = None
+
+		async def discard(message):
+			nonlocal status_code
+			if(message['type'] == 'http.response.start'):
+				status_code = message['status']
+
+		try:
+			# Run as its own task, the event loop is only sampled while it runs
+			task = asyncio.ensure_future(self.app(scope, receive, discard))
+			sampler = Sampler(task=task)
+			sampler.start()
+			try:
+				await asyncio.wait_for(task, timeout=PROFILER_MAX_SECONDS)
+			except asyncio.TimeoutError:
+				pass
+			finally:
+				sampler.stop()
+		finally:
+			lock.release()
+
+		headers = sampler.get_headers()
+		headers['X-Profile-Status'] = str(status_code)
+		await PlainTextResponse(sampler.collapsed(), headers=headers)(scope, receive, send)
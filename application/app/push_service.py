@@ -11,8 +11,12 @@ from requests import Session
 import time
 from dotenv import load_dotenv
 import os
+from app.metrics import Family, Counter
 load_dotenv()
 
+# Outcome of each notification after its retries: sent, failed, token_empty, server_error or device_not_registered
+dispatch_outcomes = Family(Counter, 'push_dispatch_total', ('outcome',), 'Push notifications dispatched by outcome')
+
 # Basic arguments. You should extend this function with the push features you
 # want to use, or simply pass in a `PushMessage` object.
 
@@ -0,0 +1,249 @@
+# rate_limiter.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import time
+import threading
+from sqlalchemy import text
+from app import notifications
+from app.database import engine
+
+# Notified with the email of every new account, workers drop it from their unknown usernames
+USER_CREATED_CHANNEL = 'user_created'
+
+# Results of a login check
+ACCEPTED = 'accepted'
+REJECTED_IP = 'rejected_ip'
+REJECTED_UNKNOWN_USERNAME = 'rejected_unknown_username'
+REJECTED_USERNAME = 'rejected_username'
+
+
+class MemoryBucketBackend:
+	'''
+	Token buckets held in the memory of the worker process
+	'''
+
+	def __init__(self, max_buckets: int = 100000):
+		self.max_buckets = max_buckets
+		self.__buckets = {}
+		self.__lock = threading.Lock()
+
+	def take(self, key: str, capacity: float, rate: float):
+		'''
+		Take a token from the bucket
+
+		Parameters:
+			key (str): Bucket key
+			capacity (float): Maximum number of tokens in the bucket
+			rate (float): Tokens added per second
+		Return:
+			Number of tokens left, negative if the bucket was empty
+		'''
+
+		now = time.monotonic()
+		with self.__lock:
+			tokens, updated, _ = self.__buckets.get(key, (capacity, now, now))
+			tokens = min(capacity, tokens + (now - updated) * rate) - 1
+			stored_tokens = max(tokens, -1)
+			self.__buckets[key] = (stored_tokens, now, now + (capacity - stored_tokens) / rate)
+
+			if(len(self.__buckets) > self.max_buckets):
+				self._prune(now)
+
+		return tokens
+
+	def _prune(self, now: float):
+		# Drop buckets which have refilled, they are equivalent to a new bucket
+		for key, (_, _, full) in list(self.__buckets.items()):
+			if(full <= now):
+				del self.__buckets[key]
+
+
+class DatabaseBucketBackend:
+	'''
+	Token buckets stored in the RateLimitBucket table, shared by every worker.
+	Keys are namespaced like "ip:<address>", the buckets of a namespace share their capacity and rate.
+	'''
+
+	take_statement = text('''
+		INSERT INTO "RateLimitBucket" (key, tokens, date_modified) VALUES (:key, :capacity - 1, now())
+		ON CONFLICT (key) DO UPDATE SET
+			tokens = GREATEST(LEAST(:capacity, "RateLimitBucket".tokens + EXTRACT(EPOCH FROM now() - "RateLimitBucket".date_modified) * :rate) - 1, -1),
+			date_modified = now()
+		RETURNING tokens
+	''')
+
+	# Buckets which have refilled are equivalent to a new bucket, like MemoryBucketBackend._prune
+	prune_statement = text('''
+		DELETE FROM "RateLimitBucket"
+		WHERE key LIKE :namespace AND tokens + EXTRACT(EPOCH FROM now() - date_modified) * :rate >= :capacity
+	''')
+
+	def __init__(self, prune_interval: float = 60):
+		self.prune_interval = prune_interval
+		self.__pruned = {}
+		self.__lock = threading.Lock()
+
+	def take(self, key: str, capacity: float, rate: float):
+		with engine.begin() as connection:
+			tokens = connection.execute(self.take_statement, key=key, capacity=capacity, rate=rate).scalar()
+
+		# Every worker prunes each namespace at most once per prune_interval, otherwise keys tried once stay forever
+		namespace = key.split(':')[0]
+		now = time.monotonic()
+		with self.__lock:
+			prune = now - self.__pruned.get(namespace, float('-inf')) >= self.prune_interval
+			if(prune):
+				self.__pruned[namespace] = now
+		if(prune):
+			self.prune(namespace, capacity, rate)
+
+		return tokens
+
+	def prune(self, namespace: str, capacity: float, rate: float):
+		'''
+		Delete the buckets of a namespace which have refilled
+
+		Return:
+			Number of deleted buckets
+		'''
+
+		escaped_namespace = namespace.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+		with engine.begin() as connection:
+			return connection.execute(self.prune_statement, namespace=f"{escaped_namespace}:%", capacity=capacity, rate=rate).rowcount
+
+
+class RateLimiter:
+	'''
+	Token bucket rate limiter, each key may burst up to capacity requests and is refilled at rate requests per second
+	'''
+
+	def __init__(self, backend, capacity: float, rate: float):
+		self.backend = backend
+		self.capacity = capacity
+		self.rate = rate
+
+	def allow(self, key: str):
+		return self.backend.take(key, self.capacity, self.rate) >= 0
+
+	@property
+	def retry_after(self):
+		# Seconds until a token is available again
+		return max(1, int(round(1 / self.rate)))
+
+
+class NegativeCache:
+	'''
+	Remembers keys known not to exist, e.g. usernames without an account, for ttl seconds
+	'''
+
+	def __init__(self, ttl: float, max_entries: int = 100000):
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.__entries = {}
+		self.__lock = threading.Lock()
+
+	def __contains__(self, key: str):
+		expiry = self.__entries.get(key)
+		if(expiry is None):
+			return False
+		if(expiry < time.monotonic()):
+			self.discard(key)
+			return False
+		return True
+
+	def add(self, key: str):
+		with self.__lock:
+			if(len(self.__entries) >= self.max_entries):
+				self.__entries.clear()
+			self.__entries[key] = time.monotonic() + self.ttl
+
+	def discard(self, key: str):
+		with self.__lock:
+			self.__entries.pop(key, None)
+
+
+class LoginShield:
+	'''
+	Rejects login attempts before any database or bcrypt work:
+		1. Token bucket per client IP
+		2. Usernames known not to exist
+		3. Token bucket per username
+	'''
+
+	def __init__(self, ip_limiter: RateLimiter, username_limiter: RateLimiter, unknown_usernames: NegativeCache):
+		self.ip_limiter = ip_limiter
+		self.username_limiter = username_limiter
+		self.unknown_usernames = unknown_usernames
+
+		self.__lock = threading.Lock()
+		self.counts = {ACCEPTED: 0, REJECTED_IP: 0, REJECTED_UNKNOWN_USERNAME: 0, REJECTED_USERNAME: 0}
+
+	def check(self, username: str, client_ip: str):
+		'''
+		Return:
+			None if the attempt is allowed, otherwise the reason it was rejected. Unknown usernames must be answered
+			like a wrong password, so the rejection does not tell which usernames have an account
+		'''
+
+		if(not self.ip_limiter.allow(f"ip:{client_ip}")):
+			return self._count(REJECTED_IP)
+		if(username in self.unknown_usernames):
+			return self._count(REJECTED_UNKNOWN_USERNAME)
+		if(not self.username_limiter.allow(f"username:{username}")):
+			return self._count(REJECTED_USERNAME)
+
+		self._count(ACCEPTED)
+		return None
+
+	def get_retry_after(self, result: str):
+		# Seconds until the limiter which rejected the attempt allows another one
+		if(result == REJECTED_IP):
+			return self.ip_limiter.retry_after
+		return self.username_limiter.retry_after
+
+	def stats(self):
+		with self.__lock:
+			return dict(self.counts)
+
+	def _count(self, result: str):
+		with self.__lock:
+			self.counts[result] += 1
+		return result
+
+
+def get_backend():
+	backend = os.getenv('LOGIN_RATE_LIMIT_BACKEND') or 'memory'
+	if(backend == 'memory'):
+		return MemoryBucketBackend()
+	if(backend == 'database'):
+		return DatabaseBucketBackend(prune_interval=float(os.getenv('LOGIN_RATE_LIMIT_PRUNE_INTERVAL') or 60))
+
+	raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+def get_login_shield():
+	'''
+	Create the login shield configured through the environment
+	'''
+
+	backend = get_backend()
+	login_shield = LoginShield(
+		ip_limiter=RateLimiter(backend,
+			capacity=float(os.getenv('LOGIN_RATE_LIMIT_IP_BURST') or 20),
+			rate=float(os.getenv('LOGIN_RATE_LIMIT_IP_PER_MINUTE') or 10) / 60,
+		),
+		username_limiter=RateLimiter(backend,
+			capacity=float(os.getenv('LOGIN_RATE_LIMIT_USERNAME_BURST') or 5),
+			rate=float(os.getenv('LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE') or 5) / 60,
+		),
+		unknown_usernames=NegativeCache(ttl=float(os.getenv('LOGIN_UNKNOWN_USERNAME_TTL') or 300)),
+	)
+
+	# Accounts registered through other workers can log in without waiting for the ttl
+	notifications.listener.subscribe(USER_CREATED_CHANNEL, login_shield.unknown_usernames.discard)
+	return login_shield
@@ -37,6 +37,16 @@ class HealthRecord(HealthRecordMetadata):
 	health_record_id: int
 	user_id: int
 
+class HealthRecordSeries(BaseAPIModel):
+	metric: str
+	resolution: str
+	period_start: List[datetime] = []
+	minimum: List[float] = []
+	maximum: List[float] = []
+	mean: List[float] = []
+	last: List[float] = []
+	count: List[int] = []
+
 class Food(BaseAPIModel):
 	food_id: str
 	food_name: str
@@ -110,8 +120,14 @@ class Meal(MealMetadata):
 	user_id: int
 	blood_glucose: float = None
 	
+class FoodPrediction(BaseAPIModel):
+	class_index: int
+	food_id: str = None
+	probability: float
+
 class MealWithPredictions(Meal):
 	food_predictions: str = None
+	predictions: List[FoodPrediction] = None
 
 class MealWithSlimFoodItems(Meal):
 	food_items: List[FoodItemSlim] = []
@@ -263,6 +279,45 @@ class ClinicianAssignment(ClinicianAssignmentBase):
 class ClinicianAssignmentWithRelations(ClinicianAssignment):
 	clinician: Clinician
 
+# Clinician Dashboard
+class ClinicianDashboardPatient(BaseAPIModel):
+	user_id: int
+	email: str
+	name: str = None
+	contact_information: str = None
+	profile: Profile = None
+	latest_health_record: HealthRecord = None
+	recent_meals: List[MealWithSlimFoodItems] = []
+
+# Sync
+class SyncChanges(BaseAPIModel):
+	token: str
+	full: bool
+	meals: List[Meal] = []
+	food_items: List[FoodItemWithMetadata] = []
+	health_records: List[HealthRecord] = []
+	profile: Profile = None
+
+# Batch
+class BatchOperation(BaseAPIModel):
+	operation: str
+	# Record the operation applies to, the meal for create_food_item
+	id: int = None
+	idempotency_key: str = None
+	data: dict = None
+
+class BatchRequest(BaseAPIModel):
+	operations: List[BatchOperation]
+
+class BatchOperationResult(BaseAPIModel):
+	status_code: int
+	id: int = None
+	detail: str = None
+	replayed: bool = False
+
+class BatchResponse(BaseAPIModel):
+	results: List[BatchOperationResult]
+
 
 
 ### Trend Analyzer
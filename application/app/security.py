@@ -1,13 +1,90 @@
 # security.py
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from passlib.context import CryptContext
+from dotenv import load_dotenv
+from app.metrics import Histogram
+load_dotenv()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor, hashes with a different cost factor are rehashed on login
+PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS') or 12)
+
+# Number of processes hashing passwords and the number of hashing requests allowed to wait for a process
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS') or 2)
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING') or 32)
+
+pwd_context = CryptContext(
+	schemes=["bcrypt"],
+	deprecated="auto",
+	bcrypt__default_rounds=PASSWORD_HASH_ROUNDS,
+	bcrypt__min_rounds=PASSWORD_HASH_ROUNDS,
+	bcrypt__max_rounds=PASSWORD_HASH_ROUNDS,
+)
 
 
 def verify_password(plain_password, hashed_password):
 	return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password, hashed_password):
+	'''
+	Return:
+		Tuple of (verified, new hash), the new hash is None unless the hash uses outdated parameters
+	'''
+	return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password):
 	return pwd_context.hash(password)
 
 
+class PasswordHasherBusyError(Exception):
+	pass
+
+
+class PasswordHasher:
+	'''
+	Runs bcrypt in a dedicated process pool so hashing never blocks the event loop.
+	Requests beyond the number of processes wait for a free process, up to max_pending,
+	after which they are rejected immediately with PasswordHasherBusyError.
+	'''
+
+	def __init__(self, workers: int, max_pending: int):
+		self.workers = workers
+		self.max_pending = max_pending
+		self.__executor = None
+		self.__semaphore = None
+		self.__pending = 0
+		self.verify_latency = Histogram('password_verify_seconds')
+
+	async def verify_and_update(self, plain_password, hashed_password):
+		with self.verify_latency.time():
+			return await self._run(verify_and_update_password, plain_password, hashed_password)
+
+	async def hash(self, password):
+		return await self._run(get_password_hash, password)
+
+	def shutdown(self):
+		if(self.__executor is not None):
+			self.__executor.shutdown(wait=False)
+			self.__executor = None
+
+	async def _run(self, function, *args):
+		if(self.__pending >= self.workers + self.max_pending):
+			raise PasswordHasherBusyError("Too many password hashing requests.")
+
+		# Created lazily, in the worker process and on the running event loop. The processes are spawned rather than
+		# forked, a fork would copy the loaded models and the locks held by the threads of the worker
+		if(self.__executor is None):
+			self.__executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+			self.__semaphore = asyncio.Semaphore(self.workers)
+
+		self.__pending += 1
+		try:
+			async with self.__semaphore:
+				return await asyncio.get_event_loop().run_in_executor(self.__executor, function, *args)
+		finally:
+			self.__pending -= 1
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
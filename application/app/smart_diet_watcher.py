@@ -6,67 +6,99 @@ load_dotenv()
 
 ### Imports
 import os
+import re
+import functools
 import hashlib
 import datetime
 import base64
 import pathlib
 import numpy as np
 import cv2
-from keras.applications.vgg16 import preprocess_input as vgg_preprocess_input
-from keras.applications.mobilenet_v2 import preprocess_input as mobilenet_preprocess_input
-from keras.preprocessing.image import load_img
-from keras.preprocessing.image import img_to_array
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from app import image_storage
 
 root_image_directory = os.getenv('IMAGE_DIRECTORY')
 root_thumbnail_directory = os.getenv('THUMBNAIL_DIRECTORY')
 
+# File names of content addressed images, SHA-256 hex digest followed by the extension
+content_address_pattern = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
 
-def save_image(user_id: int, image_data: str):
+image_store = image_storage.get_storage(root_image_directory)
+thumbnail_store = image_storage.get_storage(root_thumbnail_directory)
+
+# ImageNet mean pixel in BGR order, subtracted by the VGG16 preprocessing
+VGG_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def get_content_address(image: bytes):
 	'''
-	Save image to disk
+	Get the content address of an image
 
 	Parameters:
-		user_id (int): User ID used for creating directory
-		image_data (str): Base64 string containing image data
+		image (bytes): Raw image data
 	Return:
-		String containing the path to the saved image
+		String containing the SHA-256 hex digest of the image data
 	'''
 
-	# Extract metadata from image
-	metadata, image_base64 = image_data.split(',')
+	return hashlib.sha256(image).hexdigest()
 
-	# Get extension from image metadata
-	if('image' in metadata):
-		ext = metadata.split('/')[1].split(';')[0]
-	else:
-		return None
 
-	# Use .jpg instead of .jpeg
-	if(ext == 'jpeg'):
-		ext = 'jpg'
+def is_content_addressed(file_name: str):
+	'''
+	Check if a file name was generated from the content of the image
+	'''
+
+	return content_address_pattern.match(file_name) is not None
+
 
-	# Generate filename
-	file_name = str(base64.urlsafe_b64encode(str.encode(str(datetime.datetime.utcnow()))))[2:-1]
-	file_name = file_name + '.' + ext
+def get_shard_directory(file_name: str):
+	'''
+	Get the relative sharded directory of a content addressed file, e.g. ab/cd for abcd...
+	'''
 
-	# Create directories for the user if they do not exist
-	image_directory = os.path.join(root_image_directory, str(user_id))
-	if(not os.path.exists(image_directory)):
-		os.makedirs(image_directory)
+	return os.path.join(file_name[0:2], file_name[2:4])
 
-	thumbnail_directory = os.path.join(root_thumbnail_directory, str(user_id))
-	if(not os.path.exists(thumbnail_directory)):
-		os.makedirs(thumbnail_directory)
 
-	# Create image path from imge directory
-	full_image_path = os.path.join(image_directory, file_name)
-	full_thumbnail_path = os.path.join(thumbnail_directory, file_name)
+def get_relative_path(user_id: int, file_name: str):
+	'''
+	Get the path of an image relative to the image and thumbnail root directories
 
-	# Parse image data
-	image = base64.b64decode(image_base64)
+	Parameters:
+		user_id (int): User ID of the meal owner, used by images saved before content addressing
+		file_name (str): File name stored in Meal.image
+	Return:
+		String containing the relative path to the image
+	'''
+
+	if(is_content_addressed(file_name)):
+		return os.path.join(get_shard_directory(file_name), file_name)
+
+	# Legacy images are stored per user
+	return os.path.join(str(user_id), file_name)
+
+
+def get_image_path(user_id: int, file_name: str):
+	return os.path.join(root_image_directory, get_relative_path(user_id, file_name))
+
+
+def get_thumbnail_path(user_id: int, file_name: str):
+	return os.path.join(root_thumbnail_directory, get_relative_path(user_id, file_name))
+
+
+def create_thumbnail(image: bytes, ext: str):
+	'''
+	Create a square 50x50 thumbnail
+
+	Parameters:
+		image (bytes): Raw image data
+		ext (str): File extension used to encode the thumbnail
+	Return:
+		Bytes containing the encoded thumbnail
+	'''
 
 	# Resize image and create thumbnail
-	thumbnail = np.fromstring(image, np.uint8)
+	thumbnail = np.frombuffer(image, np.uint8)
 	thumbnail = cv2.imdecode(thumbnail, cv2.IMREAD_COLOR)
 	h, w = thumbnail.shape[:2]
 
@@ -82,39 +114,146 @@ def save_image(user_id: int, image_data: str):
 
 	thumbnail = cv2.resize(thumbnail, (50,50), interpolation=cv2.INTER_AREA)
 
-	# Write image to disk
-	with open(full_image_path, 'wb') as f:
-		f.write(image)
+	return cv2.imencode('.' + ext, thumbnail)[1].tobytes()
+
+
+async def image_exists(user_id: int, file_name: str):
+	relative_path = get_relative_path(user_id, file_name)
+	return await image_store.exists(relative_path) and await thumbnail_store.exists(relative_path)
 
-	cv2.imwrite(full_thumbnail_path, thumbnail)
+
+async def save_image(user_id: int, image_data: str):
+	'''
+	Save image to disk
+
+	Images are content addressed, the file name is the SHA-256 digest of the image data
+	and files are sharded by the first two bytes of the digest. Identical images are only stored once.
+	Thumbnail creation and file I/O run outside of the event loop.
+
+	Parameters:
+		user_id (int): User ID of the meal owner
+		image_data (str): Base64 string containing image data
+	Return:
+		String containing the file name of the saved image
+	'''
+
+	# Extract metadata from image
+	metadata, image_base64 = image_data.split(',')
+
+	# Get extension from image metadata
+	if('image' in metadata):
+		ext = metadata.split('/')[1].split(';')[0]
+	else:
+		return None
+
+	# Use .jpg instead of .jpeg
+	if(ext == 'jpeg'):
+		ext = 'jpg'
+
+	# Parse image data
+	image = base64.b64decode(image_base64)
+
+	# Generate filename from the image content
+	file_name = get_content_address(image) + '.' + ext
+
+	relative_path = get_relative_path(user_id, file_name)
+
+	# Image has been uploaded before
+	if(await image_exists(user_id, file_name)):
+		return file_name
+
+	# Write image to disk
+	thumbnail = await run_in_threadpool(create_thumbnail, image, ext)
+	await image_store.write(relative_path, image)
+	await thumbnail_store.write(relative_path, thumbnail)
 
 	return file_name
 
 
-def predict_classes(model, image_path: str):
+def delete_image(user_id: int, file_name: str):
 	'''
-	Predict food classes
+	Delete an image and its thumbnail from disk
+
+	Return:
+		Number of files deleted
+	'''
+
+	deleted = 0
+	for path in (get_image_path(user_id, file_name), get_thumbnail_path(user_id, file_name)):
+		try:
+			os.remove(path)
+			deleted += 1
+		except FileNotFoundError:
+			pass
+
+	return deleted
+
+
+def load_classification_image(image_path: str, input_size):
+	'''
+	Load and preprocess an image for the food classification model
 
 	Parameters:
-		model: Keras model
 		image_path (str): Path to image to be classified
+		input_size: (height, width) of the model input
 	Return:
-		String containing prediction classes sorted from highest to lowest, delimited by commas
+		float32 numpy array of shape (1, height, width, 3)
 	'''
 
-	# get model shape
-	width, height = model.layers[0].input_shape[1:3]
+	height, width = input_size
 
-	# load image
-	image = load_img(image_path, target_size=(width,height))
+	# load image, resized with nearest neighbour like keras.preprocessing.image.load_img
+	with Image.open(image_path) as image:
+		image = image.convert('RGB').resize((width,height), Image.NEAREST)
+		image = np.asarray(image, dtype=np.float32)
 
 	# preprocess image
-	image = img_to_array(image)
-	image.reshape((1, image.shape[0], image.shape[1], image.shape[2]))
-	image = vgg_preprocess_input(np.array([image]))
+	return vgg_preprocess_input(np.array([image]))
+
+
+# Preprocessing of the keras.applications models in numpy, the API does not import Keras and TensorFlow for it
+def vgg_preprocess_input(images):
+	# RGB to BGR, zero-centered by the ImageNet mean
+	return images[..., ::-1] - VGG_MEAN_BGR
+
+
+def mobilenet_preprocess_input(images):
+	# Scaled to [-1, 1]
+	return images / 127.5 - 1
+
+
+@functools.lru_cache(maxsize=256)
+def predict_probabilities(model, image_path: str):
+	'''
+	Run the food classification model on an image
+
+	Images are content addressed, so results are cached by image path.
+
+	Parameters:
+		model: InferenceBackend
+		image_path (str): Path to image to be classified
+	Return:
+		Numpy array containing the probability of each food class
+	'''
+
+	image = load_classification_image(image_path, model.input_size)
 
 	# predict food classes
-	predictions = model.predict(image)[0]
+	return model.predict(image)[0]
+
+
+def predict_classes(model, image_path: str):
+	'''
+	Predict food classes
+
+	Parameters:
+		model: InferenceBackend
+		image_path (str): Path to image to be classified
+	Return:
+		String containing prediction classes sorted from highest to lowest, delimited by commas
+	'''
+
+	predictions = predict_probabilities(model, image_path)
 
 	predictions_sorted = list(np.flip(np.argsort(predictions)))
 	predictions_sorted_str = ','.join(str(prediction) for prediction in predictions_sorted)
@@ -122,34 +261,82 @@ def predict_classes(model, image_path: str):
 	return predictions_sorted_str
 
 
-def detect_food(model, image_data: str):
+def predict_top_classes(model, image_path: str, prediction_classes: list, k: int):
 	'''
-	Detect if food is present in an image
+	Predict the top k food classes
 
 	Parameters:
-		model: Keras model
-		image_data (str): Image data in Base64
+		model: InferenceBackend
+		image_path (str): Path to image to be classified
+		prediction_classes (list): Food IDs of the model classes
+		k (int): Number of classes to return, at least 1
 	Return:
-		True if food is detected, False if food is not detected
+		List of dicts containing the class index, food ID and probability, sorted from highest to lowest probability
 	'''
 
-	# get model shape
-	width, height = model.layers[0].input_shape[1:3]
+	predictions = predict_probabilities(model, image_path)
+	k = min(k, len(predictions))
+
+	# Partially select the top k classes, only those are sorted
+	top_classes = np.argpartition(predictions, -k)[-k:]
+	top_classes = top_classes[np.argsort(predictions[top_classes])[::-1]]
+
+	return [{
+		'class_index': int(class_index),
+		'food_id': prediction_classes[class_index] if class_index < len(prediction_classes) else None,
+		'probability': float(predictions[class_index]),
+	} for class_index in top_classes]
+
+
+def decode_image_data(image_data: str):
+	'''
+	Decode a Base64 image
+
+	Parameters:
+		image_data (str): Image data in Base64
+	Return:
+		RGB image as a numpy array
+	'''
 
-	# Decode image data
 	image = base64.b64decode(image_data.split(',')[1])
-	image = np.fromstring(image, np.uint8)
+	image = np.frombuffer(image, np.uint8)
 	image = cv2.imdecode(image, cv2.IMREAD_COLOR)
-	image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+	return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def predict_food_presence(model, image):
+	'''
+	Run the food detection model on a decoded image
+
+	Parameters:
+		model: InferenceBackend
+		image: RGB image as a numpy array
+	Return:
+		Numpy array containing the food and no food probabilities
+	'''
+
+	# get model shape
+	height, width = model.input_size
 
 	# preprocess image
-	image = cv2.resize(image, (224,224), interpolation=cv2.INTER_AREA)
-	image = img_to_array(image)
-	image.reshape((1, image.shape[0], image.shape[1], image.shape[2]))
-	image = mobilenet_preprocess_input(np.array([image]))
+	image = cv2.resize(image, (width,height), interpolation=cv2.INTER_AREA)
+	image = mobilenet_preprocess_input(np.array([image], dtype=np.float32))
 
-	# predict food classes
-	prediction = model.predict(image)[0]
+	return model.predict(image)[0]
+
+
+def detect_food(model, image_data: str):
+	'''
+	Detect if food is present in an image
+
+	Parameters:
+		model: InferenceBackend
+		image_data (str): Image data in Base64
+	Return:
+		True if food is detected, False if food is not detected
+	'''
+
+	prediction = predict_food_presence(model, decode_image_data(image_data))
 
 	if(prediction[0] > prediction[1]):
 		return True
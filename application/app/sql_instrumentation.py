@@ -0,0 +1,233 @@
+# sql_instrumentation.py
+
+# load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+### Imports
+import os
+import time
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from app.metrics import Histogram, get_endpoint_name
+
+# Adds X-DB-Queries, X-DB-Time-Ms and X-DB-N-Plus-One to responses, meant for development only
+SQL_DEBUG_HEADERS = (os.getenv('SQL_DEBUG_HEADERS') or '0') == '1'
+
+# Seconds after which a statement is logged as slow
+SQL_SLOW_QUERY_SECONDS = float(os.getenv('SQL_SLOW_QUERY_SECONDS') or 0.25)
+
+# Number of times an identical statement runs in a request before it is flagged as an N+1 suspect
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD') or 5)
+
+# Number of slow statements kept for the metrics
+SQL_SLOW_QUERY_HISTORY = 50
+
+# Queries per request buckets
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Longest statement text kept in the slow query log and the N+1 suspects
+STATEMENT_MAX_LENGTH = 500
+
+
+class RequestQueries:
+	'''
+	Statements run by the database during a request
+	'''
+
+	def __init__(self):
+		self.count = 0
+		self.seconds = 0.0
+		self.statements = Counter()
+
+	def record(self, statement: str, seconds: float):
+		self.count += 1
+		self.seconds += seconds
+		# Lazy loads repeat the same statement with other parameters, so the text identifies them
+		self.statements[statement] += 1
+
+	def get_n_plus_one_suspects(self, threshold: int = None):
+		'''
+		Return:
+			List of (statement, count) run at least threshold times, most repeated first
+		'''
+
+		threshold = threshold or SQL_N_PLUS_ONE_THRESHOLD
+		return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+class QueryStats:
+	'''
+	Queries aggregated per endpoint, and the most recent slow statements
+	'''
+
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__endpoints = {}
+		self.__slow_queries = deque(maxlen=SQL_SLOW_QUERY_HISTORY)
+		self.query_latency = Histogram('sql_query_seconds')
+		self.queries_per_request = Histogram('sql_queries_per_request', QUERY_COUNT_BUCKETS)
+
+	def record_request(self, endpoint: str, queries: RequestQueries):
+		self.queries_per_request.observe(queries.count)
+		suspects = queries.get_n_plus_one_suspects()
+		with self.__lock:
+			stats = self.__endpoints.setdefault(endpoint, {'requests': 0, 'queries': 0, 'seconds': 0.0, 'max_queries': 0, 'n_plus_one_requests': 0, 'n_plus_one_statements': {}})
+			stats['requests'] += 1
+			stats['queries'] += queries.count
+			stats['seconds'] += queries.seconds
+			stats['max_queries'] = max(stats['max_queries'], queries.count)
+			if(suspects):
+				stats['n_plus_one_requests'] += 1
+				for statement, count in suspects:
+					statement = statement[:STATEMENT_MAX_LENGTH]
+					stats['n_plus_one_statements'][statement] = max(stats['n_plus_one_statements'].get(statement, 0), count)
+
+	def record_slow_query(self, statement: str, seconds: float):
+		with self.__lock:
+			self.__slow_queries.append({'statement': statement[:STATEMENT_MAX_LENGTH], 'seconds': seconds, 'date': datetime.now().isoformat()})
+
+	def stats(self):
+		with self.__lock:
+			endpoints = {endpoint: dict(stats, n_plus_one_statements=dict(stats['n_plus_one_statements'])) for endpoint, stats in self.__endpoints.items()}
+			slow_queries = list(self.__slow_queries)
+
+		for stats in endpoints.values():
+			stats['average_queries'] = stats['queries'] / stats['requests']
+			stats['average_seconds'] = stats['seconds'] / stats['requests']
+		return {
+			'query_seconds': self.query_latency.snapshot(),
+			'queries_per_request': self.queries_per_request.snapshot(),
+			'endpoints': endpoints,
+			'slow_queries': slow_queries,
+		}
+
+
+query_stats = QueryStats()
+
+# Queries of the request being handled, the threadpool runs sync endpoints in a copy of the context so they share it
+current_queries = contextvars.ContextVar('current_queries', default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	seconds = time.perf_counter() - conn.info['query_start'].pop()
+	query_stats.query_latency.observe(seconds)
+
+	queries = current_queries.get()
+	if(queries is not None):
+		queries.record(statement, seconds)
+
+	if(seconds >= SQL_SLOW_QUERY_SECONDS):
+		query_stats.record_slow_query(statement, seconds)
+		print('[WARN] slow query ({:.3f} s): {}'.format(seconds, ' '.join(statement.split())[:STATEMENT_MAX_LENGTH]))
+
+
+def handle_error(exception_context):
+	# A failed statement never reaches after_cursor_execute
+	connection = exception_context.connection
+	if(connection is not None and connection.info.get('query_start')):
+		connection.info['query_start'].pop()
+
+
+def instrument(engine):
+	'''
+	Time every statement run by the engine, statements run during a request are recorded for it
+	'''
+
+	if(not event.contains(engine, 'before_cursor_execute', before_cursor_execute)):
+		event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+		event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+		event.listen(engine, 'handle_error', handle_error)
+
+
+@contextmanager
+def record_queries():
+	'''
+	Record the statements run within the block
+
+	Return:
+		RequestQueries filled in as the block runs
+	'''
+
+	queries = RequestQueries()
+	token = current_queries.set(queries)
+	try:
+		yield queries
+	finally:
+		current_queries.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries: int, n_plus_one_threshold: int = None):
+	'''
+	Assert that the block stays within a number of statements and runs none of them repeatedly, e.g. in a test
+
+		with sql_instrumentation.query_budget(3):
+			client.get('/meals/', headers=headers)
+
+	Parameters:
+		max_queries (int): Most statements the block may run
+		n_plus_one_threshold (int): Times an identical statement may run, defaults to SQL_N_PLUS_ONE_THRESHOLD
+	Return:
+		RequestQueries of the block, AssertionError when the budget is exceeded
+	'''
+
+	with record_queries() as queries:
+		yield queries
+
+	suspects = queries.get_n_plus_one_suspects(n_plus_one_threshold)
+	if(queries.count > max_queries or suspects):
+		lines = ['{} queries run, budget of {}'.format(queries.count, max_queries)]
+		lines += ['{}x {}'.format(count, ' '.join(statement.split())) for statement, count in (suspects or queries.statements.most_common())]
+		raise AssertionError('\n'.join(lines))
+
+
+class SQLInstrumentationMiddleware:
+	'''
+	Records the statements run by each request per endpoint.
+
+	With debug_headers, the number of queries, the time spent in the database and the number of N+1 suspects are
+	added to the response headers. Statements run after the response started, e.g. by background tasks, are only
+	counted in the metrics.
+	'''
+
+	def __init__(self, app, debug_headers: bool = SQL_DEBUG_HEADERS):
+		self.app = app
+		self.debug_headers = debug_headers
+
+	async def __call__(self, scope, receive, send):
+		if(scope['type'] != 'http'):
+			await self.app(scope, receive, send)
+			return
+
+		async def send_with_headers(message):
+			if(message['type'] == 'http.response.start'):
+				headers = MutableHeaders(raw=message['headers'])
+				headers['X-DB-Queries'] = str(queries.count)
+				headers['X-DB-Time-Ms'] = '{:.1f}'.format(queries.seconds * 1000)
+				headers['X-DB-N-Plus-One'] = str(len(queries.get_n_plus_one_suspects()))
+			await send(message)
+
+		# Requests run within a query_budget, e.g. through a TestClient, count towards it
+		queries = current_queries.get()
+		if(queries is not None):
+			await self._run(scope, receive, send_with_headers if self.debug_headers else send, queries)
+			return
+
+		with record_queries() as queries:
+			await self._run(scope, receive, send_with_headers if self.debug_headers else send, queries)
+
+	async def _run(self, scope, receive, send, queries: RequestQueries):
+		try:
+			await self.app(scope, receive, send)
+		finally:
+			query_stats.record_request(get_endpoint_name(scope), queries)
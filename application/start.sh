@@ -7,4 +7,15 @@ if [ $INITIAL -eq 1 ]; then
   cd ..
 fi
 
+# Metrics of the workers of a previous run would be added to the new ones
+if [ -n "$METRICS_MULTIPROCESS_DIRECTORY" ]; then
+  rm -rf "$METRICS_MULTIPROCESS_DIRECTORY"
+  mkdir -p "$METRICS_MULTIPROCESS_DIRECTORY"
+fi
+
+# API workers of the remote inference mode delegate the models to an inference worker, the only process importing TensorFlow
+if [ "$INFERENCE_MODE" = "remote" ]; then
+  uvicorn app.inference_worker:app --host 127.0.0.1 --port 9001 &
+fi
+
 uvicorn app.main:app `if [ $DEV -eq 1 ]; then echo --reload; fi` --host 0.0.0.0 --port 9000
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # add app to path
+import tempfile
+import pytest
+
+# Tests create and drop tables, they only run against a database created for them
+TEST_DATABASE_URL = os.getenv('TEST_POSTGRESQL_CONNECTION')
+if(TEST_DATABASE_URL):
+    os.environ['POSTGRESQL_CONNECTION'] = TEST_DATABASE_URL
+
+# Set before app/.env is loaded, which does not override them
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('ACCESS_TOKEN_EXPIRE', '0')
+os.environ.setdefault('ACCESS_TOKEN_EXPIRE_DURATION', '30')
+os.environ.setdefault('STATIC_DIRECTORY', '')
+os.environ['IMAGE_DIRECTORY'] = tempfile.mkdtemp()
+os.environ['THUMBNAIL_DIRECTORY'] = tempfile.mkdtemp()
+
+
+@pytest.fixture(scope='session')
+def database():
+    if(not TEST_DATABASE_URL):
+        pytest.skip('TEST_POSTGRESQL_CONNECTION is not set')
+
+    from app import models, sql_instrumentation
+    from app.database import engine
+    sql_instrumentation.instrument(engine)
+    models.Base.metadata.create_all(engine)
+    yield engine
+    models.Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def db(database):
+    from app.database import SessionLocal
+    db = SessionLocal()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def user(db, request):
+    from app import crud
+    return crud.create_user(db, '{}@example.com'.format(request.node.name.lower()), 'password hash', 0)
+
+
+@pytest.fixture
+def client(database):
+    # Without the startup events, the models and background threads are not loaded
+    from starlette.testclient import TestClient
+    from app import main
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def clinician(db, request):
+    from app import crud
+    return crud.create_user(db, 'clinician-{}@example.com'.format(request.node.name.lower()), 'password hash', 1)
+
+
+def get_headers(user):
+    from app import main
+    # PyJWT 1.7 encodes tokens as bytes
+    token = main.create_access_token(data={'user_id': user.user_id, 'password_updated_date': 0})
+    return {'Authorization': 'Bearer {}'.format(token.decode('utf-8'))}
+
+
+@pytest.fixture
+def headers(user):
+    return get_headers(user)
+
+
+@pytest.fixture
+def clinician_headers(clinician):
+    return get_headers(clinician)
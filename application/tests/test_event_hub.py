@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import event
+from app import sql_instrumentation
+
+
+@pytest.fixture
+def commits(database):
+    committed = []
+    listener = lambda connection: committed.append(connection)
+    event.listen(database, 'commit', listener)
+    yield committed
+    event.remove(database, 'commit', listener)
+
+
+@pytest.mark.parametrize('backend', ['memory', 'postgres'])
+def test_accept_assignment_commits_once(client, clinician_headers, db, user, clinician, commits, monkeypatch, backend):
+    from app import crud, event_hub
+    monkeypatch.setattr(event_hub.hub, 'backend', backend)
+    assignment = crud.create_clinician_assignment(db, clinician.user_id, user.user_id)
+    published = event_hub.hub.published
+    commits.clear()
+
+    with sql_instrumentation.record_queries() as queries:
+        response = client.get('/clinician/assignments/{}/accept'.format(assignment.clinician_assignment_id), headers=clinician_headers)
+    assert response.status_code == 200
+    assert event_hub.hub.published == published + 1
+
+    # The assignment change and, with the postgres backend, the event are notified by the commit of the update
+    assert len(commits) == 1
+    notifications = sum(count for statement, count in queries.statements.items() if 'pg_notify' in statement)
+    assert notifications == (2 if backend == event_hub.BACKEND_POSTGRES else 1)
@@ -0,0 +1,64 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from app import fast_json, schemas
+
+DATE_CREATED = datetime(2020, 6, 1, 12, 30, 15, 123456)
+
+
+def get_food_item(food_item_id, volume_consumed, nutrition_value):
+    nutrition = SimpleNamespace(nutrition_code='N1', nutrition_name='Energy', nutrition_measurement_suffix='kcal')
+    return SimpleNamespace(
+        food_item_id=food_item_id,
+        meal_id=1,
+        volume_consumed=volume_consumed,
+        per_unit_measurement=1,
+        new_food_type=None,
+        food=SimpleNamespace(food_id='rice', food_name='Rice', food_nutritions=[
+            SimpleNamespace(nutrition=nutrition, nutrition_value=nutrition_value),
+            SimpleNamespace(nutrition=None, nutrition_value=None),
+        ]),
+        measurement=SimpleNamespace(measurement_description='Gram', measurement_conversion_to_g=1.0, suffix='g'),
+    )
+
+
+def get_meal(meal_id, blood_glucose, food_items, **attributes):
+    return SimpleNamespace(meal_id=meal_id, user_id=1, image='{:064x}.jpg'.format(meal_id), blood_glucose=blood_glucose,
+                           date_created=DATE_CREATED, food_items=food_items, **attributes)
+
+
+MEALS = [
+    # Nested food items, with foods, nutritions and measurements
+    get_meal(1, 5.5, [get_food_item(1, 150.5, 0.1 + 0.2), get_food_item(2, 0, 1e15)], date_modified=datetime(2020, 6, 2), date_deleted=None),
+    # Optional fields set to None
+    get_meal(2, None, [SimpleNamespace(food_item_id=3, meal_id=2, volume_consumed=None, per_unit_measurement=None, new_food_type='Soup', food=None, measurement=None)],
+             date_modified=None, date_deleted=None),
+    # Integers given for floats, negative floats
+    get_meal(3, 6, [get_food_item(4, -1.5, 42)], date_modified=None, date_deleted=None),
+    # Floats encoded differently by orjson and json are delegated to pydantic
+    get_meal(4, 1e-05, [get_food_item(5, 1e17, 1e-07)], date_modified=None, date_deleted=None),
+    # Missing attributes take the defaults of the fields
+    get_meal(5, 4.2, []),
+    SimpleNamespace(meal_id=6, user_id=1, image='6.jpg', date_created=DATE_CREATED),
+]
+
+HEALTH_RECORDS = [
+    SimpleNamespace(health_record_id=1, user_id=1, waist_circumference=80.5, weight=70, blood_pressure_medication=False, physical_exercise_hours=1,
+                    physical_exercise_minutes=30, smoking=None, vegetable_fruit_berries_consumption=True, systolic_pressure=120.0,
+                    fasting_blood_glucose=5.123456789, hdl_cholesterol=0.0001, triglycerides=1.7, date_created=DATE_CREATED,
+                    date_modified=datetime(2021, 1, 1, 0, 0), date_deleted=None),
+    SimpleNamespace(health_record_id=2, user_id=1, weight=None, hdl_cholesterol=0.00001, date_created=DATE_CREATED),
+]
+
+
+@pytest.mark.parametrize('model, objects', [
+    (schemas.MealWithFoodItems, MEALS),
+    (schemas.HealthRecord, HEALTH_RECORDS),
+])
+def test_contract(model, objects):
+    assert fast_json.check_contract(model, objects) is None
+
+
+def test_missing_attribute_takes_default():
+    assert fast_json.encode(schemas.MealWithFoodItems, [MEALS[-1]]) == fast_json.encode_pydantic(schemas.MealWithFoodItems, [MEALS[-1]])
+    assert b'"food_items":[]' in fast_json.encode(schemas.MealWithFoodItems, [MEALS[-1]])
@@ -0,0 +1,25 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+inference = pytest.importorskip('app.inference')
+
+
+@pytest.mark.parametrize('dtype, scale, zero_point, values, expected', [
+    # Rounded to the nearest step instead of truncated
+    (np.int8, 1 / 255, -128, [0.0, 0.4 / 255, 0.6 / 255, 127.4 / 255, 127.6 / 255], [-128, -128, -127, -1, 0]),
+    # Saturated instead of wrapped around
+    (np.int8, 1 / 255, -128, [1.0, 1.5, -0.5], [127, 127, -128]),
+    (np.uint8, 1 / 255, 0, [0.0, 0.25, 1.0, 1.1, -0.1], [0, 64, 255, 255, 0]),
+])
+def test_quantize(dtype, scale, zero_point, values, expected):
+    quantized = inference.quantize(np.array(values, dtype=np.float32), scale, zero_point, dtype)
+    assert quantized.dtype == dtype
+    assert quantized.tolist() == expected
+
+
+def test_dequantize_inverts_quantize():
+    image = np.linspace(0, 1, 256, dtype=np.float32)
+    quantized = inference.quantize(image, 1 / 255, -128, np.int8)
+    prediction = inference.dequantize(quantized, 1 / 255, -128)
+    assert prediction.dtype == np.float32
+    assert np.abs(prediction - image).max() <= 0.5 / 255 + 1e-6
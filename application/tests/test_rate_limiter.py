@@ -0,0 +1,44 @@
+import time
+from sqlalchemy import text
+
+
+def get_bucket_keys(database, namespace):
+    with database.connect() as connection:
+        return {row.key for row in connection.execute(text('SELECT key FROM "RateLimitBucket" WHERE key LIKE :namespace'), namespace=namespace + ':%')}
+
+
+def test_database_backend_prunes_refilled_buckets(database):
+    from app import rate_limiter
+    backend = rate_limiter.DatabaseBucketBackend(prune_interval=3600)
+    # Refilled within 20ms
+    backend.take('refilled:a', capacity=2, rate=100)
+    backend.take('refilled:b', capacity=2, rate=100)
+    time.sleep(0.05)
+
+    assert backend.prune('refilled', capacity=2, rate=100) == 2
+    assert get_bucket_keys(database, 'refilled') == set()
+
+
+def test_database_backend_keeps_draining_buckets(database):
+    from app import rate_limiter
+    backend = rate_limiter.DatabaseBucketBackend(prune_interval=3600)
+    backend.take('draining:a', capacity=2, rate=0.001)
+    assert backend.take('draining:a', capacity=2, rate=0.001) < 1
+    backend.take('other:a', capacity=2, rate=100)
+    time.sleep(0.05)
+
+    # Other namespaces have their own capacity and rate
+    assert backend.prune('draining', capacity=2, rate=0.001) == 0
+    assert get_bucket_keys(database, 'draining') == {'draining:a'}
+    assert get_bucket_keys(database, 'other') == {'other:a'}
+
+
+def test_database_backend_prunes_while_taking(database):
+    from app import rate_limiter
+    backend = rate_limiter.DatabaseBucketBackend(prune_interval=0)
+    backend.take('taken:a', capacity=2, rate=100)
+    time.sleep(0.05)
+
+    # Attempts with random keys do not accumulate
+    backend.take('taken:b', capacity=2, rate=100)
+    assert get_bucket_keys(database, 'taken') == {'taken:b'}
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import text
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+from app import sql_instrumentation
+
+
+def run_queries(database, count):
+    async def endpoint(request):
+        with database.connect() as connection:
+            for _ in range(count):
+                connection.execute(text('SELECT 1'))
+        return PlainTextResponse('')
+
+    app = Starlette()
+    app.add_route('/', endpoint)
+    app.add_middleware(sql_instrumentation.SQLInstrumentationMiddleware)
+    return TestClient(app).get('/')
+
+
+def test_query_budget_counts_requests(database):
+    with sql_instrumentation.query_budget(2, n_plus_one_threshold=5) as queries:
+        run_queries(database, 2)
+    assert queries.count == 2
+
+
+def test_query_budget_exceeded(database):
+    with pytest.raises(AssertionError):
+        with sql_instrumentation.query_budget(1, n_plus_one_threshold=5):
+            run_queries(database, 2)
+
+
+def test_query_budget_n_plus_one(database):
+    with pytest.raises(AssertionError):
+        with sql_instrumentation.query_budget(10, n_plus_one_threshold=3):
+            run_queries(database, 4)
+
+
+# Statements of the endpoints, including the lookup of the authenticated user
+@pytest.mark.parametrize('path, max_queries', [
+    ('/users/me', 1),
+    ('/health-records/', 2),
+])
+def test_endpoint_query_budget(client, headers, path, max_queries):
+    with sql_instrumentation.query_budget(max_queries):
+        response = client.get(path, headers=headers)
+    assert response.status_code == 200
+
+
+def test_meal_list_query_budget(client, headers, db, user):
+    from app import crud
+    # More meals than SQL_N_PLUS_ONE_THRESHOLD, their food items are loaded in one query
+    for index in range(8):
+        crud.create_meal(db, user.user_id, 'meal-{}.jpg'.format(index))
+
+    with sql_instrumentation.query_budget(3):
+        response = client.get('/meals/', headers=headers)
+    assert len(response.json()) == 8
@@ -0,0 +1,97 @@
+import pytest
+from app import sql_instrumentation
+
+PROFILE = {
+    'date_of_birth': '1980-01-01',
+    'gender': 'female',
+    'height': 170,
+    'ethnicity': 1,
+    'family_history_diabetes_non_immediate': False,
+    'family_history_diabetes_parents': False,
+    'family_history_diabetes_siblings': False,
+    'family_history_diabetes_children': False,
+    'high_blood_glucose_history': False,
+    'high_blood_pressure_medication_history': False,
+}
+
+
+def get_writes(queries, table):
+    # INSERT ... RETURNING and UPDATE ... RETURNING read the row back in the write itself
+    return [statement for statement, count in queries.statements.items() for _ in range(count)
+            if statement.lstrip().startswith(('INSERT INTO "{}"'.format(table), 'UPDATE "{}"'.format(table)))]
+
+
+def assert_single_write(queries, table):
+    writes = get_writes(queries, table)
+    assert len(writes) == 1, writes
+    assert 'RETURNING' in writes[0]
+
+
+# Statements include the lookup of the authenticated user
+def test_update_user_info_writes_once(client, headers):
+    with sql_instrumentation.query_budget(2) as queries:
+        response = client.put('/users/me', json={'name': 'Name'}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['name'] == 'Name'
+    assert_single_write(queries, 'User')
+
+
+def test_create_profile_writes_once(client, headers):
+    with sql_instrumentation.query_budget(3) as queries:
+        response = client.post('/profile/', json=PROFILE, headers=headers)
+    assert response.status_code == 200
+    assert_single_write(queries, 'Profile')
+
+
+def test_update_profile_writes_once(client, headers, db, user):
+    from app import crud, schemas
+    crud.create_profile(db, user.user_id, schemas.ProfileBase(**PROFILE))
+
+    with sql_instrumentation.query_budget(2) as queries:
+        response = client.put('/profile/', json=dict(PROFILE, height=180), headers=headers)
+    assert response.status_code == 200
+    assert response.json()['height'] == 180
+    assert_single_write(queries, 'Profile')
+
+
+def test_create_health_record_writes_once(client, headers):
+    # The rollups of the day, week and month are locked and rewritten in the same transaction
+    with sql_instrumentation.query_budget(8) as queries:
+        response = client.post('/health-records/', json={'weight': 70}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['weight'] == 70
+    assert_single_write(queries, 'HealthRecord')
+
+
+def test_update_meal_blood_glucose_writes_once(client, headers, db, user):
+    from app import crud
+    meal = crud.create_meal(db, user.user_id, 'meal.jpg')
+
+    with sql_instrumentation.query_budget(4) as queries:
+        response = client.put('/meals/{}/blood-glucose/'.format(meal.meal_id), json={'blood_glucose': 5.5}, headers=headers)
+    assert response.status_code == 200
+    assert_single_write(queries, 'Meal')
+
+
+# Statements include the lookup of the notified user by the push notification background task
+def test_create_clinician_assignment_writes_once(client, headers, clinician):
+    with sql_instrumentation.query_budget(7) as queries:
+        response = client.post('/users/clinicians/', json={'clinician_id': clinician.user_id}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()['clinician']['user_id'] == clinician.user_id
+    assert_single_write(queries, 'ClinicianAssignment')
+
+
+@pytest.mark.parametrize('action, accepted', [
+    ('accept', True),
+    ('decline', False),
+])
+def test_update_clinician_assignment_writes_once(client, clinician_headers, db, user, clinician, action, accepted):
+    from app import crud
+    assignment = crud.create_clinician_assignment(db, clinician.user_id, user.user_id)
+
+    with sql_instrumentation.query_budget(5) as queries:
+        response = client.get('/clinician/assignments/{}/{}'.format(assignment.clinician_assignment_id, action), headers=clinician_headers)
+    assert response.status_code == 200
+    assert response.json()['assignment_accepted'] == accepted
+    assert_single_write(queries, 'ClinicianAssignment')